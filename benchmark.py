@@ -0,0 +1,332 @@
+"""
+Benchmark Module
+Offline CPU benchmark of the training pipeline on a synthetic dataset, compared against a stored baseline
+"""
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# =============================================================================
+# BENCHMARK CONFIGURATION
+# =============================================================================
+
+BENCH_DIR = "runs/benchmark"                # ผลลัพธ์ทุกครั้ง + dataset สังเคราะห์
+BASELINE_FILE = "runs/benchmark/baseline.json"
+BENCH_MODEL = "yolo11n.yaml"                # สร้างจาก yaml - ไม่ต้องดาวน์โหลด weights
+BENCH_IMGSZ = 160                           # imgsz เล็ก ๆ ให้รันบน CPU ได้เร็ว
+BENCH_BATCH = 8
+BENCH_WORKERS = 2
+BENCH_EPOCHS = 2                            # epoch แรกเป็น warm-up, วัดจาก epoch สุดท้าย
+TRAIN_IMAGES = 64                           # จำนวนภาพสังเคราะห์ (train / val)
+VAL_IMAGES = 16
+SYNTH_SIZE = (640, 480)                     # ขนาดภาพสังเคราะห์ (w, h)
+REPEATS = 3                                 # stage ที่ถูก ๆ วัดซ้ำแล้วเอาค่าต่ำสุด
+THRESHOLD = 0.15                            # ช้าลงเกินสัดส่วนนี้ = regression
+STAGE_THRESHOLDS = {"cold_start": 0.25, "validate": 0.25}  # threshold เฉพาะ stage (stage ที่ noisy)
+MIN_DELTA_S = 0.05                          # ต่างกันน้อยกว่านี้ (วินาที) ไม่นับเป็น regression
+
+# =============================================================================
+
+CLASS_NAMES = ["car", "bus", "truck"]
+
+def make_synthetic_dataset(root: str, n_train: int = TRAIN_IMAGES, n_val: int = VAL_IMAGES,
+                           size: tuple = SYNTH_SIZE, seed: int = 0) -> str:
+    """
+    Write a small YOLO-format dataset of noisy frames with coloured boxes (no-op if it exists)
+
+    Returns:
+        Path to data.yaml
+    """
+    import cv2
+    import numpy as np
+
+    root = Path(root)
+    data_yaml = root / "data.yaml"
+    if data_yaml.exists():
+        return str(data_yaml)
+
+    rng = np.random.default_rng(seed)
+    w, h = size
+    for split, n in (("train", n_train), ("valid", n_val)):
+        (root / split / "images").mkdir(parents=True, exist_ok=True)
+        (root / split / "labels").mkdir(parents=True, exist_ok=True)
+        for i in range(n):
+            img = rng.integers(0, 64, (h, w, 3), dtype=np.uint8)
+            lines = []
+            for _ in range(rng.integers(1, 6)):
+                cls = int(rng.integers(len(CLASS_NAMES)))
+                bw, bh = int(rng.integers(w // 16, w // 3)), int(rng.integers(h // 16, h // 3))
+                x, y = int(rng.integers(0, w - bw)), int(rng.integers(0, h - bh))
+                color = [(0, 0, 255), (0, 255, 0), (255, 0, 0)][cls]
+                cv2.rectangle(img, (x, y), (x + bw, y + bh), color, -1)
+                lines.append(f"{cls} {(x + bw / 2) / w:.6f} {(y + bh / 2) / h:.6f} {bw / w:.6f} {bh / h:.6f}")
+            cv2.imwrite(str(root / split / "images" / f"{i:05d}.jpg"), img)
+            (root / split / "labels" / f"{i:05d}.txt").write_text("\n".join(lines) + "\n")
+
+    data_yaml.write_text(
+        f"path: {root.resolve()}\ntrain: train/images\nval: valid/images\n"
+        f"nc: {len(CLASS_NAMES)}\nnames: {CLASS_NAMES}\n"
+    )
+    return str(data_yaml)
+
+def _best_of(fn, repeats: int = REPEATS) -> float:
+    """Minimum wall time of fn over repeats (least disturbed by other load)"""
+    times = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    return min(times)
+
+def bench_decode(data_yaml: str) -> dict:
+    """Plain decode + resize of the train split, and building the mmap store from it"""
+    import cv2
+    from cache_store import build_store
+    from train import get_split_paths, list_image_files
+
+    img_path = get_split_paths(data_yaml)["train"]
+    files = list_image_files(img_path)
+
+    def decode():
+        for f in files:
+            im = cv2.imread(f)
+            r = BENCH_IMGSZ / max(im.shape[:2])
+            cv2.resize(im, (round(im.shape[1] * r), round(im.shape[0] * r)), interpolation=cv2.INTER_AREA)
+
+    def store():
+        root = tempfile.mkdtemp(dir=BENCH_DIR)
+        try:
+            build_store(img_path, BENCH_IMGSZ, root)
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
+
+    decode_s = _best_of(decode)
+    return {
+        "decode": {"seconds": decode_s, "images_per_s": len(files) / decode_s},
+        "mmap_store": {"seconds": _best_of(store)},
+    }
+
+def bench_dataloader(data_yaml: str) -> dict:
+    """One full pass of the Ultralytics train dataloader (augmentation included)"""
+    from ultralytics.cfg import get_cfg
+    from ultralytics.data import build_dataloader, build_yolo_dataset
+    from ultralytics.data.utils import check_det_dataset
+
+    data = check_det_dataset(data_yaml)
+    cfg = get_cfg(overrides={"imgsz": BENCH_IMGSZ, "cache": False})
+    dataset = build_yolo_dataset(cfg, data["train"], BENCH_BATCH, data, mode="train")
+    loader = build_dataloader(dataset, BENCH_BATCH, BENCH_WORKERS, shuffle=True, pin_memory=False, device="cpu")
+
+    t0 = time.perf_counter()
+    it = iter(loader)
+    next(it)
+    first_s = time.perf_counter() - t0
+    for _ in range(len(loader) - 1):
+        next(it)
+    epoch_s = time.perf_counter() - t0
+    return {"dataloader_epoch": {"seconds": epoch_s, "images_per_s": len(dataset) / epoch_s,
+                                 "first_batch_s": first_s}}
+
+def bench_train(data_yaml: str) -> tuple[dict, str]:
+    """
+    Short CPU training run; times the train loop of the last epoch per iteration
+
+    Returns:
+        Tuple of (stage results, path to last.pt)
+    """
+    from ultralytics import YOLO
+
+    marks = {"batches": [], "epochs": []}
+
+    def on_train_epoch_start(trainer):
+        marks["batches"] = [time.perf_counter()]
+        marks["epoch_t0"] = time.perf_counter()
+
+    def on_train_batch_end(trainer):
+        marks["batches"].append(time.perf_counter())
+
+    def on_train_epoch_end(trainer):
+        marks["epochs"].append(time.perf_counter() - marks["epoch_t0"])
+
+    model = YOLO(BENCH_MODEL)
+    for event, fn in (("on_train_epoch_start", on_train_epoch_start),
+                      ("on_train_batch_end", on_train_batch_end),
+                      ("on_train_epoch_end", on_train_epoch_end)):
+        model.add_callback(event, fn)
+
+    t0 = time.perf_counter()
+    results = model.train(
+        data=data_yaml, epochs=BENCH_EPOCHS, imgsz=BENCH_IMGSZ, batch=BENCH_BATCH, workers=BENCH_WORKERS,
+        device="cpu", amp=False, cache=False, val=False, plots=False, verbose=False, pretrained=False,
+        project=os.path.abspath(BENCH_DIR), name="train", exist_ok=True,
+    )
+    total_s = time.perf_counter() - t0
+    steps = [b - a for a, b in zip(marks["batches"], marks["batches"][1:])]
+    return {
+        "train_step": {"seconds": statistics.median(steps), "iterations": len(steps)},
+        "train_epoch": {"seconds": marks["epochs"][-1], "images_per_s": TRAIN_IMAGES / marks["epochs"][-1]},
+        "train_total": {"seconds": total_s},
+    }, str(Path(results.save_dir) / "weights" / "last.pt")
+
+def bench_validate(model_path: str, dataset_path: str) -> dict:
+    """train.validate_model on the synthetic val split"""
+    from train import validate_model
+
+    t0 = time.perf_counter()
+    validate_model(model_path, dataset_path)
+    return {"validate": {"seconds": time.perf_counter() - t0}}
+
+def bench_checkpoint(model_path: str) -> dict:
+    """torch.save / torch.load of a checkpoint and the catalog's metadata-only read"""
+    import torch
+    from checkpoint_catalog import read_metadata
+
+    ckpt = torch.load(model_path, map_location="cpu", weights_only=False)
+    tmp = Path(BENCH_DIR) / "ckpt_bench.pt"
+    try:
+        save_s = _best_of(lambda: torch.save(ckpt, tmp))
+        load_s = _best_of(lambda: torch.load(tmp, map_location="cpu", weights_only=False))
+        meta_s = _best_of(lambda: read_metadata(str(tmp)))
+        size_mb = tmp.stat().st_size / 2**20
+    finally:
+        tmp.unlink(missing_ok=True)
+    return {
+        "checkpoint_save": {"seconds": save_s, "size_mb": size_mb},
+        "checkpoint_load": {"seconds": load_s},
+        "checkpoint_metadata": {"seconds": meta_s},
+    }
+
+def bench_cold_start() -> dict:
+    """Start main.py in a fresh interpreter, pass the GPU check and menu, and exit (option 4)"""
+    main_py = Path(__file__).resolve().parent / "main.py"
+
+    def run():
+        subprocess.run([sys.executable, str(main_py)], input="4\n", text=True, capture_output=True,
+                       cwd=str(main_py.parent), env={**os.environ, "TERM": os.environ.get("TERM", "dumb")})
+
+    return {"cold_start": {"seconds": _best_of(run)}}
+
+def environment() -> dict:
+    """Versions and hardware the numbers were measured on"""
+    import torch
+    import ultralytics
+
+    return {
+        "host": platform.node(),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "ultralytics": ultralytics.__version__,
+        "cpu_count": os.cpu_count(),
+        "torch_threads": torch.get_num_threads(),
+    }
+
+def run_benchmarks() -> dict:
+    """
+    Run every stage on the synthetic dataset
+
+    Returns:
+        Result dict with 'environment', 'config' and per-stage 'stages'
+    """
+    Path(BENCH_DIR).mkdir(parents=True, exist_ok=True)
+    dataset_path = str(Path(BENCH_DIR) / "dataset")
+    data_yaml = make_synthetic_dataset(dataset_path)
+
+    stages = {}
+    print("⏱️  decode / cache...")
+    stages.update(bench_decode(data_yaml))
+    print("⏱️  dataloader epoch...")
+    stages.update(bench_dataloader(data_yaml))
+    print("⏱️  training steps...")
+    train_stages, last_pt = bench_train(data_yaml)
+    stages.update(train_stages)
+    print("⏱️  validate_model...")
+    stages.update(bench_validate(last_pt, dataset_path))
+    print("⏱️  checkpoint save / load...")
+    stages.update(bench_checkpoint(last_pt))
+    print("⏱️  cold start main.py...")
+    stages.update(bench_cold_start())
+
+    return {
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "environment": environment(),
+        "config": {"model": BENCH_MODEL, "imgsz": BENCH_IMGSZ, "batch": BENCH_BATCH, "workers": BENCH_WORKERS,
+                   "epochs": BENCH_EPOCHS, "train_images": TRAIN_IMAGES, "val_images": VAL_IMAGES},
+        "stages": stages,
+    }
+
+def compare(current: dict, baseline: dict) -> list[dict]:
+    """
+    Compare stage times with a baseline
+
+    Returns:
+        One row per stage with baseline/current seconds, relative change and status
+    """
+    rows = []
+    for stage, result in current["stages"].items():
+        base = baseline["stages"].get(stage)
+        if base is None:
+            rows.append({"stage": stage, "baseline": None, "current": result["seconds"], "change": None, "status": "new"})
+            continue
+        change = result["seconds"] / base["seconds"] - 1 if base["seconds"] else 0.0
+        limit = STAGE_THRESHOLDS.get(stage, THRESHOLD)
+        if abs(result["seconds"] - base["seconds"]) < MIN_DELTA_S:
+            status = "ok"
+        else:
+            status = "regression" if change > limit else "faster" if change < -limit else "ok"
+        rows.append({"stage": stage, "baseline": base["seconds"], "current": result["seconds"],
+                     "change": change, "status": status})
+    return rows
+
+def print_comparison(rows: list[dict], current: dict, baseline: dict):
+    """Print the comparison table (and a warning if the environments differ)"""
+    diff = [k for k in ("cpu_count", "torch", "ultralytics", "python")
+            if current["environment"].get(k) != baseline["environment"].get(k)]
+    if diff:
+        print(f"⚠️  Environment ต่างจาก baseline: {', '.join(diff)}")
+    print(f"\n   {'Stage':<22} {'Baseline':>10} {'Current':>10} {'Change':>8}")
+    for r in rows:
+        base = f"{r['baseline']:.3f}s" if r["baseline"] is not None else "-"
+        change = f"{r['change'] * 100:+.1f}%" if r["change"] is not None else "-"
+        mark = {"regression": "❌", "faster": "🚀", "ok": "✅", "new": "🆕"}[r["status"]]
+        current = f"{r['current']:.3f}s"
+        print(f"   {r['stage']:<22} {base:>10} {current:>10} {change:>8} {mark}")
+
+if __name__ == "__main__":
+    # python benchmark.py            - run and compare against the baseline
+    # python benchmark.py baseline   - run and store the result as the new baseline
+    print("=" * 60)
+    print("       Pipeline Benchmark (CPU, offline)")
+    print("=" * 60)
+
+    result = run_benchmarks()
+    out = Path(BENCH_DIR) / f"bench_{time.strftime('%Y%m%d_%H%M%S')}.json"
+    out.write_text(json.dumps(result, indent=2), encoding="utf-8")
+    print(f"\n📁 ผลลัพธ์: {out}")
+
+    if len(sys.argv) > 1 and sys.argv[1] == "baseline":
+        shutil.copy(out, BASELINE_FILE)
+        print(f"✅ บันทึก baseline: {BASELINE_FILE}")
+        sys.exit(0)
+
+    if not Path(BASELINE_FILE).exists():
+        print(f"⚠️  ยังไม่มี baseline - รัน 'python benchmark.py baseline' เพื่อสร้าง")
+        for stage, r in result["stages"].items():
+            print(f"   {stage:<22} {r['seconds']:.3f}s")
+        sys.exit(0)
+
+    baseline = json.loads(Path(BASELINE_FILE).read_text(encoding="utf-8"))
+    rows = compare(result, baseline)
+    print_comparison(rows, result, baseline)
+    regressions = [r["stage"] for r in rows if r["status"] == "regression"]
+    if regressions:
+        print(f"\n❌ Regression: {', '.join(regressions)}")
+        sys.exit(1)
+    print("\n✅ ไม่มี regression")
@@ -0,0 +1,215 @@
+"""
+Memory-mapped Image Store Module
+Decodes each dataset split once into sharded uint8 arrays at the training imgsz
+"""
+import hashlib
+import json
+import math
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import cv2
+import numpy as np
+from ultralytics.data import YOLODataset
+from ultralytics.models.yolo.detect import DetectionTrainer
+
+from train import list_image_files
+
+# =============================================================================
+# STORE CONFIGURATION
+# =============================================================================
+
+STORE_DIRNAME = ".mmap_cache"   # โฟลเดอร์ cache (อยู่ใน dataset)
+SHARD_SIZE = 256                # จำนวนภาพต่อ shard (640px ≈ 300 MB ต่อ shard)
+STORE_VERSION = 1               # เปลี่ยนเมื่อ format ของ store เปลี่ยน
+
+# =============================================================================
+
+def store_key(im_files: list[str], imgsz: int) -> str:
+    """
+    Hash the split contents (path, size, mtime) and preprocessing settings
+
+    Args:
+        im_files: Image paths of the split
+        imgsz: Target image size
+
+    Returns:
+        Hex digest used as the store directory name
+    """
+    h = hashlib.sha1(f"v{STORE_VERSION}|imgsz={imgsz}|rect=1".encode())
+    for f in im_files:
+        st = os.stat(f)
+        h.update(f"{os.path.abspath(f)}|{st.st_size}|{st.st_mtime_ns}\n".encode())
+    return h.hexdigest()[:16]
+
+def _decode(args: tuple[str, int]):
+    """Decode one image and resize its long side to imgsz (same as Ultralytics rect_mode)"""
+    path, imgsz = args
+    im = cv2.imread(path)
+    if im is None:
+        return None, (0, 0)
+    h0, w0 = im.shape[:2]
+    r = imgsz / max(h0, w0)
+    if r != 1:
+        w, h = min(math.ceil(w0 * r), imgsz), min(math.ceil(h0 * r), imgsz)
+        im = cv2.resize(im, (w, h), interpolation=cv2.INTER_LINEAR)
+    return im, (h0, w0)
+
+def build_store(img_path: str, imgsz: int, store_root: str, workers: int | None = None) -> str:
+    """
+    Decode a split once into memory-mapped shards (no-op if it already exists)
+
+    Args:
+        img_path: Image directory or list file of the split
+        imgsz: Target image size
+        store_root: Directory that holds all stores
+        workers: Decode threads (default: all cores)
+
+    Returns:
+        Path to the store directory
+    """
+    im_files = list_image_files(img_path)
+    if not im_files:
+        raise FileNotFoundError(f"ไม่พบภาพใน {img_path}")
+
+    store_dir = Path(store_root) / store_key(im_files, imgsz)
+    if (store_dir / "manifest.json").exists():
+        return str(store_dir)
+
+    tmp_dir = store_dir.with_name(store_dir.name + ".tmp")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir(parents=True)
+
+    n = len(im_files)
+    num_shards = math.ceil(n / SHARD_SIZE)
+    hw0 = np.zeros((n, 2), dtype=np.int32)
+    hw = np.zeros((n, 2), dtype=np.int32)
+
+    print(f"🗄️  กำลังสร้าง mmap store: {n} ภาพ → {num_shards} shards ({store_dir.name})")
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        for s in range(num_shards):
+            lo, hi = s * SHARD_SIZE, min((s + 1) * SHARD_SIZE, n)
+            shard = np.lib.format.open_memmap(
+                tmp_dir / f"shard_{s:05d}.npy", mode="w+", dtype=np.uint8, shape=(hi - lo, imgsz, imgsz, 3)
+            )
+            for j, (im, shape0) in enumerate(pool.map(_decode, [(f, imgsz) for f in im_files[lo:hi]])):
+                if im is None:
+                    continue  # hw = (0, 0) → dataset falls back to decoding the file itself
+                h, w = im.shape[:2]
+                shard[j, :h, :w] = im if im.ndim == 3 else im[..., None]
+                hw0[lo + j], hw[lo + j] = shape0, (h, w)
+            shard.flush()
+            del shard
+            print(f"   shard {s + 1}/{num_shards} ✅")
+
+    np.save(tmp_dir / "hw0.npy", hw0)
+    np.save(tmp_dir / "hw.npy", hw)
+    manifest = {
+        "version": STORE_VERSION,
+        "imgsz": imgsz,
+        "shard_size": SHARD_SIZE,
+        "num_shards": num_shards,
+        "files": [os.path.abspath(f) for f in im_files],
+    }
+    (tmp_dir / "manifest.json").write_text(json.dumps(manifest), encoding="utf-8")
+
+    # Publish atomically - another process may have finished the same store first
+    try:
+        os.replace(tmp_dir, store_dir)
+    except OSError:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return str(store_dir)
+
+def prepare_stores(data_yaml: str, imgsz: int) -> dict:
+    """
+    Build (or reuse) the store of every split listed in data.yaml
+
+    Args:
+        data_yaml: Path to data.yaml
+        imgsz: Target image size
+
+    Returns:
+        Dict of split name -> store directory
+    """
+    from train import get_split_paths
+
+    stores = {}
+    root = Path(data_yaml).parent / STORE_DIRNAME
+    for split, img_path in get_split_paths(data_yaml).items():
+        stores[split] = build_store(img_path, imgsz, str(root))
+        print(f"✅ {split}: {stores[split]}")
+    return stores
+
+class MemmapStore:
+    """Read-only view over a built store; shards are opened lazily per process"""
+
+    def __init__(self, store_dir: str):
+        self.store_dir = Path(store_dir)
+        manifest = json.loads((self.store_dir / "manifest.json").read_text(encoding="utf-8"))
+        self.shard_size = manifest["shard_size"]
+        self.index = {f: i for i, f in enumerate(manifest["files"])}
+        self.hw0 = np.load(self.store_dir / "hw0.npy")
+        self.hw = np.load(self.store_dir / "hw.npy")
+        self._shards = {}
+
+    def __getstate__(self):
+        # Never pickle mapped pages into dataloader workers - each worker maps the same files
+        state = self.__dict__.copy()
+        state["_shards"] = {}
+        return state
+
+    def get(self, path: str):
+        """Return (image, hw_original, hw_resized) or None if the file is not in the store"""
+        i = self.index.get(os.path.abspath(path))
+        if i is None or not self.hw[i, 0]:
+            return None
+        s, j = divmod(i, self.shard_size)
+        shard = self._shards.get(s)
+        if shard is None:
+            shard = self._shards[s] = np.load(self.store_dir / f"shard_{s:05d}.npy", mmap_mode="r")
+        h, w = self.hw[i]
+        return np.ascontiguousarray(shard[j, :h, :w]), tuple(self.hw0[i]), (int(h), int(w))
+
+class MemmapYOLODataset(YOLODataset):
+    """YOLODataset whose load_image reads from a MemmapStore instead of decoding files"""
+
+    def load_image(self, i, rect_mode=True, **kwargs):
+        hit = self.store.get(self.im_files[i]) if rect_mode and not kwargs.get("resize_short") else None
+        if hit is None:
+            return super().load_image(i, rect_mode, **kwargs)
+        if self.augment:
+            # Keep the mosaic buffer populated without holding the pixels in RAM
+            self.buffer.append(i)
+            if 1 < len(self.buffer) >= self.max_buffer_length:
+                self.buffer.pop(0)
+        return hit
+
+class MemmapDetectionTrainer(DetectionTrainer):
+    """DetectionTrainer that opens (or builds) the store of each split before training"""
+
+    def build_dataset(self, img_path, mode="train", batch=None):
+        dataset = super().build_dataset(img_path, mode=mode, batch=batch)
+        if type(dataset) is not YOLODataset:
+            return dataset
+        root = Path(self.args.data).parent / STORE_DIRNAME
+        dataset.__class__ = MemmapYOLODataset  # same state, store-backed load_image
+        dataset.store = MemmapStore(build_store(img_path, self.args.imgsz, str(root)))
+        return dataset
+
+if __name__ == "__main__":
+    # Build stores standalone
+    import sys
+    from train import IMAGE_SIZE, get_data_yaml
+
+    print("=" * 60)
+    print("       Memory-mapped Image Store")
+    print("=" * 60)
+
+    if len(sys.argv) < 2:
+        print("Usage: python cache_store.py <dataset_path> [imgsz]")
+        sys.exit(1)
+
+    imgsz = int(sys.argv[2]) if len(sys.argv) > 2 else IMAGE_SIZE
+    prepare_stores(get_data_yaml(sys.argv[1]), imgsz)
@@ -0,0 +1,366 @@
+"""
+Channel Pruning Module
+Structured channel pruning of a trained best.pt to FLOPs / latency budgets, then a short fine-tune
+"""
+import copy
+import json
+import math
+import time
+from pathlib import Path
+
+# =============================================================================
+# PRUNING CONFIGURATION
+# =============================================================================
+
+PRUNE_BUDGETS = (0.75, 0.5)     # สัดส่วนของ FLOPs (หรือ latency) เดิมที่ยอมให้เหลือ, 1 budget = 1 model
+BUDGET_METRIC = "flops"         # "flops" = นับ conv FLOPs, "latency" = วัดเวลา forward บน CPU (batch 1)
+IMPORTANCE_BATCHES = 16         # จำนวน batch จาก train split ที่ใช้จัดอันดับ channel (Taylor บน BatchNorm)
+IMPORTANCE_BATCH_SIZE = 8
+ROUND_TO = 8                    # จำนวน channel ที่เหลือปัดขึ้นเป็นพหุคูณของค่านี้ (SIMD บน CPU)
+MIN_CHANNELS = 8                # channel ขั้นต่ำที่เหลือต่อ layer
+LATENCY_RUNS = 20               # จำนวนรอบที่จับเวลาตอนหา budget แบบ latency
+FINETUNE_EPOCHS = 10            # epochs ที่ fine-tune หลังตัด channel
+FINETUNE_LR = 0.002             # lr0 ตอน fine-tune (SGD, ไม่มี warmup)
+REPORT_FILE = "prune_report.json"  # อยู่ใน <run>/pruned/
+
+# =============================================================================
+
+def _conv2d(module):
+    """The nn.Conv2d of an Ultralytics Conv (or the module itself)"""
+    return getattr(module, "conv", module)
+
+def prunable_groups(model) -> list[dict]:
+    """
+    Channels that can be removed without touching another block's interface
+
+    A group is a producer Conv (conv + BN) whose output channels are pruned, optional depthwise Convs that pass
+    them through, and consumers whose input channels follow (at one offset per concatenated copy).
+    Block outputs stay as they are: they meet residual adds, Concat and C2f splits elsewhere in the graph.
+
+    Returns:
+        List of {"producer", "passthrough", "consumers": [(name, offsets)]} with module names in `model`
+    """
+    from torch import nn
+    from ultralytics.nn.modules.block import C3, SPPF, Bottleneck
+    from ultralytics.nn.modules.head import Detect
+
+    groups = []
+    for name, m in model.named_modules():
+        if isinstance(m, Bottleneck) and m.cv2.conv.groups == 1:
+            groups.append({"producer": f"{name}.cv1", "passthrough": [], "consumers": [(f"{name}.cv2", [0])]})
+        elif isinstance(m, SPPF):
+            c = m.cv1.conv.out_channels  # cv2 sees cv1 and its n max-pooled copies, concatenated
+            groups.append({"producer": f"{name}.cv1", "passthrough": [],
+                           "consumers": [(f"{name}.cv2", [c * k for k in range(getattr(m, "n", 3) + 1)])]})
+        elif isinstance(m, C3):
+            c = m.cv1.conv.out_channels  # cv3 input = cat(m(cv1(x)), cv2(x))
+            groups.append({"producer": f"{name}.cv2", "passthrough": [], "consumers": [(f"{name}.cv3", [c])]})
+        elif isinstance(m, Detect):
+            for attr in ("cv2", "cv3", "one2one_cv2", "one2one_cv3"):
+                for i, branch in enumerate(getattr(m, attr, None) or []):
+                    path = f"{name}.{attr}.{i}"
+                    if isinstance(branch[0], nn.Sequential):  # (DWConv, Conv), (DWConv, Conv), Conv2d
+                        groups.append({"producer": f"{path}.0.1", "passthrough": [f"{path}.1.0"],
+                                       "consumers": [(f"{path}.1.1", [0])]})
+                        groups.append({"producer": f"{path}.1.1", "passthrough": [], "consumers": [(f"{path}.2", [0])]})
+                    else:  # Conv, Conv, Conv2d
+                        groups.append({"producer": f"{path}.0", "passthrough": [], "consumers": [(f"{path}.1", [0])]})
+                        groups.append({"producer": f"{path}.1", "passthrough": [], "consumers": [(f"{path}.2", [0])]})
+    return [g for g in groups if hasattr(model.get_submodule(g["producer"]), "bn")]
+
+def channel_importance(model, groups: list[dict], data_yaml: str, imgsz: int, device="cpu",
+                       batches: int = IMPORTANCE_BATCHES) -> dict:
+    """
+    First-order Taylor importance of each producer channel, |γ·∂L/∂γ + β·∂L/∂β| on its BatchNorm,
+    summed over training batches
+
+    Scores are divided by their group mean, so one threshold ranks channels across layers.
+
+    Returns:
+        {producer name: 1-D tensor of scores}
+    """
+    import torch
+    from ultralytics.cfg import get_cfg
+    from ultralytics.data import build_dataloader, build_yolo_dataset
+    from ultralytics.data.utils import check_det_dataset
+
+    data = check_det_dataset(data_yaml)
+    cfg = get_cfg(overrides={"imgsz": imgsz, "cache": False, "data": data_yaml})
+    dataset = build_yolo_dataset(cfg, data["train"], IMPORTANCE_BATCH_SIZE, data, mode="train")
+    loader = build_dataloader(dataset, IMPORTANCE_BATCH_SIZE, workers=0, shuffle=True)
+
+    model = copy.deepcopy(model).to(device).train()
+    model.args = get_cfg(overrides=model.args) if isinstance(model.args, dict) else model.args
+    model.criterion = None
+    for m in model.modules():
+        if isinstance(m, torch.nn.BatchNorm2d):
+            m.eval()  # running stats stay those of the trained model
+    for p in model.parameters():
+        p.requires_grad_(True)
+
+    bns = {g["producer"]: model.get_submodule(g["producer"]).bn for g in groups}
+    scores = {name: torch.zeros(bn.num_features, device=device) for name, bn in bns.items()}
+    for i, batch in enumerate(loader):
+        if i >= batches:
+            break
+        batch = {k: v.to(device) if isinstance(v, torch.Tensor) else v for k, v in batch.items()}
+        batch["img"] = batch["img"].float() / 255
+        model.zero_grad(set_to_none=True)
+        loss, _ = model.loss(batch)
+        loss.sum().backward()
+        for name, bn in bns.items():
+            scores[name] += (bn.weight * bn.weight.grad + bn.bias * bn.bias.grad).detach().abs()
+    return {name: (s / s.mean().clamp_min(1e-12)).cpu() for name, s in scores.items()}
+
+def keep_indices(scores: dict, threshold: float) -> dict:
+    """
+    Channels of each producer above the threshold, count rounded up to ROUND_TO (at least MIN_CHANNELS)
+
+    Returns:
+        {producer name: sorted LongTensor of kept output channels} for the producers that lose channels
+    """
+    keep = {}
+    for name, s in scores.items():
+        n = len(s)
+        k = max(int((s > threshold).sum()), MIN_CHANNELS)
+        k = min(math.ceil(k / ROUND_TO) * ROUND_TO, n)
+        if k < n:
+            keep[name] = s.topk(k).indices.sort().values
+    return keep
+
+def _slice_conv(module, out_idx=None, in_idx=None):
+    """Keep the given output / input channels of a Conv (+BN) or nn.Conv2d in place"""
+    from torch import nn
+
+    conv = _conv2d(module)
+    if out_idx is not None:
+        depthwise = conv.groups > 1 and conv.groups == conv.in_channels == conv.out_channels
+        conv.weight = nn.Parameter(conv.weight.data[out_idx].clone())
+        if conv.bias is not None:
+            conv.bias = nn.Parameter(conv.bias.data[out_idx].clone())
+        conv.out_channels = len(out_idx)
+        if depthwise:
+            conv.in_channels = conv.groups = len(out_idx)
+        bn = getattr(module, "bn", None)
+        if bn is not None:
+            bn.weight = nn.Parameter(bn.weight.data[out_idx].clone())
+            bn.bias = nn.Parameter(bn.bias.data[out_idx].clone())
+            bn.running_mean = bn.running_mean[out_idx].clone()
+            bn.running_var = bn.running_var[out_idx].clone()
+            bn.num_features = len(out_idx)
+    if in_idx is not None:
+        conv.weight = nn.Parameter(conv.weight.data[:, in_idx].clone())
+        conv.in_channels = len(in_idx)
+
+def prune(model, groups: list[dict], keep: dict):
+    """
+    Copy of the model with the pruned channels physically removed (smaller weight tensors, not masks)
+
+    Args:
+        model: Trained DetectionModel (left untouched)
+        groups: prunable_groups(model)
+        keep: keep_indices(...) - kept output channels per producer
+    """
+    import torch
+
+    model = copy.deepcopy(model)
+    for g in groups:
+        idx = keep.get(g["producer"])
+        if idx is None:
+            continue
+        producer = model.get_submodule(g["producer"])
+        removed = torch.ones(_conv2d(producer).out_channels, dtype=torch.bool)
+        removed[idx] = False
+        removed = removed.nonzero().flatten()
+        _slice_conv(producer, out_idx=idx)
+        for name in g["passthrough"]:
+            _slice_conv(model.get_submodule(name), out_idx=idx)
+        for name, offsets in g["consumers"]:
+            consumer = model.get_submodule(name)
+            mask = torch.ones(_conv2d(consumer).in_channels, dtype=torch.bool)
+            for offset in offsets:
+                mask[removed + offset] = False
+            _slice_conv(consumer, in_idx=mask.nonzero().flatten())
+    model.criterion = None
+    return model
+
+def conv_flops(model, imgsz: int) -> float:
+    """GFLOPs of all convolutions for one imgsz×imgsz image (multiply-add = 2)"""
+    import torch
+    from torch import nn
+
+    total = []
+
+    def hook(m, inputs, output):
+        k = m.weight[0].numel()  # in_channels / groups × kh × kw
+        total.append(2 * output.numel() * k)
+
+    handles = [m.register_forward_hook(hook) for m in model.modules() if isinstance(m, nn.Conv2d)]
+    try:
+        p = next(model.parameters())
+        with torch.inference_mode():
+            copy.deepcopy(model).eval()(torch.zeros(1, 3, imgsz, imgsz, device=p.device, dtype=p.dtype))
+    finally:
+        for h in handles:
+            h.remove()
+    return sum(total) / 1e9
+
+def forward_ms(model, imgsz: int, runs: int = LATENCY_RUNS) -> float:
+    """Median CPU forward time (fused, batch 1) in ms"""
+    import numpy as np
+    import torch
+
+    model = copy.deepcopy(model).cpu().float().eval().fuse(verbose=False)
+    im = torch.zeros(1, 3, imgsz, imgsz)
+    times = []
+    with torch.inference_mode():
+        for i in range(runs + 3):
+            t0 = time.perf_counter()
+            model(im)
+            if i >= 3:
+                times.append((time.perf_counter() - t0) * 1000)
+    return float(np.median(times))
+
+def parameter_count(model) -> int:
+    """Number of parameters (pruned shapes included)"""
+    return sum(p.numel() for p in model.parameters())
+
+def fit_budget(model, groups: list[dict], scores: dict, budget: float, imgsz: int, metric: str = BUDGET_METRIC):
+    """
+    Smallest importance threshold whose pruned model meets budget × the original FLOPs / latency
+
+    Returns:
+        (pruned model, keep indices, measured value, original value); the most pruned model if the budget is out of reach
+    """
+    import torch
+
+    measure = conv_flops if metric == "flops" else forward_ms
+    base = measure(model, imgsz)
+    target = budget * base
+    candidates = torch.cat(list(scores.values())).unique().sort().values.tolist()
+
+    lo, hi, best = 0, len(candidates) - 1, None
+    while lo <= hi:
+        mid = (lo + hi) // 2
+        keep = keep_indices(scores, candidates[mid])
+        pruned = prune(model, groups, keep)
+        value = measure(pruned, imgsz)
+        if value <= target:
+            best, hi = (pruned, keep, value), mid - 1
+        else:
+            lo = mid + 1
+    if best is None:
+        keep = keep_indices(scores, candidates[-1])
+        pruned = prune(model, groups, keep)
+        best = (pruned, keep, measure(pruned, imgsz))
+        print(f"⚠️  {metric} budget {budget:.0%} ต่ำกว่าที่ตัดได้ (เหลือ {best[2] / base:.0%}) - ใช้ model ที่ตัดมากที่สุด")
+    return (*best, base)
+
+def pruned_trainer(base=None):
+    """
+    Trainer class that fine-tunes the loaded model as it is
+
+    The default get_model rebuilds the architecture from model.yaml and copies matching weights,
+    which would bring the original channel counts back.
+    """
+    from ultralytics.models.yolo.detect import DetectionTrainer
+
+    class PrunedDetectionTrainer(base or DetectionTrainer):
+        def get_model(self, cfg=None, weights=None, verbose=True):
+            if weights is None:
+                return super().get_model(cfg=cfg, weights=weights, verbose=verbose)
+            model = self.set_model_names_for_load(weights)
+            model.criterion = None
+            for p in model.parameters():
+                p.requires_grad_(True)
+            return model
+
+    return PrunedDetectionTrainer
+
+def prune_and_finetune(weights: str, dataset_path: str, budgets=PRUNE_BUDGETS, metric: str = BUDGET_METRIC,
+                       epochs: int = FINETUNE_EPOCHS) -> list[dict]:
+    """
+    Prune best.pt to every budget, fine-tune each, and compare them with the original
+
+    Args:
+        weights: Path to best.pt
+        dataset_path: Dataset directory (as passed to start_training)
+        budgets: Fractions of the original FLOPs / latency to keep
+        metric: "flops" or "latency"
+        epochs: Fine-tune epochs per budget
+
+    Returns:
+        One row per model: budget, achieved (fraction of the original FLOPs / latency actually reached), path,
+        GFLOPs, parameters, mAP50, mAP50-95 (before / after fine-tune), latency
+    """
+    from ultralytics import YOLO
+    from export import LATENCY_IMAGES, measure_latency
+    from train import get_data_yaml, get_split_paths, list_image_files, validate_model
+
+    weights = Path(weights).resolve()  # fine-tune project must be absolute, else Ultralytics puts it under its runs_dir
+    out_dir = weights.parent.parent / "pruned"
+    out_dir.mkdir(parents=True, exist_ok=True)
+    data_yaml = get_data_yaml(dataset_path)
+    yolo = YOLO(str(weights))
+    model, train_args = yolo.model, yolo.ckpt.get("train_args", {})
+    imgsz = yolo.overrides.get("imgsz", 640)
+    splits = get_split_paths(data_yaml)
+    latency_images = list_image_files(splits.get("val") or splits["train"])[:LATENCY_IMAGES]
+
+    groups = prunable_groups(model)
+    print(f"\n✂️  Channel pruning: {len(groups)} layer ที่ตัดได้, จัดอันดับด้วย {IMPORTANCE_BATCHES} batch จาก train split")
+    scores = channel_importance(model, groups, data_yaml, imgsz)
+
+    def row(budget, achieved, path, m):
+        results = validate_model(str(path), dataset_path)
+        return {"budget": budget, "achieved": round(achieved, 3), "path": str(path),
+                "gflops": round(conv_flops(m, imgsz), 2), "params": parameter_count(m),
+                "map50": round(float(results.box.map50), 4) if results else None,
+                "map50_95": round(float(results.box.map), 4) if results else None,
+                **measure_latency(str(path), latency_images, imgsz)}
+
+    rows = [row(1.0, 1.0, weights, model)]
+    for budget in budgets:
+        pruned, keep, value, base = fit_budget(model, groups, scores, budget, imgsz, metric)
+        tag = f"{metric}{round(budget * 100)}"
+        removed = sum(_conv2d(model.get_submodule(n)).out_channels - len(k) for n, k in keep.items())
+        print(f"\n✂️  {tag}: ตัด {removed} channel ใน {len(keep)} layer → {metric} {value / base:.0%} ของเดิม")
+
+        pruned_path = out_dir / f"{tag}.pt"
+        yolo.model = pruned
+        yolo.save(str(pruned_path))
+        before = validate_model(str(pruned_path), dataset_path)
+
+        print(f"🔧 Fine-tune {epochs} epochs: {tag}")
+        tuned = YOLO(str(pruned_path))
+        results = tuned.train(data=data_yaml, epochs=epochs, imgsz=imgsz, project=str(out_dir), name=tag,
+                              exist_ok=True, optimizer="SGD", lr0=FINETUNE_LR, warmup_epochs=0,
+                              trainer=pruned_trainer(),
+                              **{k: train_args[k] for k in ("batch", "device", "workers") if k in train_args})
+        best = Path(results.save_dir) / "weights" / "best.pt"
+        r = row(budget, value / base, best, pruned)  # above budget when it is out of reach
+        r["map50_95_before_finetune"] = round(float(before.box.map), 4) if before else None
+        rows.append(r)
+    yolo.model = model
+
+    base = rows[0]
+    print(f"\n📊 Pruning report ({metric} budget, CPU batch 1, {imgsz}px):")
+    print(f"   {'Budget':<8} {'Achieved':>8} {'GFLOPs':>8} {'Params':>11} {'mAP50':>7} {'mAP50-95':>9} {'p50 ms':>8} {'Speedup':>8}")
+    for r in rows:
+        r["speedup"] = round(base["p50_ms"] / r["p50_ms"], 2)
+        map50 = f"{r['map50']:.4f}" if r["map50"] is not None else "-"
+        map95 = f"{r['map50_95']:.4f}" if r["map50_95"] is not None else "-"
+        print(f"   {r['budget']:<8.0%} {r['achieved']:>8.0%} {r['gflops']:>8.2f} {r['params']:>11,} {map50:>7} {map95:>9} "
+              f"{r['p50_ms']:>8.2f} {r['speedup']:>7.2f}x")
+    (out_dir / REPORT_FILE).write_text(json.dumps(rows, indent=2), encoding="utf-8")
+    print(f"📄 {out_dir / REPORT_FILE}")
+    return rows
+
+if __name__ == "__main__":
+    # python channel_prune.py <best.pt> <dataset_path> [budget ...]   เช่น 0.75 0.5
+    import sys
+
+    if len(sys.argv) < 3:
+        print("Usage: python channel_prune.py <best.pt> <dataset_path> [budget ...]")
+        sys.exit(1)
+    prune_and_finetune(sys.argv[1], sys.argv[2], tuple(float(b) for b in sys.argv[3:]) or PRUNE_BUDGETS)
@@ -0,0 +1,273 @@
+"""
+Checkpoint Catalog Module
+Indexes every checkpoint under RUNS_DIR in SQLite, reading metadata without loading weights
+"""
+import hashlib
+import json
+import os
+import pickle
+import sqlite3
+import time
+import zipfile
+from pathlib import Path
+
+from ckpt_store import REF_SUFFIX, load_ref
+
+# =============================================================================
+# CATALOG CONFIGURATION
+# =============================================================================
+
+CATALOG_NAME = "catalog.db"   # อยู่ใน RUNS_DIR
+
+# =============================================================================
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS checkpoints (
+    path TEXT PRIMARY KEY,
+    run TEXT NOT NULL,
+    file TEXT NOT NULL,
+    size INTEGER,
+    mtime_ns INTEGER,
+    epoch INTEGER,
+    epochs INTEGER,
+    best_fitness REAL,
+    map50 REAL,
+    map REAL,
+    resumable INTEGER,
+    data TEXT,
+    dataset_hash TEXT,
+    file_hash TEXT,
+    train_args TEXT,
+    indexed_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_ckpt_dataset ON checkpoints (dataset_hash, resumable, mtime_ns);
+CREATE INDEX IF NOT EXISTS idx_ckpt_map ON checkpoints (map);
+"""
+
+class _Stub:
+    """Stand-in for any class referenced by the pickle (modules, tensors, storages)"""
+
+    def __new__(cls, *args, **kwargs):
+        return object.__new__(cls)
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __setstate__(self, state):
+        pass
+
+    def __setitem__(self, key, value):
+        pass
+
+    def append(self, value):
+        pass
+
+    def extend(self, values):
+        pass
+
+class _MetadataUnpickler(pickle.Unpickler):
+    """Unpickles data.pkl with every tensor storage left unread"""
+
+    _SAFE = {("collections", "OrderedDict"), ("builtins", "set"), ("builtins", "frozenset"),
+             ("builtins", "slice"), ("builtins", "complex"), ("pathlib", "PosixPath"),
+             ("pathlib", "WindowsPath"), ("pathlib", "Path")}
+
+    def find_class(self, module, name):
+        if (module, name) in self._SAFE:
+            return super().find_class(module, name)
+        return type(name, (_Stub,), {})
+
+    def persistent_load(self, pid):
+        return None  # storage reference - never loaded
+
+def read_metadata(path: str) -> dict:
+    """
+    Read checkpoint metadata without deserializing the weight tensors
+
+    Args:
+        path: Path to a .pt checkpoint
+
+    Returns:
+        Dict with epoch, best_fitness, train_args, train_metrics and a content hash
+    """
+    try:
+        with zipfile.ZipFile(path) as zf:
+            pkl = next(n for n in zf.namelist() if n.endswith("/data.pkl") or n == "data.pkl")
+            with zf.open(pkl) as f:
+                ckpt = _MetadataUnpickler(f).load()
+            # Content hash from the zip directory (CRC32 + size of every record), no data read
+            h = hashlib.sha1()
+            for info in sorted(zf.infolist(), key=lambda i: i.filename):
+                h.update(f"{info.filename.split('/', 1)[-1]}|{info.CRC}|{info.file_size}\n".encode())
+            file_hash = h.hexdigest()
+    except (zipfile.BadZipFile, StopIteration):
+        # Legacy (non-zip) torch format - full load is the only option
+        import torch
+        ckpt = torch.load(path, map_location="cpu", weights_only=False)
+        file_hash = file_sha1(path)
+
+    def plain(value):
+        return value if isinstance(value, (int, float, str, bool, type(None))) else str(value)
+
+    return {
+        "epoch": ckpt.get("epoch"),
+        "best_fitness": ckpt.get("best_fitness"),
+        "train_args": {k: plain(v) for k, v in (ckpt.get("train_args") or {}).items()},
+        "train_metrics": {k: plain(v) for k, v in (ckpt.get("train_metrics") or {}).items()},
+        "has_optimizer": ckpt.get("optimizer") is not None,
+        "file_hash": file_hash,
+    }
+
+def file_sha1(path: str, chunk: int = 1 << 20) -> str:
+    """SHA1 of a file read in chunks"""
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def dataset_hash(data_yaml: str | None) -> str | None:
+    """
+    Fingerprint of a dataset: data.yaml content plus name and size of every image and label of its splits
+
+    Caches and derived files next to the yaml (labels.cache, *.npy, data_*.yaml) are not part of it,
+    so the hash stays the same before and after a first training run.
+
+    Returns:
+        Hex digest, or None if the dataset is not available
+    """
+    if not data_yaml or not os.path.exists(data_yaml):
+        return None
+    from label_index import img2label_path
+    from train import get_split_paths, list_image_files
+
+    try:
+        splits = get_split_paths(data_yaml)
+    except Exception:  # images missing (check_det_dataset would try to download them)
+        return None
+    root = Path(data_yaml).parent
+    h = hashlib.sha1(Path(data_yaml).read_bytes())
+    for split in sorted(splits):
+        h.update(f"[{split}]\n".encode())
+        for im in list_image_files(splits[split]):
+            label = img2label_path(im)
+            size = os.path.getsize(label) if os.path.exists(label) else -1
+            h.update(f"{os.path.relpath(im, root)}|{os.path.getsize(im)}|{size}\n".encode())
+    return h.hexdigest()[:16]
+
+def connect(runs_dir: str) -> sqlite3.Connection:
+    """Open (and create) the catalog of a runs directory"""
+    Path(runs_dir).mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(Path(runs_dir) / CATALOG_NAME), timeout=30)
+    conn.executescript(SCHEMA)
+    return conn
+
+def refresh(runs_dir: str, weights_dir: str = "weights") -> sqlite3.Connection:
+    """
+    Incrementally update the catalog: only new or changed files (size/mtime) are read
+
+    Args:
+        runs_dir: Directory that holds the runs (e.g. runs/detect)
+        weights_dir: Weights sub-directory of each run
+
+    Returns:
+        Open connection to the catalog
+    """
+    conn = connect(runs_dir)
+    known = {row[0]: (row[1], row[2]) for row in conn.execute("SELECT path, size, mtime_ns FROM checkpoints")}
+    seen, dataset_hashes, updated = set(), {}, 0
+
+    with os.scandir(runs_dir) as runs:
+        run_entries = [r for r in runs if r.is_dir()]
+    for run in run_entries:
+        wdir = os.path.join(run.path, weights_dir)
+        if not os.path.isdir(wdir):
+            continue
+        with os.scandir(wdir) as files:
+            for entry in files:
+                is_ref = entry.name.endswith(REF_SUFFIX)
+                if not (entry.name.endswith(".pt") or is_ref) or not entry.is_file():
+                    continue
+                st = entry.stat()
+                path = os.path.abspath(entry.path)
+                seen.add(path)
+                # Manifests record the logical size, so only their mtime tells whether they changed
+                if path in known and known[path][1] == st.st_mtime_ns and (is_ref or known[path][0] == st.st_size):
+                    continue
+                try:
+                    # Snapshots moved into the checkpoint store carry their metadata in the manifest
+                    ref = load_ref(path) if is_ref else None
+                    meta = ref["meta"] if is_ref else read_metadata(path)
+                except Exception as e:
+                    print(f"⚠️  อ่าน metadata ไม่ได้: {path} ({e})")
+                    continue
+
+                args = meta["train_args"]
+                # Prefer the hash recorded at training time (plan.json), else hash the dataset now
+                plan_path = os.path.join(run.path, "plan.json")
+                data_hash = None
+                if os.path.exists(plan_path):
+                    data_hash = json.loads(Path(plan_path).read_text(encoding="utf-8")).get("dataset_hash")
+                if data_hash is None:
+                    data = args.get("data")
+                    if data not in dataset_hashes:
+                        dataset_hashes[data] = dataset_hash(data)
+                    data_hash = dataset_hashes[data]
+
+                epoch, epochs = meta["epoch"], args.get("epochs")
+                resumable = int(epoch is not None and epoch >= 0 and meta["has_optimizer"]
+                                and (epochs is None or epoch + 1 < epochs))
+                metrics = meta["train_metrics"]
+                conn.execute(
+                    "INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (path, run.name, entry.name, ref["size"] if is_ref else st.st_size, st.st_mtime_ns, epoch, epochs,
+                     meta["best_fitness"], metrics.get("metrics/mAP50(B)"), metrics.get("metrics/mAP50-95(B)"),
+                     resumable, args.get("data"), data_hash, meta["file_hash"], json.dumps(args), time.time()),
+                )
+                updated += 1
+
+    stale = [p for p in known if p not in seen]
+    conn.executemany("DELETE FROM checkpoints WHERE path = ?", [(p,) for p in stale])
+    conn.commit()
+    if updated or stale:
+        print(f"🗂️  Catalog: อัปเดต {updated}, ลบ {len(stale)} checkpoint")
+    return conn
+
+def _rows(conn: sqlite3.Connection, sql: str, args: tuple = ()) -> list[dict]:
+    cur = conn.execute(sql, args)
+    cols = [c[0] for c in cur.description]
+    return [dict(zip(cols, row)) for row in cur.fetchall()]
+
+def latest_resumable(conn: sqlite3.Connection, data_hash: str | None = None) -> dict | None:
+    """Most recent last.pt that can still be resumed (optionally for one dataset)"""
+    sql = "SELECT * FROM checkpoints WHERE resumable = 1 AND file = 'last.pt'"
+    args = ()
+    if data_hash:
+        sql, args = sql + " AND dataset_hash = ?", (data_hash,)
+    rows = _rows(conn, sql + " ORDER BY mtime_ns DESC LIMIT 1", args)
+    return rows[0] if rows else None
+
+def best_checkpoint(conn: sqlite3.Connection, data_hash: str | None = None) -> dict | None:
+    """Checkpoint with the highest mAP50-95 across all runs (optionally for one dataset)"""
+    sql = "SELECT * FROM checkpoints WHERE map IS NOT NULL"
+    args = ()
+    if data_hash:
+        sql, args = sql + " AND dataset_hash = ?", (data_hash,)
+    rows = _rows(conn, sql + " ORDER BY map DESC, mtime_ns DESC LIMIT 1", args)
+    return rows[0] if rows else None
+
+def all_checkpoints(conn: sqlite3.Connection) -> list[dict]:
+    """Every catalogued checkpoint, newest first"""
+    return _rows(conn, "SELECT * FROM checkpoints ORDER BY mtime_ns DESC")
+
+if __name__ == "__main__":
+    # Print the catalog
+    from resume import RUNS_DIR, WEIGHTS_DIR
+
+    conn = refresh(RUNS_DIR, WEIGHTS_DIR)
+    for row in all_checkpoints(conn):
+        print(f"   {row['run']:<24} {row['file']:<12} epoch={row['epoch']:<4} "
+              f"mAP50-95={row['map'] or 0:.4f} resumable={bool(row['resumable'])} data={row['dataset_hash']}")
+    best = best_checkpoint(conn)
+    if best:
+        print(f"\n🏆 Best: {best['path']} (mAP50-95 {best['map']:.4f})")
@@ -0,0 +1,377 @@
+"""
+Checkpoint Store Module
+Content-addressed, deduplicated storage for checkpoint snapshots (epochN.pt, finished runs)
+"""
+import hashlib
+import json
+import os
+import struct
+import time
+import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+# =============================================================================
+# STORE CONFIGURATION
+# =============================================================================
+
+STORE_DIRNAME = ".ckpt_store"   # อยู่ใน project directory (เช่น runs/detect/.ckpt_store) แชร์ทุก run
+REF_SUFFIX = ".ptref"           # ไฟล์ manifest เล็ก ๆ ที่ใช้แทน .pt ใน weights/
+DELTA = True                    # เก็บ tensor ที่เปลี่ยนน้อยเป็น XOR delta กับ snapshot ก่อนหน้า (lossless)
+MAX_DELTA_CHAIN = 8             # ความยาว delta chain สูงสุดก่อนเก็บเต็ม
+SMALL_MAX = 4096                # record ที่เล็กกว่านี้ (bytes) รวมเป็น object เดียวต่อ checkpoint
+COMPRESS_LEVEL = 1              # zlib level (1 = เร็ว)
+
+# =============================================================================
+
+MAGIC = b"CKS1"
+RAW, ZLIB, XOR_ZLIB = 0, 1, 2
+HEADER = struct.Struct("<4sBB32s")  # magic, encoding, delta depth, base digest
+ALIGNMENT = 64                      # torch aligns storage records to 64 bytes (needed for mmap loads)
+
+def _shuffle(data: bytes) -> bytes:
+    """Group the high and low bytes of 16-bit values (fp16 weights compress far better this way)"""
+    if len(data) % 2:
+        return data
+    import numpy as np
+    return np.frombuffer(data, np.uint8).reshape(-1, 2).T.tobytes()
+
+def _unshuffle(data: bytes) -> bytes:
+    if len(data) % 2:
+        return data
+    import numpy as np
+    return np.frombuffer(data, np.uint8).reshape(2, -1).T.tobytes()
+
+def _xor(a: bytes, b: bytes) -> bytes:
+    import numpy as np
+    return np.bitwise_xor(np.frombuffer(a, np.uint8), np.frombuffer(b, np.uint8)).tobytes()
+
+class CheckpointStore:
+    """
+    Object store keyed by the SHA256 of the uncompressed record
+
+    Each object is raw, zlib-compressed, or an XOR delta against another object.
+    The key does not depend on the encoding, so identical tensors are stored once.
+    """
+
+    def __init__(self, root: str):
+        self.root = Path(root)
+        (self.root / "objects").mkdir(parents=True, exist_ok=True)
+
+    def _path(self, digest: str) -> Path:
+        return self.root / "objects" / digest[:2] / digest[2:]
+
+    def has(self, digest: str) -> bool:
+        return self._path(digest).exists()
+
+    def header(self, digest: str) -> tuple[int, int, str | None]:
+        """Return (encoding, delta depth, base digest or None) of an object"""
+        with open(self._path(digest), "rb") as f:
+            magic, enc, depth, base = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError(f"ไม่ใช่ object ของ checkpoint store: {digest}")
+        return enc, depth, base.hex() if enc == XOR_ZLIB else None
+
+    def object_size(self, digest: str) -> int:
+        return self._path(digest).stat().st_size
+
+    def get(self, digest: str) -> bytes:
+        """Decode an object (following its delta chain)"""
+        return self._decode(self._path(digest).read_bytes())
+
+    def _decode(self, raw: bytes) -> bytes:
+        _, enc, _, base = HEADER.unpack_from(raw)
+        payload = raw[HEADER.size:]
+        if enc == RAW:
+            return payload
+        data = _unshuffle(zlib.decompress(payload))
+        return _xor(data, self.get(base.hex())) if enc == XOR_ZLIB else data
+
+    def put(self, data: bytes, base: str | None = None) -> tuple[str, int]:
+        """
+        Store a record unless it already exists
+
+        Args:
+            data: Record bytes
+            base: Digest of the same record in an earlier snapshot (delta candidate)
+
+        Returns:
+            Tuple of (digest, bytes written - 0 when deduplicated)
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        if self.has(digest):
+            return digest, 0
+
+        packed = zlib.compress(_shuffle(data), COMPRESS_LEVEL)
+        best = (ZLIB, 0, b"", packed) if len(packed) < len(data) * 0.97 else (RAW, 0, b"", data)
+        if DELTA and base and base != digest and self.has(base):
+            _, depth, _ = self.header(base)
+            base_data = self.get(base)
+            if depth < MAX_DELTA_CHAIN and len(base_data) == len(data):
+                delta = zlib.compress(_shuffle(_xor(data, base_data)), COMPRESS_LEVEL)
+                if len(delta) < len(best[3]):
+                    best = (XOR_ZLIB, depth + 1, bytes.fromhex(base), delta)
+
+        enc, depth, base_bytes, payload = best
+        path = self._path(digest)
+        path.parent.mkdir(exist_ok=True)
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        with open(tmp, "wb") as f:
+            f.write(HEADER.pack(MAGIC, enc, depth, base_bytes.ljust(32, b"\0")))
+            f.write(payload)
+        if hashlib.sha256(self._decode(tmp.read_bytes())).hexdigest() != digest:
+            tmp.unlink()
+            raise IOError(f"ตรวจสอบ object ไม่ผ่าน: {digest}")
+        os.replace(tmp, path)
+        return digest, HEADER.size + len(payload)
+
+    def closure(self, digest: str) -> list[str]:
+        """Digest plus every base it depends on"""
+        chain = [digest]
+        while True:
+            _, _, base = self.header(chain[-1])
+            if base is None:
+                return chain
+            chain.append(base)
+
+    def iter_objects(self):
+        """Yield (digest, path) of every stored object"""
+        for sub in (self.root / "objects").iterdir():
+            for path in sub.iterdir():
+                if not path.name.endswith(".tmp"):
+                    yield sub.name + path.name, path
+
+def store_for(path: str) -> CheckpointStore:
+    """Store shared by all runs of the project that <project>/<run>/weights/<file> belongs to"""
+    return CheckpointStore(str(Path(path).resolve().parent.parent.parent / STORE_DIRNAME))
+
+def load_ref(ref_path: str) -> dict:
+    """Load a .ptref manifest"""
+    return json.loads(Path(ref_path).read_text(encoding="utf-8"))
+
+def _object_refs(manifest: dict) -> list[str]:
+    """Digests a manifest refers to directly"""
+    return [manifest["pack"]] + [e["hash"] for e in manifest["entries"] if "hash" in e]
+
+def _previous_ref(weights_dir: Path, epoch) -> dict | None:
+    """Newest manifest in the same run older than epoch (delta base)"""
+    best = None
+    for ref in weights_dir.glob(f"*{REF_SUFFIX}"):
+        manifest = load_ref(str(ref))
+        e = manifest["meta"].get("epoch")
+        if e is None or e < 0 or (epoch is not None and epoch >= 0 and e >= epoch):
+            continue
+        if best is None or e > best["meta"]["epoch"]:
+            best = manifest
+    return best
+
+def ingest(pt_path: str, remove: bool = True) -> str:
+    """
+    Move a checkpoint into the store and leave a .ptref manifest in its place
+
+    Args:
+        pt_path: Path to a torch zip checkpoint
+        remove: Delete the original .pt once the manifest is written
+
+    Returns:
+        Path of the .ptref manifest
+    """
+    from checkpoint_catalog import read_metadata
+
+    pt = Path(pt_path)
+    store = store_for(pt_path)
+    meta = read_metadata(str(pt))
+    previous = _previous_ref(pt.parent, meta.get("epoch"))
+    bases = {e["name"]: e["hash"] for e in previous["entries"] if "hash" in e} if previous else {}
+
+    # Large records (tensor storages) become one object each; small ones are packed together
+    entries, small, prefix, written = [], [], None, 0
+    with zipfile.ZipFile(pt) as zf:
+        for info in zf.infolist():
+            prefix, name = info.filename.split("/", 1)
+            data = zf.read(info)
+            if len(data) <= SMALL_MAX:
+                entries.append({"name": name, "size": len(data), "offset": sum(map(len, small))})
+                small.append(data)
+                continue
+            digest, n = store.put(data, bases.get(name))
+            written += n
+            entries.append({"name": name, "size": len(data), "hash": digest})
+    pack, n = store.put(b"".join(small), previous.get("pack") if previous else None)
+    written += n
+
+    manifest = {
+        "version": 1,
+        "source": pt.name,
+        "prefix": prefix,
+        "size": pt.stat().st_size,
+        "created": time.time(),
+        "meta": meta,
+        "pack": pack,
+        "entries": entries,
+    }
+    ref = pt.with_name(pt.stem + REF_SUFFIX)
+    tmp = ref.with_name(ref.name + ".tmp")
+    tmp.write_text(json.dumps(manifest), encoding="utf-8")
+    os.replace(tmp, ref)
+    if remove:
+        pt.unlink()
+    print(f"🧊 {pt.name} → store: {manifest['size'] / 2**20:.1f} MB, เขียนจริง {written / 2**20:.2f} MB")
+    return str(ref)
+
+def materialize(ref_path: str, out_path: str | None = None) -> str:
+    """
+    Rebuild a regular .pt (loadable by torch.load / YOLO) from a manifest
+
+    Returns:
+        Path of the rebuilt checkpoint (next to the manifest unless out_path is given)
+    """
+    manifest = load_ref(ref_path)
+    store = store_for(ref_path)
+    out = Path(out_path) if out_path else Path(ref_path).with_suffix(".pt")
+    pack = store.get(manifest["pack"])
+    tmp = out.with_name(out.name + ".tmp")
+    with open(tmp, "wb") as f, zipfile.ZipFile(f, "w", zipfile.ZIP_STORED) as zf:
+        for entry in manifest["entries"]:
+            if "hash" in entry:
+                data = store.get(entry["hash"])
+            else:
+                data = pack[entry["offset"]:entry["offset"] + entry["size"]]
+            info = zipfile.ZipInfo(f"{manifest['prefix']}/{entry['name']}", date_time=(1980, 1, 1, 0, 0, 0))
+            # Pad the local header so the record starts on an aligned offset, like torch.save
+            fixed = f.tell() + 30 + len(info.filename) + 4
+            pad = -fixed % ALIGNMENT
+            info.extra = struct.pack("<HH", 0x4246, pad) + b"Z" * pad
+            zf.writestr(info, data)
+    os.replace(tmp, out)
+    return str(out)
+
+def resolve_checkpoint(path: str) -> str:
+    """Return a loadable .pt path, rebuilding it first if path is a manifest"""
+    if str(path).endswith(REF_SUFFIX):
+        print(f"🧊 สร้าง {Path(path).stem}.pt จาก checkpoint store...")
+        return materialize(path)
+    return str(path)
+
+def compact_run(run_dir: str, files: tuple = ()) -> int:
+    """
+    Ingest the epochN.pt snapshots of a run (plus any extra file names, e.g. "last.pt")
+
+    Returns:
+        Number of checkpoints moved into the store
+    """
+    wdir = Path(run_dir) / "weights"
+    if not wdir.is_dir():
+        return 0
+    snapshots = [p for p in wdir.glob("epoch*.pt") if p.stem[5:].isdigit()]
+    snapshots.sort(key=lambda p: int(p.stem[5:]))  # oldest first, so each one deltas against the previous
+    snapshots += [wdir / name for name in files if (wdir / name).exists()]
+    count = 0
+    for pt in snapshots:
+        try:
+            ingest(str(pt))
+            count += 1
+        except (zipfile.BadZipFile, OSError, ValueError) as e:
+            print(f"⚠️  ข้าม {pt}: {e}")
+    return count
+
+def attach_store(model, synced: bool = False):
+    """
+    Move every save_period snapshot into the store in the background while training runs
+
+    Args:
+        model: YOLO model about to train
+        synced: The run directory is mirrored by run_sync (SYNC_DIR). The store lives outside
+            the run, so its manifests could not be restored from the mirror - keep plain .pt files
+    """
+    if synced:
+        print("ℹ️  SYNC_DIR ถูกตั้งไว้ - เก็บ epochN.pt เป็นไฟล์ปกติ (store อยู่นอก run directory จึงไม่ถูก sync)")
+        return
+    pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ckpt-store")
+
+    def on_model_save(trainer):
+        snapshot = Path(trainer.wdir) / f"epoch{trainer.epoch}.pt"
+        if snapshot.exists():
+            pool.submit(ingest, str(snapshot))
+
+    def on_train_end(trainer):
+        pool.shutdown(wait=True)
+
+    model.add_callback("on_model_save", on_model_save)
+    model.add_callback("on_train_end", on_train_end)
+
+def disk_usage(paths: list[str]) -> dict:
+    """
+    Bytes on disk per checkpoint
+
+    Plain .pt files count their file size. A store object counts toward every manifest that
+    uses it (directly or as a delta base), split evenly, so the values add up to the store size.
+    """
+    usage, refs = {}, {}
+    for path in paths:
+        if str(path).endswith(REF_SUFFIX):
+            refs[path] = load_ref(path)
+        else:
+            usage[path] = os.path.getsize(path) if os.path.exists(path) else 0
+
+    closures, counts, stores = {}, {}, {}
+    for path, manifest in refs.items():
+        store = stores.setdefault(store_for(path).root, store_for(path))
+        objs = set()
+        for digest in _object_refs(manifest):
+            if store.has(digest):
+                objs.update(store.closure(digest))
+        closures[path] = (store, objs)
+        for digest in objs:
+            counts[(store.root, digest)] = counts.get((store.root, digest), 0) + 1
+
+    sizes = {}
+    for path, (store, objs) in closures.items():
+        total = os.path.getsize(path)
+        for digest in objs:
+            if (store.root, digest) not in sizes:
+                sizes[(store.root, digest)] = store.object_size(digest)
+            total += sizes[(store.root, digest)] / counts[(store.root, digest)]
+        usage[path] = int(total)
+    return usage
+
+def collect_garbage(project_dir: str) -> int:
+    """
+    Delete store objects no manifest in the project refers to
+
+    Returns:
+        Bytes freed
+    """
+    store = CheckpointStore(str(Path(project_dir) / STORE_DIRNAME))
+    live = set()
+    for ref in Path(project_dir).glob(f"*/weights/*{REF_SUFFIX}"):
+        for digest in _object_refs(load_ref(str(ref))):
+            if store.has(digest):
+                live.update(store.closure(digest))
+    freed = 0
+    for digest, path in list(store.iter_objects()):
+        if digest not in live:
+            freed += path.stat().st_size
+            path.unlink()
+    return freed
+
+if __name__ == "__main__":
+    # python ckpt_store.py compact|gc [project_dir] | materialize <file.ptref>
+    import sys
+
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+    if command in ("compact", "gc"):
+        from resume import RUNS_DIR
+
+        project = sys.argv[2] if len(sys.argv) > 2 else RUNS_DIR
+        if command == "compact":
+            runs = [p for p in Path(project).iterdir() if p.is_dir() and not p.name.startswith(".")]
+            print(f"✅ ย้าย {sum(compact_run(str(r)) for r in runs)} checkpoint เข้า store")
+        else:
+            print(f"🧹 คืนพื้นที่ {collect_garbage(project) / 2**20:.1f} MB")
+    elif command == "materialize" and len(sys.argv) > 2:
+        print(materialize(sys.argv[2]))
+    else:
+        print("Usage: python ckpt_store.py compact|gc [project_dir] | materialize <file.ptref>")
+        sys.exit(1)
@@ -0,0 +1,240 @@
+"""
+Coreset Module
+Picks a representative fraction of the train split for quick directional runs, and tracks
+how well subset mAP follows full-data mAP
+
+Selection: classes are visited rarest first and each gets its share of images (stratified on
+the label index); within a class, and for the remaining budget, images are chosen by
+farthest-point sampling on the perceptual hashes from dedup.py so the subset spreads across
+the visual variety of the split instead of clustering on near-identical frames.
+"""
+import csv
+import hashlib
+import json
+import math
+import os
+from pathlib import Path
+
+import numpy as np
+
+# =============================================================================
+# CORESET CONFIGURATION
+# =============================================================================
+
+CORESET_DIRNAME = ".coreset"    # โฟลเดอร์เก็บรายการภาพของ subset (อยู่ใน dataset)
+CORESET_SEED = 0
+METRIC = "metrics/mAP50-95(B)"  # คอลัมน์ใน results.csv ที่ใช้เทียบ subset กับ full
+TRUST_GAP = 0.05                # |mAP subset - full| เฉลี่ยไม่เกินเท่านี้ และ
+TRUST_SPEARMAN = 0.8            # ลำดับ config ตรงกัน (Spearman) อย่างน้อยเท่านี้ = เชื่อ subset ได้
+
+# =============================================================================
+
+def train_key(data_yaml: str) -> str:
+    """
+    Version of the train split: path, size and mtime of every image and label
+
+    Returns:
+        Hex digest - the coreset cache key, also stored in each run's plan
+    """
+    from label_index import img2label_path
+    from train import get_split_paths, list_image_files
+
+    h = hashlib.sha1()
+    for f in list_image_files(get_split_paths(data_yaml)["train"]):
+        for p in (f, img2label_path(f)):
+            try:
+                st = os.stat(p)
+                h.update(f"{os.path.abspath(p)}|{st.st_size}|{st.st_mtime_ns}\n".encode())
+            except OSError:
+                h.update(f"{os.path.abspath(p)}|-\n".encode())
+    return h.hexdigest()[:16]
+
+def _farthest_points(h64: np.ndarray, mind: np.ndarray, candidates: np.ndarray, k: int,
+                     rng: np.random.Generator) -> list[int]:
+    """
+    Greedy farthest-point sampling in Hamming space
+
+    Args:
+        h64: (n, 2) uint64 hashes (image, mirrored)
+        mind: (n,) distance of every image to the current selection - updated in place
+        candidates: Bool mask of images that may be picked
+        k: Number of picks
+
+    Returns:
+        Picked indices
+    """
+    from dedup import _popcount
+
+    picks = []
+    cand = candidates.copy()
+    for _ in range(min(k, int(cand.sum()))):
+        idx = np.flatnonzero(cand)
+        far = idx[mind[idx] == mind[idx].max()]
+        p = int(rng.choice(far))
+        picks.append(p)
+        cand[p] = False
+        d = np.minimum(_popcount(h64[:, 0] ^ h64[p, 0]), _popcount(h64[:, 0] ^ h64[p, 1]))
+        np.minimum(mind, d, out=mind)
+    return picks
+
+def select_coreset(data_yaml: str, fraction: float, seed: int = CORESET_SEED) -> tuple[list[str], dict]:
+    """
+    Choose the subset
+
+    Args:
+        data_yaml: data.yaml whose train split is sampled
+        fraction: Share of train images to keep (0-1)
+
+    Returns:
+        (selected image paths in split order, per-class stats {class: [full images, subset images]})
+    """
+    from dedup import DEDUP_DIRNAME, compute_hashes
+    from label_index import build_dataset_index
+    from train import get_split_paths, list_image_files
+
+    files = list_image_files(get_split_paths(data_yaml)["train"])
+    index = build_dataset_index(data_yaml)["train"]
+    hashes, valid = compute_hashes(files, str(Path(data_yaml).parent / DEDUP_DIRNAME / "train.npz"))
+    h64 = np.ascontiguousarray(hashes).view(np.uint64)[..., 0]
+
+    n = len(files)
+    nc = int(index.classes.max()) + 1 if len(index.classes) else 0
+    image_of_box = np.repeat(np.arange(n), index.boxes_per_image())
+    presence = np.zeros((n, nc), dtype=bool)
+    presence[image_of_box, index.classes] = True
+
+    budget = max(1, round(fraction * n))
+    rng = np.random.default_rng(seed)
+    selected = np.zeros(n, dtype=bool)
+    mind = np.full(n, 255, dtype=np.uint8)
+
+    # Stratify: rarest class first, each gets ceil(fraction × its images)
+    counts = presence.sum(0)
+    for c in np.argsort(counts, kind="stable"):
+        if not counts[c]:
+            continue
+        need = math.ceil(fraction * counts[c]) - int((selected & presence[:, c]).sum())
+        need = min(need, budget - int(selected.sum()))
+        if need > 0:
+            selected[_farthest_points(h64, mind, presence[:, c] & ~selected & valid, need, rng)] = True
+
+    # Remaining budget (incl. background images): spread over everything not yet chosen
+    rest = budget - int(selected.sum())
+    if rest > 0:
+        selected[_farthest_points(h64, mind, ~selected & valid, rest, rng)] = True
+
+    stats = {int(c): [int(counts[c]), int((presence[:, c] & selected).sum())] for c in range(nc)}
+    return [f for f, s in zip(files, selected) if s], stats
+
+def make_coreset(data_yaml: str, fraction: float, seed: int = CORESET_SEED) -> str:
+    """
+    Subset data.yaml for a fraction of the train split (cached per train split version)
+
+    Args:
+        data_yaml: Source data.yaml
+        fraction: Share of train images, e.g. 0.1 or 0.25
+
+    Returns:
+        Path to data_coreset_<pct>.yaml next to the source yaml
+    """
+    from train import derive_data_yaml
+
+    root = Path(data_yaml).parent
+    pct = f"{fraction * 100:g}"
+    out_dir = root / CORESET_DIRNAME / train_key(data_yaml)
+    list_path = out_dir / f"{pct}_s{seed}.txt"
+    stats_path = out_dir / f"{pct}_s{seed}.json"
+
+    if list_path.exists():
+        print(f"♻️  Coreset {pct}%: ใช้ของเดิม ({list_path})")
+        stats = json.loads(stats_path.read_text(encoding="utf-8"))
+    else:
+        files, per_class = select_coreset(data_yaml, fraction, seed)
+        out_dir.mkdir(parents=True, exist_ok=True)
+        list_path.write_text("\n".join(files) + "\n", encoding="utf-8")
+        stats = {"fraction": fraction, "seed": seed, "images": len(files), "classes": per_class}
+        stats_path.write_text(json.dumps(stats, indent=2), encoding="utf-8")
+        print(f"✂️  Coreset {pct}%: {len(files)} ภาพ → {list_path}")
+
+    for c, (full, sub) in stats["classes"].items():
+        print(f"   [{c}] {sub}/{full} ภาพ ({sub / max(full, 1) * 100:.0f}%)")
+    return derive_data_yaml(data_yaml, str(root / f"data_coreset_{pct}.yaml"), str(list_path))
+
+# =============================================================================
+# Subset vs full-data tracking
+# =============================================================================
+
+def _best_metric(run_dir: Path) -> float | None:
+    path = run_dir / "results.csv"
+    if not path.exists():
+        return None
+    with open(path, encoding="utf-8") as f:
+        values = [float(row[METRIC]) for row in csv.DictReader(f, skipinitialspace=True) if row.get(METRIC)]
+    return max(values) if values else None
+
+def _ranks(x: np.ndarray) -> np.ndarray:
+    r = np.empty(len(x))
+    r[np.argsort(x, kind="stable")] = np.arange(len(x))
+    return r
+
+def tracking_report(runs_dir: str) -> list[dict]:
+    """
+    Compare coreset runs with full-data runs of the same train split and config (model, imgsz, epochs)
+
+    Returns:
+        One row per (train split, fraction): matched configs, mean gap, Spearman rank correlation, trusted
+    """
+    from planner import PLAN_FILENAME
+
+    runs = {}
+    for plan_path in Path(runs_dir).glob(f"*/{PLAN_FILENAME}"):
+        plan = json.loads(plan_path.read_text(encoding="utf-8"))
+        metric = _best_metric(plan_path.parent)
+        if metric is None or not plan.get("train_key"):
+            continue
+        config = (plan.get("model"), plan.get("imgsz"), plan.get("epochs"))
+        runs.setdefault((plan["train_key"], plan.get("coreset")), {})[config] = metric
+
+    rows = []
+    for (key, fraction), subset in runs.items():
+        full = runs.get((key, None), {})
+        matched = sorted(set(subset) & set(full)) if fraction else []
+        if not matched:
+            continue
+        s = np.array([subset[c] for c in matched])
+        f = np.array([full[c] for c in matched])
+        rho = float(np.corrcoef(_ranks(s), _ranks(f))[0, 1]) if len(matched) >= 3 else None
+        gap = float(np.mean(np.abs(s - f)))
+        rows.append({"train_key": key, "fraction": fraction, "configs": len(matched), "mean_gap": round(gap, 4),
+                     "subset_map": round(float(s.mean()), 4), "full_map": round(float(f.mean()), 4),
+                     "spearman": None if rho is None or np.isnan(rho) else round(rho, 3),
+                     "trusted": gap <= TRUST_GAP and rho is not None and rho >= TRUST_SPEARMAN})
+    return rows
+
+def print_tracking(runs_dir: str):
+    rows = tracking_report(runs_dir)
+    if not rows:
+        print("ℹ️  ยังไม่มีคู่ run (coreset + full) ที่ config ตรงกันให้เทียบ")
+        return
+    print(f"\n📈 Coreset vs Full ({METRIC}):")
+    print(f"   {'Fraction':>8} {'Configs':>7} {'Subset':>8} {'Full':>8} {'Gap':>7} {'Spearman':>8}  เชื่อได้?")
+    for r in sorted(rows, key=lambda r: r["fraction"]):
+        rho = "-" if r["spearman"] is None else f"{r['spearman']:.2f}"
+        print(f"   {r['fraction'] * 100:>7g}% {r['configs']:>7} {r['subset_map']:>8.4f} {r['full_map']:>8.4f} "
+              f"{r['mean_gap']:>7.4f} {rho:>8}  {'✅' if r['trusted'] else '❌'}")
+    print(f"\n   เชื่อได้ = gap ≤ {TRUST_GAP} และ Spearman ≥ {TRUST_SPEARMAN} (ต้องมีอย่างน้อย 3 configs)")
+
+if __name__ == "__main__":
+    # python coreset.py <dataset_path> <fraction>   → build the subset data.yaml
+    # python coreset.py track [runs_dir]            → subset vs full mAP report
+    import sys
+    from train import PROJECT_NAME, get_data_yaml
+
+    if len(sys.argv) >= 2 and sys.argv[1] == "track":
+        print_tracking(sys.argv[2] if len(sys.argv) > 2 else PROJECT_NAME)
+    elif len(sys.argv) >= 3:
+        print(f"✅ {make_coreset(get_data_yaml(sys.argv[1]), float(sys.argv[2]))}")
+    else:
+        print("Usage: python coreset.py <dataset_path> <fraction>")
+        print("       python coreset.py track [runs_dir]")
+        sys.exit(1)
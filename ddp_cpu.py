@@ -0,0 +1,311 @@
+"""
+CPU Data-Parallel Training Module
+Runs Ultralytics' DDP training loop on CPU with the gloo backend: N worker processes per host,
+each pinned to its own core set, optionally spanning several hosts
+
+Every worker is a separate Python process started with RANK / LOCAL_RANK / WORLD_SIZE /
+MASTER_ADDR / MASTER_PORT in its environment (Ultralytics reads them at import time). Gradients
+are all-reduced by DistributedDataParallel, the train split is sharded by Ultralytics'
+DistributedSampler, and only rank 0 validates, plots and writes checkpoints.
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import timedelta
+from pathlib import Path
+
+# =============================================================================
+# DDP CONFIGURATION
+# =============================================================================
+
+MASTER_ADDR = "127.0.0.1"       # เครื่อง rank 0 (ต้องเข้าถึงได้จากทุกเครื่องเมื่อใช้หลายเครื่อง)
+MASTER_PORT = 29500
+PIN_CORES = True                # True = แต่ละ worker ใช้เฉพาะชุด core ของตัวเอง
+SCALING_FILE = "ddp_scaling.json"
+SPEC_FILE = "ddp_spec.json"     # spec ของ run (ใน run directory) สำหรับสั่งเครื่องอื่นเข้าร่วม
+
+# =============================================================================
+
+def core_sets(nproc: int) -> list[list[int]]:
+    """Split the cores this process may use into nproc contiguous, equal-sized sets"""
+    cores = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count()))
+    per = max(1, len(cores) // nproc)
+    return [cores[i * per:(i + 1) * per] or cores[-per:] for i in range(nproc)]
+
+def ddp_trainer(base=None):
+    """
+    Trainer class that runs Ultralytics' DDP path on CPU
+
+    Args:
+        base: Trainer class to extend (DetectionTrainer, or e.g. MemmapDetectionTrainer)
+    """
+    import torch.distributed as dist
+    from torch import nn
+    from ultralytics.engine import validator as validator_module
+    from ultralytics.models.yolo.detect import DetectionTrainer
+    from ultralytics.models.yolo.detect import val as detect_val_module
+    from ultralytics.utils import RANK, WORLD_SIZE
+
+    class CPUDDPTrainer(base or DetectionTrainer):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.world_size = WORLD_SIZE  # Ultralytics counts GPUs here, which is 0 on CPU
+            self.ddp = False  # already a worker - never spawn
+
+        def _setup_ddp(self):
+            dist.init_process_group(backend="gloo", timeout=timedelta(hours=3), rank=RANK, world_size=self.world_size)
+
+        def _setup_train(self):
+            # Ultralytics passes device_ids=[device.index], i.e. [None] on CPU, which DDP rejects
+            wrap = nn.parallel.DistributedDataParallel
+            nn.parallel.DistributedDataParallel = lambda module, device_ids=None, **kw: wrap(module, **kw)
+            try:
+                super()._setup_train()
+            finally:
+                nn.parallel.DistributedDataParallel = wrap
+
+        def final_eval(self):
+            # Training is over: leave the group and validate best.pt on rank 0 as a single process
+            # (standalone validation picks a CUDA device and gathers stats whenever RANK != -1)
+            if dist.is_initialized():  # a single worker never joins a group
+                dist.barrier()
+                dist.destroy_process_group()
+            if RANK > 0:
+                return
+            # test_loader was built with rank=LOCAL_RANK, i.e. this worker's shard of the val split
+            val = self.data.get("val") or self.data.get("test")
+            self.validator.dataloader = self.get_dataloader(val, self.test_loader.batch_size, rank=-1, mode="val")
+            modules = (validator_module, detect_val_module)
+            for m in modules:
+                m.RANK = -1
+            try:
+                super().final_eval()
+            finally:
+                for m in modules:
+                    m.RANK = RANK
+
+    return CPUDDPTrainer
+
+def launch(spec: dict, nproc: int, nnodes: int = 1, node_rank: int = 0,
+           master_addr: str = MASTER_ADDR, master_port: int = MASTER_PORT) -> int:
+    """
+    Start this host's workers and wait for them
+
+    Args:
+        spec: Worker spec - "model", "train" (model.train kwargs) and optional "attach" flags
+        nproc: Workers on this host
+        nnodes: Number of hosts (run launch on every host with its own node_rank)
+        node_rank: Index of this host (0 = master)
+
+    Returns:
+        0 if every worker succeeded, else the first non-zero exit code
+    """
+    world = nproc * nnodes
+    batch = spec["train"].get("batch")  # resume keeps the checkpoint's batch
+    if isinstance(batch, int) and batch % world:
+        raise ValueError(f"batch={batch} ต้องหารด้วยจำนวน worker ทั้งหมด ({world}) ลงตัว")
+
+    with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False, encoding="utf-8") as f:
+        json.dump(spec, f)
+    cores = core_sets(nproc)
+    print(f"🧵 DDP (gloo): {nproc} workers × {nnodes} เครื่อง, node {node_rank}, master {master_addr}:{master_port}")
+    procs = []
+    try:
+        for local in range(nproc):
+            env = dict(os.environ, RANK=str(node_rank * nproc + local), LOCAL_RANK=str(local),
+                       WORLD_SIZE=str(world), LOCAL_WORLD_SIZE=str(nproc), MASTER_ADDR=master_addr,
+                       MASTER_PORT=str(master_port), OMP_NUM_THREADS=str(len(cores[local])),
+                       DDP_CORES=",".join(map(str, cores[local])) if PIN_CORES else "")
+            procs.append(subprocess.Popen([sys.executable, os.path.abspath(__file__), "--worker", f.name], env=env))
+
+        # One failed worker leaves the others blocked in a collective - stop them all
+        code = 0
+        while any(p.poll() is None for p in procs):
+            failed = [p.returncode for p in procs if p.returncode not in (None, 0)]
+            if failed:
+                code = failed[0]
+                for p in procs:
+                    if p.poll() is None:
+                        p.terminate()
+                break
+            time.sleep(0.5)
+        for p in procs:
+            p.wait()
+        return code or next((p.returncode for p in procs if p.returncode), 0)
+    except KeyboardInterrupt:
+        for p in procs:
+            p.terminate()
+        raise
+    finally:
+        os.unlink(f.name)
+
+def _worker(spec_path: str):
+    """Entry point of one worker process"""
+    cores = [int(c) for c in os.environ.get("DDP_CORES", "").split(",") if c]
+    if cores and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+
+    import torch
+    import torch.distributed as dist
+    from ultralytics import YOLO
+    from ultralytics.utils import RANK
+
+    torch.set_num_threads(len(cores) or torch.get_num_threads())
+    spec = json.loads(Path(spec_path).read_text(encoding="utf-8"))
+    train_kwargs = dict(spec["train"])
+    base = None
+    if train_kwargs.get("cache") == "mmap":
+        from cache_store import MemmapDetectionTrainer
+        base, train_kwargs["cache"] = MemmapDetectionTrainer, False
+
+    model = YOLO(spec["model"])
+    attach = spec.get("attach", {})
+    sync = {"syncer": None}
+    if attach.get("progressive"):
+        from progressive import attach_progressive
+        attach_progressive(model, *attach["progressive"])  # every rank switches its own loader
+    if attach.get("step"):
+        from step_ckpt import attach_step_checkpoints
+        attach_step_checkpoints(model)  # every rank follows the same sampler position
+    if RANK in {-1, 0}:  # -1 = single worker
+        if attach.get("plan"):
+            from planner import attach_plan
+            attach_plan(model, attach["plan"])
+        if attach.get("instrument"):
+            from instrument import attach_instrumentation
+            attach_instrumentation(model)
+        if attach.get("store"):
+            from ckpt_store import attach_store
+            attach_store(model, synced=bool(attach.get("sync")))
+        if attach.get("sync"):
+            from run_sync import attach_syncer
+            sync = attach_syncer(model, attach["sync"])
+        if attach.get("timing"):
+            _attach_timing(model, attach["timing"])
+    try:
+        model.train(trainer=ddp_trainer(base), device="cpu", **train_kwargs)
+    finally:
+        if dist.is_initialized():
+            dist.destroy_process_group()
+        if sync["syncer"]:
+            sync["syncer"].stop()
+
+def train_ddp(model: str, train: dict, attach: dict, nproc: int, nnodes: int = 1,
+              master_addr: str = MASTER_ADDR, master_port: int = MASTER_PORT) -> Path:
+    """
+    Train with nproc workers on this host as node 0 (the master)
+
+    With nnodes > 1 the spec is written to the run directory and the command that
+    every other host has to run is printed (paths in the spec must exist there too).
+
+    Args:
+        model: Model name/yaml, or the checkpoint to continue when train["resume"] is set
+        train: model.train() kwargs (project and name decide the run directory)
+        attach: Extras - "progressive" and "step" on every rank; "plan", "instrument", "store", "sync" on rank 0
+
+    Returns:
+        Run directory
+    """
+    from ultralytics.utils.files import increment_path
+
+    if train.get("resume"):
+        save_dir = Path(model).resolve().parent.parent
+        train = dict(train)
+    else:
+        # Fix the run directory up front so every host (and the caller) agrees on it
+        save_dir = increment_path(Path(train["project"]) / train["name"], train.get("exist_ok", False))
+        train = dict(train, name=save_dir.name, exist_ok=True)
+    spec = {"model": model, "train": train, "attach": attach}
+
+    if nnodes > 1:
+        save_dir.mkdir(parents=True, exist_ok=True)
+        spec_path = save_dir / SPEC_FILE
+        spec_path.write_text(json.dumps(spec, indent=2), encoding="utf-8")
+        print(f"🌐 รันบนอีก {nnodes - 1} เครื่อง (node_rank 1..{nnodes - 1}):")
+        print(f"   python ddp_cpu.py node {spec_path} {nproc} {nnodes} <node_rank> {master_addr} {master_port}")
+
+    code = launch(spec, nproc, nnodes, 0, master_addr, master_port)
+    if code:
+        raise RuntimeError(f"DDP worker ล้มเหลว (exit code {code})")
+    return save_dir
+
+def _attach_timing(model, out_path: str):
+    """Record train-loop throughput of each epoch (rank 0) for the scaling report"""
+    epochs = []
+
+    def start(trainer):
+        epochs.append({"t0": time.perf_counter()})
+
+    def end(trainer):
+        e = epochs[-1]
+        e["seconds"] = time.perf_counter() - e.pop("t0")
+        e["images"] = len(trainer.train_loader.dataset)
+        Path(out_path).write_text(json.dumps(epochs), encoding="utf-8")
+
+    model.add_callback("on_train_epoch_start", start)
+    model.add_callback("on_train_epoch_end", end)
+
+def scaling_report(data_yaml: str, model: str, imgsz: int, batch: int, workers=(1, 2, 4), epochs: int = 2) -> list[dict]:
+    """
+    Train briefly with 1..N workers on this host and report throughput scaling
+
+    The first epoch includes process start-up and warm-up, so the last epoch is measured.
+
+    Returns:
+        One row per worker count: images/s, speedup and parallel efficiency
+    """
+    from train import PROJECT_NAME
+
+    rows = []
+    out_dir = Path(PROJECT_NAME).resolve() / "ddp_scaling"
+    for n in workers:
+        timing = out_dir / f"timing_{n}.json"
+        spec = {"model": model, "attach": {"timing": str(timing)},
+                "train": {"data": data_yaml, "epochs": epochs, "imgsz": imgsz, "batch": batch, "val": False,
+                          "plots": False, "save": False, "project": str(out_dir), "name": f"w{n}", "exist_ok": True,
+                          "amp": False}}
+        if launch(spec, n, master_port=MASTER_PORT + n) != 0 or not timing.exists():
+            print(f"❌ {n} workers: training ล้มเหลว")
+            continue
+        last = json.loads(timing.read_text(encoding="utf-8"))[-1]
+        rows.append({"workers": n, "images_per_s": round(last["images"] / last["seconds"], 2),
+                     "epoch_s": round(last["seconds"], 2)})
+
+    if rows:
+        base = rows[0]["images_per_s"] / rows[0]["workers"]
+        for r in rows:
+            r["speedup"] = round(r["images_per_s"] / rows[0]["images_per_s"], 2)
+            r["efficiency"] = round(r["images_per_s"] / (base * r["workers"]), 2)
+        out_dir.mkdir(parents=True, exist_ok=True)
+        (out_dir / SCALING_FILE).write_text(json.dumps(rows, indent=2), encoding="utf-8")
+        print(f"\n📊 DDP scaling (batch {batch}, imgsz {imgsz}):")
+        print(f"   {'Workers':>7} {'ภาพ/วินาที':>10} {'Epoch':>8} {'Speedup':>8} {'Efficiency':>10}")
+        for r in rows:
+            print(f"   {r['workers']:>7} {r['images_per_s']:>10} {r['epoch_s']:>7}s {r['speedup']:>7}x "
+                  f"{r['efficiency'] * 100:>9.0f}%")
+        print(f"📁 {out_dir / SCALING_FILE}")
+    return rows
+
+if __name__ == "__main__":
+    # python ddp_cpu.py scaling <dataset_path> [workers ...]
+    # python ddp_cpu.py node <spec.json> <nproc> <nnodes> <node_rank> [master_addr] [master_port]
+    # (internal) python ddp_cpu.py --worker <spec.json>
+    if len(sys.argv) == 3 and sys.argv[1] == "--worker":
+        _worker(sys.argv[2])
+    elif len(sys.argv) >= 6 and sys.argv[1] == "node":
+        spec = json.loads(Path(sys.argv[2]).read_text(encoding="utf-8"))
+        sys.exit(launch(spec, int(sys.argv[3]), int(sys.argv[4]), int(sys.argv[5]),
+                        sys.argv[6] if len(sys.argv) > 6 else MASTER_ADDR,
+                        int(sys.argv[7]) if len(sys.argv) > 7 else MASTER_PORT))
+    elif len(sys.argv) >= 3 and sys.argv[1] == "scaling":
+        from train import BATCH_SIZE, IMAGE_SIZE, MODEL_NAME, get_data_yaml
+        counts = tuple(int(n) for n in sys.argv[3:]) or (1, 2, 4)
+        scaling_report(get_data_yaml(sys.argv[2]), MODEL_NAME, IMAGE_SIZE,
+                       BATCH_SIZE if isinstance(BATCH_SIZE, int) else 16, counts)
+    else:
+        print("Usage: python ddp_cpu.py scaling <dataset_path> [workers ...]")
+        print("       python ddp_cpu.py node <spec.json> <nproc> <nnodes> <node_rank> [master_addr] [master_port]")
+        sys.exit(1)
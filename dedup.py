@@ -0,0 +1,269 @@
+"""
+Near-Duplicate Pruning Module
+Perceptual hashes for every image, vectorized Hamming search for near-duplicate clusters
+and train/val leaks, and a deduplicated train list for start_training
+
+Each image gets a 64-bit DCT hash of itself and of its horizontal mirror (flip copies are
+redundant too - Ultralytics already trains with fliplr). Hashes are cached per split in
+<dataset>/.dedup/<split>.npz and only recomputed for files whose size or mtime changed.
+"""
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+# =============================================================================
+# DEDUP CONFIGURATION
+# =============================================================================
+
+DEDUP_DIRNAME = ".dedup"        # โฟลเดอร์เก็บ hash + รายการภาพ (อยู่ใน dataset)
+DEDUP_YAML = "data_dedup.yaml"  # data.yaml ที่ train ชี้ไปที่รายการภาพหลังตัดซ้ำ
+HAMMING_THRESHOLD = 6           # ต่างกันไม่เกินกี่ bit (จาก 64) ถึงนับว่าซ้ำ
+HASH_WORKERS = None             # จำนวน process (None = ทุก core)
+FILES_PER_TASK = 256            # จำนวนภาพต่อ task ที่ส่งให้ process pool
+BLOCK_ROWS = 1024               # จำนวนแถวต่อ block ตอนเทียบ Hamming (จำกัด memory)
+
+# =============================================================================
+
+HASH_BYTES = 8
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+def _dct_hash(paths: list[str]) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Hash a batch of images (runs in a worker process)
+
+    Returns:
+        (hashes uint8 (n, 2, 8) = [image, mirrored image], valid bool (n,))
+    """
+    import cv2
+
+    # Low-frequency DCT coefficient (u, v) of a horizontally mirrored image = (-1)^v × original
+    mirror = np.where(np.arange(8) % 2, -1, 1).astype(np.float32)[None, :]
+    hashes = np.zeros((len(paths), 2, HASH_BYTES), dtype=np.uint8)
+    valid = np.zeros(len(paths), dtype=bool)
+    for k, path in enumerate(paths):
+        im = cv2.imread(path, cv2.IMREAD_REDUCED_GRAYSCALE_4)  # JPEG decodes at 1/4 scale - much faster
+        if im is None:
+            continue
+        low = cv2.dct(cv2.resize(im, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32))[:8, :8]
+        for m, coef in enumerate((low, low * mirror)):
+            bits = (coef > np.median(coef.ravel()[1:])).ravel()  # median without the DC term
+            hashes[k, m] = np.packbits(bits)
+        valid[k] = True
+    return hashes, valid
+
+def _stat(paths: list[str]) -> np.ndarray:
+    out = np.full((len(paths), 2), -1, dtype=np.int64)
+    for i, p in enumerate(paths):
+        try:
+            st = os.stat(p)
+            out[i] = st.st_size, st.st_mtime_ns
+        except OSError:
+            pass
+    return out
+
+def compute_hashes(files: list[str], cache_path: str, workers: int | None = HASH_WORKERS) -> tuple:
+    """
+    Hashes of every image, reusing the cache for unchanged files
+
+    Args:
+        files: Image paths
+        cache_path: .npz cache of this split
+        workers: Number of processes
+
+    Returns:
+        (hashes uint8 (n, 2, 8), valid bool (n,))
+    """
+    stat = _stat(files)
+    hashes = np.zeros((len(files), 2, HASH_BYTES), dtype=np.uint8)
+    valid = np.zeros(len(files), dtype=bool)
+    todo = np.ones(len(files), dtype=bool)
+
+    if os.path.exists(cache_path):
+        try:
+            with np.load(cache_path) as old:
+                rows = {f: i for i, f in enumerate(old["files"].tolist())}
+                old_stat, old_hashes, old_valid = old["stat"], old["hashes"], old["valid"]
+            for i, f in enumerate(files):
+                j = rows.get(f)
+                if j is not None and (old_stat[j] == stat[i]).all():
+                    hashes[i], valid[i], todo[i] = old_hashes[j], old_valid[j], False
+        except (OSError, KeyError, ValueError):
+            todo[:] = True
+
+    idx = np.flatnonzero(todo)
+    print(f"🔑 Hash: {len(files)} ภาพ, คำนวณใหม่ {len(idx)}, ใช้ของเดิม {len(files) - len(idx)}")
+    if len(idx):
+        tasks = [idx[i:i + FILES_PER_TASK] for i in range(0, len(idx), FILES_PER_TASK)]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for t, (h, v) in zip(tasks, pool.map(_dct_hash, [[files[i] for i in t] for t in tasks])):
+                hashes[t], valid[t] = h, v
+        Path(cache_path).parent.mkdir(parents=True, exist_ok=True)
+        tmp = f"{cache_path}.tmp.npz"
+        np.savez(tmp, files=np.array(files), stat=stat, hashes=hashes, valid=valid)
+        os.replace(tmp, cache_path)
+    return hashes, valid
+
+def _popcount(x: np.ndarray) -> np.ndarray:
+    """Set bits of each uint64"""
+    if hasattr(np, "bitwise_count"):  # numpy >= 2.0
+        return np.bitwise_count(x)
+    return _POPCOUNT[x[..., None].view(np.uint8)].sum(-1, dtype=np.uint8)
+
+def hamming_pairs(a: np.ndarray, b: np.ndarray | None = None, threshold: int = HAMMING_THRESHOLD) -> tuple:
+    """
+    All pairs within threshold bits, compared block by block over packed hashes
+
+    Args:
+        a: (n, 2, 8) hashes (image, mirrored)
+        b: (m, 2, 8) hashes, or None to compare a with itself (pairs i < j only)
+        threshold: Maximum Hamming distance
+
+    Returns:
+        (i, j, distance) arrays; distance is the smaller of direct and mirrored match
+    """
+    self_join = b is None
+    a64 = np.ascontiguousarray(a).view(np.uint64)[..., 0]  # (n, 2)
+    b64 = a64[:, 0] if self_join else np.ascontiguousarray(b).view(np.uint64)[:, 0, 0]
+    out_i, out_j, out_d = [], [], []
+    for lo in range(0, len(a64), BLOCK_ROWS):
+        block = a64[lo:lo + BLOCK_ROWS]
+        start = lo if self_join else 0  # self join: only columns j >= lo can satisfy i < j
+        target = b64[start:]
+        d = np.minimum(_popcount(block[:, 0, None] ^ target), _popcount(block[:, 1, None] ^ target))
+        if self_join:
+            d[np.tril_indices(len(block), 0, len(target))] = 255  # keep i < j
+        i, j = np.nonzero(d <= threshold)
+        out_i.append(i + lo)
+        out_j.append(j + start)
+        out_d.append(d[i, j])
+    if not out_i:
+        return np.zeros(0, np.int64), np.zeros(0, np.int64), np.zeros(0, np.uint8)
+    return np.concatenate(out_i), np.concatenate(out_j), np.concatenate(out_d)
+
+def clusters(n: int, i: np.ndarray, j: np.ndarray) -> np.ndarray:
+    """Connected components of the duplicate graph (label = smallest member index)"""
+    labels = np.arange(n)
+    while True:
+        m = np.minimum(labels[i], labels[j])
+        new = labels.copy()
+        np.minimum.at(new, i, m)
+        np.minimum.at(new, j, m)
+        new = new[new]  # pointer jumping
+        if (new == labels).all():
+            return labels
+        labels = new
+
+def _seconds_per_image(project_dir: str) -> float | None:
+    """Train-loop seconds per image from the newest instrumented run (instrument.py)"""
+    import yaml
+    from instrument import METRICS_FILE, summarize
+
+    runs = sorted(Path(project_dir).glob(f"*/{METRICS_FILE}"), key=lambda p: p.stat().st_mtime, reverse=True)
+    for path in runs:
+        epochs = summarize(str(path.parent))
+        args = path.parent / "args.yaml"
+        if not epochs or not args.exists():
+            continue
+        batch = yaml.safe_load(args.read_text(encoding="utf-8")).get("batch")
+        if not isinstance(batch, int) or batch <= 0:
+            continue
+        per_epoch = [(r["wall_s"] - r["val_s"] - r["save_s"]) / (r["iterations"] * batch)
+                     for r in epochs if r["iterations"]]
+        if per_epoch:
+            return float(np.median(per_epoch))
+    return None
+
+def prune_dataset(dataset_path: str, threshold: int = HAMMING_THRESHOLD) -> dict:
+    """
+    Find near-duplicate clusters in train and train/val leaks, write the deduplicated train list
+
+    One image per cluster is kept (the one with most boxes); train images that match any
+    val image are dropped so validation only sees unseen images. Val itself is not changed.
+
+    Args:
+        dataset_path: Dataset directory
+        threshold: Maximum Hamming distance for a duplicate
+
+    Returns:
+        Report dict, including "data_yaml" - the yaml start_training should use
+    """
+    from label_index import build_dataset_index
+    from train import EPOCHS, PROJECT_NAME, derive_data_yaml, get_data_yaml, get_split_paths, list_image_files
+
+    data_yaml = get_data_yaml(dataset_path)
+    root = Path(data_yaml).parent / DEDUP_DIRNAME
+    splits = get_split_paths(data_yaml)
+    train_files = list_image_files(splits["train"])
+    train_h, train_ok = compute_hashes(train_files, str(root / "train.npz"))
+
+    # Duplicates inside train: keep the member with the most boxes in each cluster
+    i, j, _ = hamming_pairs(train_h, threshold=threshold)
+    ok = train_ok[i] & train_ok[j]
+    labels = clusters(len(train_files), i[ok], j[ok])
+    boxes = build_dataset_index(data_yaml)["train"].boxes_per_image()
+    order = np.lexsort((np.arange(len(labels)), -boxes, labels))  # by cluster, most boxes first
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = labels[order][1:] != labels[order][:-1]
+    keep = np.zeros(len(train_files), dtype=bool)
+    keep[order[first]] = True
+    sizes = np.bincount(labels, minlength=len(labels))
+
+    # Train/val leaks
+    leaks = []
+    if "val" in splits:
+        val_files = list_image_files(splits["val"])
+        val_h, val_ok = compute_hashes(val_files, str(root / "val.npz"))
+        li, lj, ld = hamming_pairs(train_h, val_h, threshold)
+        ok = train_ok[li] & val_ok[lj]
+        leaks = [{"train": train_files[a], "val": val_files[b], "distance": int(d)}
+                 for a, b, d in zip(li[ok], lj[ok], ld[ok])]
+        keep[li[ok]] = False
+
+    list_path = root / "train.txt"
+    list_path.write_text("\n".join(f for f, k in zip(train_files, keep) if k) + "\n", encoding="utf-8")
+    out_yaml = derive_data_yaml(data_yaml, str(Path(data_yaml).parent / DEDUP_YAML), str(list_path))
+
+    removed = int((~keep).sum())
+    report = {
+        "threshold": threshold, "train_images": len(train_files), "kept": int(keep.sum()), "removed": removed,
+        "duplicate_clusters": int((sizes > 1).sum()), "largest_cluster": int(sizes.max()) if len(sizes) else 0,
+        "leaks": leaks, "unreadable": [f for f, v in zip(train_files, train_ok) if not v],
+        "data_yaml": out_yaml,
+    }
+    spi = _seconds_per_image(PROJECT_NAME)
+    if spi is not None:
+        report["seconds_saved_per_epoch"] = round(removed * spi, 1)
+        report["minutes_saved_total"] = round(removed * spi * EPOCHS / 60, 1)
+    (root / "report.json").write_text(json.dumps(report, indent=2), encoding="utf-8")
+    print_report(report)
+    return report
+
+def print_report(report: dict):
+    n, removed = report["train_images"], report["removed"]
+    print(f"\n🧹 Dedup (Hamming ≤ {report['threshold']}/64):")
+    print(f"   Train: {n} ภาพ → เหลือ {report['kept']} (ตัด {removed}, {removed / max(n, 1) * 100:.1f}%)")
+    print(f"   กลุ่มภาพซ้ำ: {report['duplicate_clusters']} กลุ่ม (ใหญ่สุด {report['largest_cluster']} ภาพ)")
+    if report["leaks"]:
+        print(f"   ⚠️  Train/Val leak: {len(report['leaks'])} คู่ (ตัดออกจาก train แล้ว)")
+        for leak in report["leaks"][:5]:
+            print(f"      {Path(leak['train']).name} ≈ {Path(leak['val']).name} (d={leak['distance']})")
+    if report["unreadable"]:
+        print(f"   ⚠️  อ่านภาพไม่ได้: {len(report['unreadable'])} ไฟล์")
+    if "seconds_saved_per_epoch" in report:
+        print(f"   ⏱️  ประหยัด ~{report['seconds_saved_per_epoch']} วินาที/epoch "
+              f"(~{report['minutes_saved_total']} นาทีทั้ง Training)")
+    else:
+        print(f"   ⏱️  ประหยัด ~{removed / max(n, 1) * 100:.1f}% ของเวลาแต่ละ epoch "
+              "(ยังไม่มี run ที่วัด phase ไว้สำหรับประมาณเป็นวินาที)")
+
+if __name__ == "__main__":
+    # python dedup.py <dataset_path> [threshold]
+    import sys
+
+    if len(sys.argv) < 2:
+        print("Usage: python dedup.py <dataset_path> [threshold]")
+        sys.exit(1)
+    prune_dataset(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else HAMMING_THRESHOLD)
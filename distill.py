@@ -0,0 +1,359 @@
+"""
+Distillation Module
+Trains a small student (yolo11n) against the labels and a trained teacher (yolo11l from runs/detect)
+without running the teacher during training
+
+The teacher runs once over the train split; its detections - boxes plus the full class-probability
+vector of each box - are stored as memory-mapped arrays. During training the teacher boxes of every
+image ride through the augmentation pipeline next to the labels (so mosaic, flips and crops move them
+with the pixels), and the loss adds a second task-aligned term whose class targets are the teacher's
+probabilities instead of one-hot labels.
+"""
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import torch
+from ultralytics.data.dataset import YOLODataset
+from ultralytics.utils.loss import v8DetectionLoss
+
+from cache_store import MemmapYOLODataset
+
+# =============================================================================
+# DISTILLATION CONFIGURATION
+# =============================================================================
+
+STUDENT_MODEL = "yolo11n.pt"    # model เล็กที่จะ train (ครู = MODEL_NAME ใน train.py ที่ train แล้ว)
+DISTILL_WEIGHT = 0.5            # loss = (1 - w) × labels + w × (labels + ครู แบบ soft)
+TEACHER_CONF = 0.05             # เก็บ detection ของครูที่ score >= ค่านี้
+TEACHER_IOU = 0.6               # NMS IoU ของครู
+TEACHER_MAX_BOXES = 100         # detection ของครูสูงสุดต่อภาพ
+TEACHER_BATCH = 16              # batch size ตอนรันครูสร้าง cache
+CACHE_DIRNAME = ".distill_cache"  # โฟลเดอร์ cache (อยู่ใน dataset)
+LATENCY_IMAGES = 50             # จำนวนภาพ val ที่ใช้วัด latency บน CPU
+REPORT_FILE = "distill_report.json"  # อยู่ใน run directory ของ student
+
+# =============================================================================
+
+class TeacherCache:
+    """
+    Teacher detections per train image: boxes (normalized xywh, float32) and class probabilities (float16)
+
+    Rows of image i are offsets[i]:offsets[i + 1]; arrays are mapped lazily in each process.
+    """
+
+    def __init__(self, cache_dir: str):
+        self.dir = Path(cache_dir)
+        meta = json.loads((self.dir / "meta.json").read_text(encoding="utf-8"))
+        self.nc = meta["nc"]
+        self.index = {f: i for i, f in enumerate(meta["files"])}
+        self.offsets = np.load(self.dir / "offsets.npy")
+        self._boxes = self._probs = None
+
+    def __getstate__(self):
+        # Dataloader workers map the same files instead of receiving a copy
+        state = self.__dict__.copy()
+        state["_boxes"] = state["_probs"] = None
+        return state
+
+    @property
+    def boxes(self) -> np.ndarray:
+        if self._boxes is None:
+            self._boxes = np.load(self.dir / "boxes.npy", mmap_mode="r")
+        return self._boxes
+
+    @property
+    def probs(self) -> np.ndarray:
+        if self._probs is None:
+            self._probs = np.load(self.dir / "probs.npy", mmap_mode="r")
+        return self._probs
+
+    def rows(self, im_file: str) -> tuple[int, int] | None:
+        i = self.index.get(os.path.abspath(im_file))
+        return None if i is None else (int(self.offsets[i]), int(self.offsets[i + 1]))
+
+    @classmethod
+    def build(cls, teacher: str, data_yaml: str, imgsz: int, device="cpu") -> "TeacherCache":
+        """
+        Run the teacher over the train split of data_yaml once (no-op if the cache exists)
+
+        Args:
+            teacher: Teacher checkpoint
+            imgsz: Inference size (the student's training imgsz)
+            device: DEVICE setting from train.py
+        """
+        from ultralytics import YOLO
+        from ultralytics.data.utils import check_det_dataset
+        from ultralytics.utils.nms import non_max_suppression
+        from cache_store import store_key
+        from checkpoint_catalog import file_sha1
+        from planner import _resolve_device
+        from train import get_split_paths, list_image_files
+        from val_sweep import _letterbox
+
+        files = [os.path.abspath(f) for f in list_image_files(get_split_paths(data_yaml)["train"])]
+        cache_dir = Path(data_yaml).parent / CACHE_DIRNAME / f"{file_sha1(teacher)[:12]}_{store_key(files, imgsz)}"
+        if (cache_dir / "meta.json").exists():
+            return cls(str(cache_dir))
+
+        nc = len(check_det_dataset(data_yaml)["names"])
+        yolo = YOLO(teacher)
+        if len(yolo.names) != nc:
+            raise ValueError(f"ครูมี {len(yolo.names)} classes แต่ dataset มี {nc}")
+        dev = _resolve_device(device)
+        model = yolo.model.float().fuse().eval().to(dev)
+        print(f"🧑‍🏫 รันครู {Path(teacher).name} บน train {len(files)} ภาพ @ {imgsz}px (ทำครั้งเดียว)")
+
+        boxes, probs, counts = [], [], []
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as pool, torch.inference_mode():
+            for start in range(0, len(files), TEACHER_BATCH):
+                items = list(pool.map(_letterbox, [(f, imgsz) for f in files[start:start + TEACHER_BATCH]]))
+                x = torch.from_numpy(np.ascontiguousarray(np.stack([im for im, _, _ in items])[..., ::-1]))
+                x = x.to(dev).permute(0, 3, 1, 2).float().div_(255)
+                y = model(x)
+                y = (y[0] if isinstance(y, (list, tuple)) else y).float()  # (B, 4 + nc, anchors)
+                dets, keep = non_max_suppression(y, TEACHER_CONF, TEACHER_IOU, max_det=TEACHER_MAX_BOXES,
+                                                 return_idxs=True)
+                for b, (_, (h0, w0), (r, left, top)) in enumerate(items):
+                    xyxy = (dets[b][:, :4].cpu().numpy() - [left, top, left, top]) / r
+                    xyxy = xyxy.clip(0, [w0, h0, w0, h0])
+                    boxes.append(np.stack([(xyxy[:, 0] + xyxy[:, 2]) / 2 / w0, (xyxy[:, 1] + xyxy[:, 3]) / 2 / h0,
+                                           (xyxy[:, 2] - xyxy[:, 0]) / w0, (xyxy[:, 3] - xyxy[:, 1]) / h0], 1))
+                    probs.append(y[b, 4:4 + nc, keep[b].view(-1).long()].T.cpu().numpy())
+                    counts.append(len(xyxy))
+
+        # Rows travel through augmentation as float32 cls = nc + row, exact only below 2**24
+        if sum(counts) + nc >= 2 ** 24:
+            raise ValueError(f"Teacher cache มี {sum(counts)} กรอบ เกินที่ cls แบบ float32 เก็บได้ (2^24 - nc) - "
+                             f"เพิ่ม TEACHER_CONF หรือลด TEACHER_MAX_BOXES")
+        tmp = cache_dir.with_name(cache_dir.name + ".tmp")
+        tmp.mkdir(parents=True, exist_ok=True)
+        np.save(tmp / "boxes.npy", np.concatenate(boxes).astype(np.float32).reshape(-1, 4))
+        np.save(tmp / "probs.npy", np.concatenate(probs).astype(np.float16).reshape(-1, nc))
+        np.save(tmp / "offsets.npy", np.concatenate([[0], np.cumsum(counts)]).astype(np.int64))
+        (tmp / "meta.json").write_text(json.dumps({"teacher": str(teacher), "imgsz": imgsz, "nc": nc, "files": files,
+                                                   "conf": TEACHER_CONF}), encoding="utf-8")
+        os.replace(tmp, cache_dir)
+        print(f"✅ Teacher cache: {sum(counts)} กรอบ → {cache_dir}")
+        return cls(str(cache_dir))
+
+def _teacher_dataset(base: type) -> type:
+    """
+    Subclass of a dataset class that appends the cached teacher boxes of an image to its labels,
+    with cls = nc + row in the cache
+
+    Augmentations keep cls aligned with its box, so the loss can look the probabilities up again.
+    Images missing from the cache (e.g. progressive pyramid stages) train on labels only.
+    A direct subclass (not a mixin) so build_dataset can swap __class__ on an existing dataset.
+    """
+
+    class Dataset(base):
+        teacher: TeacherCache
+
+        def update_labels_info(self, label: dict) -> dict:
+            rows = self.teacher.rows(label["im_file"])
+            if rows and rows[1] > rows[0] and not len(label.get("segments", [])):
+                start, end = rows
+                label["bboxes"] = np.concatenate([label["bboxes"], self.teacher.boxes[start:end]]).astype(np.float32)
+                tcls = (self.teacher.nc + np.arange(start, end, dtype=np.float32))[:, None]
+                label["cls"] = np.concatenate([label["cls"], tcls]).astype(np.float32)
+            return super().update_labels_info(label)
+
+    Dataset.__name__ = Dataset.__qualname__ = f"Distill{base.__name__}"  # picklable for spawned workers
+    return Dataset
+
+DistillYOLODataset = _teacher_dataset(YOLODataset)
+DistillMemmapYOLODataset = _teacher_dataset(MemmapYOLODataset)
+DATASETS = {YOLODataset: DistillYOLODataset, MemmapYOLODataset: DistillMemmapYOLODataset}
+
+class _SoftAssigner:
+    """Task-aligned assigner whose class targets become soft probabilities when `soft` is set"""
+
+    def __init__(self, assigner):
+        self.assigner = assigner
+        self.soft = None  # (batch, max boxes, nc), padded like the loss' targets
+
+    def __call__(self, *args):
+        labels, bboxes, scores, fg_mask, gt_idx = self.assigner(*args)
+        if self.soft is not None:
+            metric = scores.amax(-1, keepdim=True)  # normalized alignment of the assigned box, 0 on background
+            soft = self.soft.gather(1, gt_idx.unsqueeze(-1).expand(-1, -1, self.soft.shape[-1]))
+            scores = soft.to(scores.dtype) * metric
+        return labels, bboxes, scores, fg_mask, gt_idx
+
+class DistillDetectionLoss(v8DetectionLoss):
+    """
+    v8 detection loss on the labels, blended with the same loss on labels + teacher boxes with soft classes
+
+    Labels stay in the second term (as one-hot rows) so objects the teacher missed are not pushed to background.
+    """
+
+    def __init__(self, model, teacher: TeacherCache, weight: float = DISTILL_WEIGHT):
+        super().__init__(model)
+        self.teacher, self.weight = teacher, weight
+        self.assigner = _SoftAssigner(self.assigner)
+
+    def _pad(self, probs: torch.Tensor, batch_idx: torch.Tensor, batch_size: int) -> torch.Tensor:
+        """Per-image padding in the same order as v8DetectionLoss.preprocess"""
+        bi = batch_idx.long().to(self.device)
+        counts = torch.bincount(bi, minlength=batch_size)
+        out = torch.zeros(batch_size, int(counts.max()), self.nc, device=self.device)
+        first = torch.cat([counts.new_zeros(1), counts.cumsum(0)[:-1]])
+        out[bi, torch.arange(len(bi), device=self.device) - first[bi]] = probs
+        return out
+
+    def loss(self, preds: dict, batch: dict) -> tuple[torch.Tensor, dict]:
+        cls = batch["cls"].view(-1)
+        from_teacher = cls >= self.nc
+        labels = {**batch, "cls": batch["cls"][~from_teacher], "bboxes": batch["bboxes"][~from_teacher],
+                  "batch_idx": batch["batch_idx"][~from_teacher]}
+        loss, items = super().loss(preds, labels)
+        if not from_teacher.any():
+            return loss, {**items, "kd_loss": torch.zeros((), device=self.device)}
+
+        probs = torch.zeros(len(cls), self.nc, device=self.device)
+        probs[~from_teacher] = torch.nn.functional.one_hot(cls[~from_teacher].long(), self.nc).float().to(self.device)
+        rows = (cls[from_teacher] - self.nc).long().cpu().numpy()
+        probs[from_teacher] = torch.from_numpy(self.teacher.probs[rows].astype(np.float32)).to(self.device)
+        batch_size = preds["boxes"].shape[0]
+        self.assigner.soft = self._pad(probs, batch["batch_idx"], batch_size)
+        try:
+            kd, _ = super().loss(preds, {**batch, "cls": probs.argmax(1, keepdim=True).float()})
+        finally:
+            self.assigner.soft = None
+        return (1 - self.weight) * loss + self.weight * kd, {**items, "kd_loss": kd.detach().sum() / batch_size}
+
+def distill_trainer(base, distill: dict):
+    """
+    Trainer class that trains against the labels and a teacher cache
+
+    Args:
+        base: Trainer class to extend (DetectionTrainer, or e.g. MemmapDetectionTrainer)
+        distill: plan["distill"] - teacher, cache directory and weight
+    """
+    from ultralytics.models.yolo.detect import DetectionTrainer
+    from ultralytics.utils.torch_utils import unwrap_model
+
+    class DistillDetectionTrainer(base or DetectionTrainer):
+        def build_dataset(self, img_path, mode="train", batch=None):
+            dataset = super().build_dataset(img_path, mode=mode, batch=batch)
+            if mode == "train" and type(dataset) in DATASETS:
+                dataset.__class__ = DATASETS[type(dataset)]
+                dataset.teacher = TeacherCache(distill["cache"])
+            return dataset
+
+        def _setup_train(self):
+            super()._setup_train()
+            model = unwrap_model(self.model)
+            model.criterion = DistillDetectionLoss(model, TeacherCache(distill["cache"]), distill["weight"])
+
+        def plot_training_samples(self, batch, ni):
+            keep = batch["cls"].view(-1) < self.data["nc"]  # labels only
+            super().plot_training_samples({**batch, "cls": batch["cls"][keep], "bboxes": batch["bboxes"][keep],
+                                           "batch_idx": batch["batch_idx"][keep]}, ni)
+
+    return DistillDetectionTrainer
+
+def find_checkpoint(train_key: str | None, data_root: str, model_name: str, distilled: bool = False) -> dict | None:
+    """
+    Best best.pt in runs/detect trained from model_name on this dataset
+
+    Runs whose plan has the same train_key (the full train split, before dedup / coreset) come first;
+    failing that, the best run whose data.yaml lies under the same dataset directory.
+
+    Args:
+        train_key: coreset.train_key of the dataset's data.yaml
+        data_root: Dataset directory (the folder of data.yaml)
+        distilled: True = only distillation runs, False = only plain runs
+    """
+    from checkpoint_catalog import all_checkpoints, refresh
+    from planner import load_plan
+    from train import PROJECT_NAME
+
+    root = Path(data_root).resolve()
+    same_key, same_dir = [], []
+    for row in all_checkpoints(refresh(PROJECT_NAME)):
+        if row["file"] != "best.pt" or row["map"] is None:
+            continue
+        args = json.loads(row["train_args"])
+        if Path(args.get("model") or "").stem != Path(model_name).stem:
+            continue
+        plan = load_plan(Path(row["path"]).parent.parent) or {}
+        if bool(plan.get("distill")) != distilled:
+            continue
+        if train_key and plan.get("train_key") == train_key:
+            same_key.append(row)
+        elif args.get("data") and Path(args["data"]).resolve().is_relative_to(root):
+            same_dir.append(row)
+    best = max(same_key or same_dir, key=lambda r: r["map"], default=None)
+    if best is not None and not same_key:
+        print(f"ℹ️  ไม่พบ run ของ {Path(model_name).stem} ที่ train split ตรงกัน - ใช้ run ที่ดีที่สุดใน {root}: {best['run']}")
+    return best
+
+def resolve_teacher(teacher: str | None, train_key: str | None, data_root: str) -> str:
+    """Teacher checkpoint: the given path, else the best MODEL_NAME run on this dataset"""
+    from train import MODEL_NAME
+
+    if teacher and teacher != "auto":
+        return teacher
+    row = find_checkpoint(train_key, data_root, MODEL_NAME)
+    if row is None:
+        raise FileNotFoundError(f"ไม่พบ best.pt ของ {MODEL_NAME} สำหรับ dataset นี้ใน runs/detect - train ครูก่อน")
+    print(f"🧑‍🏫 ครู: {row['path']} (run {row['run']}, mAP50-95 {row['map']:.4f})")
+    return row["path"]
+
+def report(student: str, teacher: str, dataset_path: str, imgsz: int) -> list[dict]:
+    """
+    mAP (val split) and CPU latency of the distilled student next to the teacher and a plain student run
+
+    Returns:
+        One row per model; also written to REPORT_FILE in the student's run directory
+    """
+    from checkpoint_catalog import file_sha1
+    from export import measure_latency
+    from planner import load_plan
+    from train import get_data_yaml
+    from val_sweep import ValCache, cached_predictions, score
+
+    run_dir = Path(student).parent.parent
+    plan = load_plan(run_dir) or {}
+    data_yaml = get_data_yaml(dataset_path)
+    plain = find_checkpoint(plan.get("train_key"), str(Path(data_yaml).parent), STUDENT_MODEL)
+    models = [("teacher", teacher), (f"{Path(STUDENT_MODEL).stem} (plain)", plain and plain["path"]),
+              (f"{Path(STUDENT_MODEL).stem} (distilled)", student)]
+
+    cache = ValCache.build(data_yaml, imgsz)
+    images = cache.files[:LATENCY_IMAGES]
+    rows = []
+    print(f"\n📊 Distillation report (val {len(cache.files)} ภาพ, CPU batch 1, {imgsz}px):")
+    print(f"   {'Model':<22} {'mAP50':>7} {'mAP50-95':>9} {'p50 ms':>8}")
+    for name, path in models:
+        if not path:
+            print(f"   {name:<22} {'-':>7} {'-':>9} {'-':>8}  (ยังไม่มี run - train {STUDENT_MODEL} แบบปกติเพื่อเทียบ)")
+            continue
+        metrics = score(cached_predictions(path, file_sha1(path), cache), cache)
+        row = {"model": name, "path": str(path), "map50": round(metrics["map50"], 4), "map": round(metrics["map"], 4),
+               **measure_latency(str(path), images, imgsz)}
+        rows.append(row)
+        print(f"   {name:<22} {row['map50']:>7.4f} {row['map']:>9.4f} {row['p50_ms']:>8.2f}")
+
+    (run_dir / REPORT_FILE).write_text(json.dumps(rows, indent=2), encoding="utf-8")
+    print(f"📄 {run_dir / REPORT_FILE}")
+    return rows
+
+if __name__ == "__main__":
+    # python distill.py <dataset_path> [teacher.pt]          → distillation run (start_training with a teacher)
+    # python distill.py report <student best.pt> <teacher.pt> <dataset_path>
+    import sys
+    from train import IMAGE_SIZE, start_training
+
+    if len(sys.argv) >= 5 and sys.argv[1] == "report":
+        report(sys.argv[2], sys.argv[3], sys.argv[4], IMAGE_SIZE)
+    elif len(sys.argv) >= 2 and sys.argv[1] != "report":
+        start_training(sys.argv[1], teacher=sys.argv[2] if len(sys.argv) > 2 else "auto")
+    else:
+        print("Usage: python distill.py <dataset_path> [teacher.pt]")
+        print("       python distill.py report <student best.pt> <teacher.pt> <dataset_path>")
+        sys.exit(1)
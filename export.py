@@ -0,0 +1,184 @@
+"""
+Export Module
+Exports best.pt to ONNX / INT8 (ONNX Runtime, OpenVINO) and compares accuracy and CPU latency
+"""
+import json
+import random
+import time
+from pathlib import Path
+
+# =============================================================================
+# EXPORT CONFIGURATION
+# =============================================================================
+
+EXPORT_VARIANTS = ("onnx", "onnx_int8", "openvino_int8")  # เพิ่ม "openvino" ได้ (FP32)
+CALIB_IMAGES = 300        # จำนวนภาพจาก train split ที่สุ่มมาใช้ calibrate INT8
+CALIB_SEED = 0
+LATENCY_IMAGES = 50       # จำนวนภาพจาก val split ที่ใช้วัด latency (batch 1 บน CPU)
+LATENCY_WARMUP = 5
+MAX_MAP_DROP = 0.01       # accuracy floor: mAP50-95 ต่ำกว่า best.pt ได้ไม่เกินเท่านี้
+REPORT_FILE = "export_report"  # เขียน .json + .md ไว้ใน run directory
+
+# =============================================================================
+
+VARIANTS = {
+    "onnx": {"format": "onnx"},
+    "onnx_int8": {"format": "onnx", "quantize": 8},
+    "openvino": {"format": "openvino"},
+    "openvino_int8": {"format": "openvino", "quantize": 8},
+}
+
+def calibration_yaml(data_yaml: str, out_dir: Path, n: int = CALIB_IMAGES, seed: int = CALIB_SEED) -> str:
+    """
+    Write a data.yaml whose train split is a random sample of the real train split
+
+    Args:
+        data_yaml: Path to the dataset's data.yaml
+        out_dir: Where calib.txt / calib.yaml are written
+        n: Number of images to sample
+
+    Returns:
+        Path to the calibration data.yaml
+    """
+    from train import derive_data_yaml, get_split_paths, list_image_files
+
+    files = list_image_files(get_split_paths(data_yaml)["train"])
+    if not files:
+        raise FileNotFoundError("ไม่พบภาพใน train split สำหรับ calibration")
+    sample = sorted(random.Random(seed).sample(files, min(n, len(files))))
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    (out_dir / "calib.txt").write_text("\n".join(str(Path(f).resolve()) for f in sample) + "\n", encoding="utf-8")
+    return derive_data_yaml(data_yaml, str(out_dir / "calib.yaml"), str(out_dir / "calib.txt"))
+
+def export_variant(weights: str, variant: str, calib_yaml: str) -> str:
+    """Export one variant with Ultralytics' exporter, returns the exported file/directory"""
+    from ultralytics import YOLO
+
+    model = YOLO(weights)
+    kwargs = dict(VARIANTS[variant], imgsz=model.overrides.get("imgsz", 640), device="cpu", verbose=False)
+    if kwargs.get("quantize") == 8:
+        kwargs.update(data=calib_yaml, split="train", fraction=1.0)  # calib.yaml's train = sampled subset
+    return str(model.export(**kwargs))
+
+def measure_latency(model_path: str, images: list[str], imgsz: int) -> dict:
+    """
+    End-to-end CPU latency (preprocess + inference + NMS), batch 1
+
+    Returns:
+        Dict with p50_ms / p90_ms / mean_ms
+    """
+    import cv2
+    import numpy as np
+    from ultralytics import YOLO
+
+    model = YOLO(model_path, task="detect")
+    ims = [cv2.imread(f) for f in images]
+    for im in ims[:LATENCY_WARMUP]:
+        model.predict(im, imgsz=imgsz, device="cpu", verbose=False)
+    times = []
+    for im in ims:
+        t0 = time.perf_counter()
+        model.predict(im, imgsz=imgsz, device="cpu", verbose=False)
+        times.append((time.perf_counter() - t0) * 1000)
+    return {"p50_ms": round(float(np.percentile(times, 50)), 2), "p90_ms": round(float(np.percentile(times, 90)), 2),
+            "mean_ms": round(float(np.mean(times)), 2)}
+
+def _size_mb(path: Path) -> float:
+    files = path.rglob("*") if path.is_dir() else [path]
+    return round(sum(f.stat().st_size for f in files if f.is_file()) / 2**20, 2)
+
+def export_and_compare(weights: str, dataset_path: str, variants=EXPORT_VARIANTS) -> list[dict]:
+    """
+    Export best.pt to every variant, then validate and time each one next to the original
+
+    Args:
+        weights: Path to best.pt
+        dataset_path: Dataset directory (as passed to start_training)
+        variants: Keys of VARIANTS to build
+
+    Returns:
+        One row per model: variant, path, size, mAP50, mAP50-95, latency, speedup, meets_floor
+    """
+    from ultralytics import YOLO
+    from train import get_data_yaml, get_split_paths, list_image_files, validate_model
+
+    weights = Path(weights)
+    run_dir = weights.parent.parent
+    data_yaml = get_data_yaml(dataset_path)
+    imgsz = YOLO(str(weights)).overrides.get("imgsz", 640)
+    splits = get_split_paths(data_yaml)
+    latency_images = list_image_files(splits.get("val") or splits["train"])[:LATENCY_IMAGES]
+
+    calib = None
+    if any(VARIANTS[v].get("quantize") == 8 for v in variants):
+        calib = calibration_yaml(data_yaml, run_dir / "calibration")
+        print(f"🎯 Calibration: สุ่ม {CALIB_IMAGES} ภาพจาก train split → {calib}")
+
+    # INT8 ONNX export quantizes best.onnx and deletes it, so FP32 variants are exported after
+    models = [("pytorch", str(weights))]
+    for variant in sorted(variants, key=lambda v: VARIANTS[v].get("quantize") != 8):
+        print(f"\n📦 Export: {variant}")
+        try:
+            models.append((variant, export_variant(str(weights), variant, calib)))
+        except Exception as e:
+            print(f"❌ Export {variant} ไม่สำเร็จ: {e}")
+            if isinstance(e, ImportError):
+                print("   กรุณารัน: pip install -r requirements-export.txt")
+
+    rows = []
+    for variant, path in models:
+        results = validate_model(path, dataset_path)
+        if results is None:
+            continue
+        rows.append({"variant": variant, "path": path, "size_mb": _size_mb(Path(path)),
+                     "map50": round(float(results.box.map50), 4), "map50_95": round(float(results.box.map), 4),
+                     **measure_latency(path, latency_images, imgsz)})
+
+    if rows and rows[0]["variant"] == "pytorch":
+        base = rows[0]
+        for r in rows:
+            r["speedup"] = round(base["p50_ms"] / r["p50_ms"], 2)
+            r["meets_floor"] = r["map50_95"] >= base["map50_95"] - MAX_MAP_DROP
+    write_report(rows, run_dir)
+    return rows
+
+def recommend(rows: list[dict]) -> dict | None:
+    """Fastest variant that meets the accuracy floor"""
+    ok = [r for r in rows if r.get("meets_floor")]
+    return min(ok, key=lambda r: r["p50_ms"]) if ok else None
+
+def write_report(rows: list[dict], run_dir: Path):
+    """Write the comparison table as JSON and Markdown and print it"""
+    best = recommend(rows)
+    (run_dir / f"{REPORT_FILE}.json").write_text(
+        json.dumps({"max_map_drop": MAX_MAP_DROP, "recommended": best and best["variant"], "variants": rows},
+                   indent=2), encoding="utf-8")
+
+    header = "| Variant | Size MB | mAP50 | mAP50-95 | p50 ms | p90 ms | Speedup | Floor |"
+    lines = [header, "|" + "---|" * 8]
+    for r in rows:
+        lines.append(f"| {r['variant']} | {r['size_mb']} | {r['map50']:.4f} | {r['map50_95']:.4f} | "
+                     f"{r['p50_ms']} | {r['p90_ms']} | {r.get('speedup', '-')}x | "
+                     f"{'✅' if r.get('meets_floor') else '❌'} |")
+    if best:
+        lines.append(f"\nRecommended: **{best['variant']}** ({best['path']})")
+    (run_dir / f"{REPORT_FILE}.md").write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+    print("\n📊 เปรียบเทียบ Model (CPU, batch 1):")
+    print("\n".join("   " + line for line in lines[:1] + lines[2:len(rows) + 2]))
+    if best:
+        print(f"\n🏆 แนะนำ: {best['variant']} - เร็วสุดที่ mAP50-95 ลดไม่เกิน {MAX_MAP_DROP}")
+    else:
+        print(f"\n⚠️  ไม่มี variant ที่ผ่าน accuracy floor (mAP50-95 ลดไม่เกิน {MAX_MAP_DROP})")
+    print(f"📁 Report: {run_dir / REPORT_FILE}.md")
+
+if __name__ == "__main__":
+    # python export.py <best.pt> <dataset_path> [variant ...]
+    import sys
+
+    if len(sys.argv) < 3:
+        print("Usage: python export.py <best.pt> <dataset_path> [variant ...]")
+        print(f"       variants: {', '.join(VARIANTS)}")
+        sys.exit(1)
+    export_and_compare(sys.argv[1], sys.argv[2], tuple(sys.argv[3:]) or EXPORT_VARIANTS)
@@ -0,0 +1,255 @@
+"""
+Training Instrumentation Module
+Per-phase timings (dataloader, forward/backward, optimizer, validation, plots, checkpoint save)
+written to JSONL and a Chrome/Perfetto trace in the run directory
+"""
+import json
+import os
+import time
+from pathlib import Path
+
+# =============================================================================
+# INSTRUMENTATION CONFIGURATION
+# =============================================================================
+
+METRICS_FILE = "phases.jsonl"   # 1 บรรทัดต่อ iteration + สรุปต่อ epoch
+TRACE_FILE = "trace.json"       # เปิดด้วย chrome://tracing หรือ ui.perfetto.dev
+TRACE_ITERATIONS = 200          # จำนวน iteration แรกของแต่ละ epoch ที่ลงใน trace (None = ทั้งหมด)
+SYNC_CUDA = False               # True = synchronize ทุก phase (เวลาแม่นขึ้น แต่ training ช้าลง)
+
+# =============================================================================
+
+PHASES = ("data", "compute", "optim", "plot", "val", "save")
+TRAIN_TID, DATA_TID, EPOCH_TID = 1, 2, 3
+
+class PhaseRecorder:
+    """
+    Collects phase timings from trainer callbacks and wrapped trainer methods
+
+    Records are buffered in memory and written once per epoch, so the training loop only
+    pays for a few clock reads, one RSS read and a list append per iteration.
+    """
+
+    def __init__(self):
+        import psutil
+
+        self.proc = psutil.Process()
+        self.pid = os.getpid()
+        self.t0_perf = time.perf_counter()
+        self.t0_wall_us = time.time() * 1e6
+        self.records, self.events = [], []
+        self.out_dir = None
+        self.cuda = False
+        self._reset_epoch()
+
+    def _reset_epoch(self):
+        self.epoch_totals = dict.fromkeys(PHASES, 0.0)
+        self.epoch_start = None
+        self.batch_start = None
+        self.last_batch_end = None
+        self.batch_extra = dict.fromkeys(("optim", "plot"), 0.0)
+        self.iteration = 0
+        self.rss_peak = 0
+        self.overhead = 0.0
+
+    def _ts(self, t: float) -> float:
+        """perf_counter → trace timestamp (µs, wall-clock anchored so resumed runs line up)"""
+        return self.t0_wall_us + (t - self.t0_perf) * 1e6
+
+    def _event(self, name: str, start: float, end: float, tid: int = TRAIN_TID, args: dict | None = None):
+        event = {"name": name, "ph": "X", "ts": self._ts(start), "dur": (end - start) * 1e6,
+                 "pid": self.pid, "tid": tid}
+        if args:
+            event["args"] = args
+        self.events.append(event)
+
+    def _sync(self):
+        if self.cuda and SYNC_CUDA:
+            import torch
+            torch.cuda.synchronize()
+
+    def _memory(self) -> tuple[float, float | None]:
+        rss = self.proc.memory_info().rss / 2**20
+        self.rss_peak = max(self.rss_peak, rss)
+        if not self.cuda:
+            return rss, None
+        import torch
+        return rss, torch.cuda.memory_allocated() / 2**20
+
+    @staticmethod
+    def _queue_depth(trainer) -> tuple[int | None, int | None]:
+        """(ready batches, batches in flight) of the dataloader workers"""
+        it = getattr(trainer.train_loader, "iterator", None)
+        try:
+            return it._data_queue.qsize(), it._tasks_outstanding
+        except (AttributeError, NotImplementedError):
+            return None, None  # workers=0 or platform without qsize
+
+    def timed(self, phase: str, fn):
+        """Wrap a trainer method so its duration is attributed to phase"""
+
+        def wrapper(*args, **kwargs):
+            self._sync()
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self._sync()
+                end = time.perf_counter()
+                self.epoch_totals[phase] += end - start
+                if phase in self.batch_extra and self.batch_start is not None:
+                    self.batch_extra[phase] += end - start
+                if phase in ("val", "save", "plot") or self._trace_iteration():
+                    self._event(phase, start, end)
+
+        return wrapper
+
+    def _trace_iteration(self) -> bool:
+        return TRACE_ITERATIONS is None or self.iteration < TRACE_ITERATIONS
+
+    # ----------------------------------------------------------------- callbacks
+
+    def on_train_start(self, trainer):
+        self.out_dir = Path(trainer.save_dir)
+        self.cuda = trainer.device.type == "cuda"
+        # Phases without a callback of their own are timed by wrapping the trainer methods
+        trainer.optimizer_step = self.timed("optim", trainer.optimizer_step)
+        trainer.validate = self.timed("val", trainer.validate)
+        trainer.save_model = self.timed("save", trainer.save_model)
+        trainer.plot_training_samples = self.timed("plot", trainer.plot_training_samples)
+        trainer.plot_metrics = self.timed("plot", trainer.plot_metrics)
+        self.events += [
+            {"name": "process_name", "ph": "M", "pid": self.pid, "args": {"name": f"train {self.out_dir.name}"}},
+            {"name": "thread_name", "ph": "M", "pid": self.pid, "tid": TRAIN_TID, "args": {"name": "train loop"}},
+            {"name": "thread_name", "ph": "M", "pid": self.pid, "tid": DATA_TID, "args": {"name": "dataloader wait"}},
+            {"name": "thread_name", "ph": "M", "pid": self.pid, "tid": EPOCH_TID, "args": {"name": "epochs"}},
+        ]
+
+    def on_train_epoch_start(self, trainer):
+        self._reset_epoch()
+        self.epoch_start = self.last_batch_end = time.perf_counter()
+
+    def on_train_batch_start(self, trainer):
+        t = time.perf_counter()
+        self.batch_start = t
+        self.batch_extra = dict.fromkeys(("optim", "plot"), 0.0)
+        data = t - self.last_batch_end
+        self.epoch_totals["data"] += data
+        if self._trace_iteration():
+            self._event("data", self.last_batch_end, t, DATA_TID)
+        self.overhead += time.perf_counter() - t
+
+    def on_train_batch_end(self, trainer):
+        self._sync()
+        t = time.perf_counter()
+        compute = t - self.batch_start - self.batch_extra["optim"] - self.batch_extra["plot"]
+        self.epoch_totals["compute"] += compute
+        rss, dev = self._memory()
+        ready, inflight = self._queue_depth(trainer)
+        record = {
+            "type": "iter", "epoch": trainer.epoch + 1, "iter": self.iteration, "t": round(self._ts(t) / 1e6, 3),
+            "data_s": round(self.batch_start - self.last_batch_end, 5), "compute_s": round(compute, 5),
+            "optim_s": round(self.batch_extra["optim"], 5), "plot_s": round(self.batch_extra["plot"], 5),
+            "queue": ready, "inflight": inflight, "rss_mb": round(rss, 1),
+            "device_mb": round(dev, 1) if dev is not None else None,
+        }
+        self.records.append(record)
+        if self._trace_iteration():
+            self._event("compute", self.batch_start, t, args={"iter": self.iteration})
+            self.events.append({"name": "memory", "ph": "C", "ts": self._ts(t), "pid": self.pid,
+                                "args": {"rss_mb": record["rss_mb"], "device_mb": record["device_mb"] or 0}})
+            if ready is not None:
+                self.events.append({"name": "dataloader queue", "ph": "C", "ts": self._ts(t), "pid": self.pid,
+                                    "args": {"ready": ready, "inflight": inflight}})
+        self.iteration += 1
+        self.batch_start = None
+        self.last_batch_end = time.perf_counter()
+        self.overhead += self.last_batch_end - t
+
+    def on_fit_epoch_end(self, trainer):
+        if self.epoch_start is None:
+            return  # final validation after training
+        t = time.perf_counter()
+        totals = {f"{k}_s": round(v, 4) for k, v in self.epoch_totals.items()}
+        record = {"type": "epoch", "epoch": trainer.epoch + 1, "iterations": self.iteration,
+                  "wall_s": round(t - self.epoch_start, 4), **totals,
+                  "other_s": round(t - self.epoch_start - sum(self.epoch_totals.values()), 4),
+                  "rss_peak_mb": round(self.rss_peak, 1), "overhead_s": round(self.overhead, 4)}
+        if self.cuda:
+            import torch
+            record["device_peak_mb"] = round(torch.cuda.max_memory_allocated() / 2**20, 1)
+        self.records.append(record)
+        self._event(f"epoch {trainer.epoch + 1}", self.epoch_start, t, EPOCH_TID, args=totals)
+        self.epoch_start = None
+        self.flush()
+
+    def on_train_end(self, trainer):
+        self.flush(close=True)
+
+    # ------------------------------------------------------------------- output
+
+    def flush(self, close: bool = False):
+        """Append buffered records to the JSONL file and buffered events to the trace"""
+        if self.out_dir is None:
+            return
+        with open(self.out_dir / METRICS_FILE, "a", encoding="utf-8") as f:
+            f.writelines(json.dumps(r) + "\n" for r in self.records)
+        self.records = []
+
+        # JSON array format - the closing bracket is optional, so the file can be appended
+        # to after every epoch and stays loadable if training is killed
+        trace = self.out_dir / TRACE_FILE
+        with open(trace, "a+b") as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell() == 0:
+                f.write(b"[\n")
+            else:
+                f.seek(-2, os.SEEK_END)
+                if f.read(2) == b"]\n":  # closed by an earlier session - reopen (resume)
+                    f.truncate(f.tell() - 2)
+                    f.seek(0, os.SEEK_END)
+                    f.write(b",\n")
+            f.write(b"".join(json.dumps(e).encode() + b",\n" for e in self.events))
+            if close:
+                f.write(b"{}]\n")
+        self.events = []
+
+def attach_instrumentation(model) -> PhaseRecorder:
+    """Register the phase recorder on a YOLO model before model.train()"""
+    recorder = PhaseRecorder()
+    for event in ("on_train_start", "on_train_epoch_start", "on_train_batch_start",
+                  "on_train_batch_end", "on_fit_epoch_end", "on_train_end"):
+        model.add_callback(event, getattr(recorder, event))
+    return recorder
+
+def summarize(run_dir: str) -> list[dict]:
+    """Per-epoch phase records of a run"""
+    path = Path(run_dir) / METRICS_FILE
+    if not path.exists():
+        return []
+    with open(path, encoding="utf-8") as f:
+        return [r for r in map(json.loads, f) if r["type"] == "epoch"]
+
+def print_summary(run_dir: str):
+    """Print where the epoch time went"""
+    epochs = summarize(run_dir)
+    if not epochs:
+        print(f"❌ ไม่พบ {METRICS_FILE} ใน {run_dir}")
+        return
+    print(f"\n   {'Epoch':>5} {'Wall':>8} " + " ".join(f"{p:>8}" for p in PHASES) + f" {'Other':>8} {'RSS MB':>8}")
+    for r in epochs:
+        print(f"   {r['epoch']:>5} {r['wall_s']:>7.1f}s " + " ".join(f"{r[p + '_s']:>7.1f}s" for p in PHASES)
+              + f" {r['other_s']:>7.1f}s {r['rss_peak_mb']:>8.0f}")
+    wall = sum(r["wall_s"] for r in epochs)
+    shares = ", ".join(f"{p} {sum(r[p + '_s'] for r in epochs) / wall * 100:.0f}%" for p in PHASES)
+    overhead = sum(r["overhead_s"] for r in epochs) / wall * 100
+    print(f"\n   สัดส่วนเวลา: {shares} (overhead ของการวัด {overhead:.2f}%)")
+
+if __name__ == "__main__":
+    # Print the phase summary of a run: python instrument.py runs/detect/train
+    import sys
+
+    if len(sys.argv) < 2:
+        print("Usage: python instrument.py <run_dir>")
+        sys.exit(1)
+    print_summary(sys.argv[1])
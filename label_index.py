@@ -0,0 +1,329 @@
+"""
+Label Index Module
+Packs every YOLO label file of a split into one columnar, memory-mappable file
+
+Layout of <split>.lblidx (one file per split):
+    magic | header length | JSON header | 64-byte aligned arrays
+Arrays: classes (int32, per box), boxes (float32 cx,cy,w,h, per box),
+offsets (int64, per image + 1), status (int8, per image), stat (int64 size,mtime_ns).
+
+Training and validation keep using Ultralytics' labels.cache, which already stores parsed labels plus the
+image shapes from image verification (not in this index). The index serves the dataset report, dedup,
+coreset selection and val_sweep.
+"""
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+# =============================================================================
+# INDEX CONFIGURATION
+# =============================================================================
+
+INDEX_DIRNAME = ".label_index"  # โฟลเดอร์เก็บ index (อยู่ใน dataset)
+INDEX_WORKERS = None            # จำนวน process (None = ทุก core)
+FILES_PER_TASK = 512            # จำนวน label ต่อ task ที่ส่งให้ process pool
+
+# Per-image status codes
+OK, EMPTY, MISSING, CORRUPT = 0, 1, 2, 3
+STATUS_NAMES = {OK: "ok", EMPTY: "empty", MISSING: "missing", CORRUPT: "corrupt"}
+
+# Box size buckets on sqrt(w*h) of normalized boxes
+SIZE_BINS = [0.0, 0.02, 0.05, 0.1, 0.2, 0.4, 1.0]
+
+# =============================================================================
+
+_MAGIC = b"LBLIDX1\n"
+_ALIGN = 64
+
+def img2label_path(im_file: str) -> str:
+    """Map an image path to its YOLO label path (same rule as Ultralytics)"""
+    sa, sb = f"{os.sep}images{os.sep}", f"{os.sep}labels{os.sep}"
+    return sb.join(im_file.rsplit(sa, 1)).rsplit(".", 1)[0] + ".txt"
+
+def _parse_labels(paths: list[str]) -> tuple:
+    """
+    Parse a batch of label files (runs in a worker process)
+
+    Returns:
+        Tuple of (classes, boxes, counts, status) for the batch
+    """
+    classes, boxes, counts, status = [], [], [], []
+    for path in paths:
+        try:
+            with open(path, encoding="utf-8") as f:
+                rows = [line.split() for line in f.read().strip().splitlines() if line.strip()]
+        except FileNotFoundError:
+            counts.append(0)
+            status.append(MISSING)
+            continue
+        except (OSError, UnicodeDecodeError):
+            counts.append(0)
+            status.append(CORRUPT)
+            continue
+
+        try:
+            cls, xywh = [], []
+            for row in rows:
+                values = [float(v) for v in row]
+                if len(values) == 5:
+                    cls.append(values[0])
+                    xywh.append(values[1:])
+                elif len(values) >= 7 and len(values) % 2 == 1:
+                    # Polygon label -> enclosing box
+                    xy = np.array(values[1:], dtype=np.float32).reshape(-1, 2)
+                    (x0, y0), (x1, y1) = xy.min(0), xy.max(0)
+                    cls.append(values[0])
+                    xywh.append([(x0 + x1) / 2, (y0 + y1) / 2, x1 - x0, y1 - y0])
+                else:
+                    raise ValueError(f"{len(values)} columns")
+            cls = np.array(cls, dtype=np.float32)
+            xywh = np.array(xywh, dtype=np.float32).reshape(-1, 4)
+            bad = (cls < 0) | (cls != np.floor(cls)) | (xywh[:, 2:] <= 0).any(1)
+            bad |= (xywh > 1.01).any(1) | (xywh < -0.01).any(1)
+            if bad.any():
+                raise ValueError("out of range")
+        except ValueError:
+            counts.append(0)
+            status.append(CORRUPT)
+            continue
+
+        classes.append(cls.astype(np.int32))
+        boxes.append(xywh)
+        counts.append(len(cls))
+        status.append(OK if len(cls) else EMPTY)
+
+    return (
+        np.concatenate(classes) if classes else np.zeros(0, np.int32),
+        np.concatenate(boxes) if boxes else np.zeros((0, 4), np.float32),
+        np.array(counts, dtype=np.int64),
+        np.array(status, dtype=np.int8),
+    )
+
+def _stat(paths: list[str]) -> np.ndarray:
+    """(size, mtime_ns) of each label file, (-1, -1) if missing"""
+    out = np.full((len(paths), 2), -1, dtype=np.int64)
+    for i, p in enumerate(paths):
+        try:
+            st = os.stat(p)
+            out[i] = st.st_size, st.st_mtime_ns
+        except OSError:
+            pass
+    return out
+
+def write_index(path: str, files: list[str], arrays: dict):
+    """Write arrays and the file list into one packed file (atomic replace)"""
+    header, blobs, offset = {"files": files, "arrays": {}}, [], 0
+    for name, arr in arrays.items():
+        arr = np.ascontiguousarray(arr)
+        offset = -(-offset // _ALIGN) * _ALIGN
+        header["arrays"][name] = {"dtype": arr.dtype.str, "shape": list(arr.shape), "offset": offset}
+        blobs.append((offset, arr))
+        offset += arr.nbytes
+
+    raw = json.dumps(header).encode("utf-8")
+    base = -(-(len(_MAGIC) + 8 + len(raw)) // _ALIGN) * _ALIGN
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(_MAGIC + (base).to_bytes(8, "little") + raw)
+        for off, arr in blobs:
+            f.seek(base + off)
+            f.write(arr.tobytes())
+    os.replace(tmp, path)
+
+class LabelIndex:
+    """Zero-copy view of a packed label index with vectorized dataset queries"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            if f.read(len(_MAGIC)) != _MAGIC:
+                raise ValueError(f"ไม่ใช่ label index: {path}")
+            base = int.from_bytes(f.read(8), "little")
+            header = json.loads(f.read(base - len(_MAGIC) - 8).rstrip(b"\0 ").decode("utf-8"))
+        self.files = header["files"]
+        for name, spec in header["arrays"].items():
+            shape = tuple(spec["shape"])
+            if 0 in shape:
+                arr = np.zeros(shape, dtype=spec["dtype"])
+            else:
+                arr = np.memmap(path, dtype=spec["dtype"], mode="r", offset=base + spec["offset"], shape=shape)
+            setattr(self, name, arr)
+
+    @property
+    def num_images(self) -> int:
+        return len(self.offsets) - 1
+
+    def image_boxes(self, i: int) -> tuple[np.ndarray, np.ndarray]:
+        """(classes, boxes) of image i without copying"""
+        lo, hi = self.offsets[i], self.offsets[i + 1]
+        return self.classes[lo:hi], self.boxes[lo:hi]
+
+    def boxes_per_image(self) -> np.ndarray:
+        return np.diff(self.offsets)
+
+    def class_histogram(self, nc: int | None = None) -> np.ndarray:
+        """Number of boxes per class id"""
+        return np.bincount(self.classes, minlength=nc or 0)
+
+    def box_size_histogram(self, bins: list[float] = SIZE_BINS) -> np.ndarray:
+        """Histogram of sqrt(w*h) of normalized boxes"""
+        return np.histogram(np.sqrt(self.boxes[:, 2] * self.boxes[:, 3]), bins=bins)[0]
+
+    def files_with_status(self, code: int) -> list[str]:
+        return [self.files[i] for i in np.flatnonzero(self.status == code)]
+
+    def out_of_range_classes(self, nc: int) -> list[str]:
+        """Label files that contain a class id >= nc"""
+        image_of_box = np.repeat(np.arange(self.num_images), self.boxes_per_image())
+        return [self.files[i] for i in np.unique(image_of_box[self.classes >= nc])]
+
+def build_index(img_path: str, index_path: str, workers: int | None = INDEX_WORKERS) -> LabelIndex:
+    """
+    Build or incrementally update the label index of one split
+
+    Only label files whose size or mtime changed since the last build are parsed again.
+
+    Args:
+        img_path: Image directory or list file of the split
+        index_path: Output .lblidx path
+        workers: Number of processes
+
+    Returns:
+        Loaded LabelIndex
+    """
+    from train import list_image_files
+
+    labels = [img2label_path(f) for f in list_image_files(img_path)]
+    stat = _stat(labels)
+
+    old, old_rows = None, {}
+    if os.path.exists(index_path):
+        try:
+            old = LabelIndex(index_path)
+            old_rows = {f: i for i, f in enumerate(old.files)}
+        except (ValueError, KeyError, OSError):
+            old = None
+
+    reuse = np.full(len(labels), -1, dtype=np.int64)
+    if old is not None:
+        for i, f in enumerate(labels):
+            j = old_rows.get(f)
+            if j is not None and (old.stat[j] == stat[i]).all():
+                reuse[i] = j
+    todo = np.flatnonzero(reuse < 0)
+    print(f"🏷️  Label index: {len(labels)} ไฟล์, parse ใหม่ {len(todo)}, ใช้ของเดิม {len(labels) - len(todo)}")
+
+    parsed = {}
+    if len(todo):
+        tasks = [todo[i:i + FILES_PER_TASK] for i in range(0, len(todo), FILES_PER_TASK)]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for idx, result in zip(tasks, pool.map(_parse_labels, [[labels[i] for i in t] for t in tasks])):
+                parsed[int(idx[0])] = (idx, result)
+
+    # Assemble in image order from reused rows and freshly parsed batches
+    counts = np.zeros(len(labels), dtype=np.int64)
+    status = np.zeros(len(labels), dtype=np.int8)
+    if old is not None:
+        hit = reuse >= 0
+        counts[hit] = old.boxes_per_image()[reuse[hit]]
+        status[hit] = old.status[reuse[hit]]
+    for idx, (_, _, c, s) in parsed.values():
+        counts[idx], status[idx] = c, s
+
+    offsets = np.zeros(len(labels) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    classes = np.empty(offsets[-1], dtype=np.int32)
+    boxes = np.empty((offsets[-1], 4), dtype=np.float32)
+    for i in np.flatnonzero(reuse >= 0):
+        j = reuse[i]
+        classes[offsets[i]:offsets[i + 1]], boxes[offsets[i]:offsets[i + 1]] = old.image_boxes(j)
+    for idx, (cls, xywh, c, _) in parsed.values():
+        starts = np.concatenate([[0], np.cumsum(c)])
+        for k, i in enumerate(idx):
+            classes[offsets[i]:offsets[i + 1]] = cls[starts[k]:starts[k + 1]]
+            boxes[offsets[i]:offsets[i + 1]] = xywh[starts[k]:starts[k + 1]]
+
+    del old  # release the mapping before replacing the file (Windows)
+    Path(index_path).parent.mkdir(parents=True, exist_ok=True)
+    write_index(index_path, labels, {
+        "classes": classes, "boxes": boxes, "offsets": offsets, "status": status, "stat": stat,
+    })
+    return LabelIndex(index_path)
+
+def build_dataset_index(data_yaml: str) -> dict:
+    """
+    Build the label index of every split listed in data.yaml
+
+    Returns:
+        Dict of split name -> LabelIndex
+    """
+    from train import get_split_paths
+
+    root = Path(data_yaml).parent / INDEX_DIRNAME
+    return {
+        split: build_index(img_path, str(root / f"{split}.lblidx"))
+        for split, img_path in get_split_paths(data_yaml).items()
+    }
+
+def print_report(index: LabelIndex, split: str, names: list[str] | None = None):
+    """Print class histogram, box sizes and problem files of one split"""
+    nc = len(names) if names else None
+    hist = index.class_histogram(nc)
+    status = np.bincount(index.status, minlength=4)
+
+    print(f"\n📊 {split}: {index.num_images} ภาพ, {len(index.classes)} boxes")
+    print("   " + ", ".join(f"{STATUS_NAMES[c]}={status[c]}" for c in STATUS_NAMES))
+    for c, n in enumerate(hist):
+        if nc and c >= nc and not n:
+            continue
+        label = names[c] if names and c < len(names) else str(c)
+        print(f"   [{c}] {label:<20} {n}")
+    sizes = index.box_size_histogram()
+    print("   Box size (sqrt(wh)): " + ", ".join(
+        f"{lo:.2f}-{hi:.2f}: {n}" for lo, hi, n in zip(SIZE_BINS, SIZE_BINS[1:], sizes)))
+
+    problems = index.files_with_status(CORRUPT)
+    if nc:
+        problems += index.out_of_range_classes(nc)
+    for f in problems[:10]:
+        print(f"   ⚠️  {f}")
+    if len(problems) > 10:
+        print(f"   ... และอีก {len(problems) - 10} ไฟล์")
+
+def inspect_dataset(dataset_path: str) -> dict:
+    """
+    Build/update the label index of a dataset and print the report
+
+    Returns:
+        Dict of split name -> LabelIndex
+    """
+    import yaml
+    from train import get_data_yaml
+
+    data_yaml = get_data_yaml(dataset_path)
+    with open(data_yaml, encoding="utf-8") as f:
+        names = yaml.safe_load(f).get("names")
+    if isinstance(names, dict):
+        names = [names[k] for k in sorted(names)]
+
+    indexes = build_dataset_index(data_yaml)
+    for split, index in indexes.items():
+        print_report(index, split, names)
+    return indexes
+
+if __name__ == "__main__":
+    # Run standalone for testing
+    import sys
+
+    print("=" * 60)
+    print("       Label Index")
+    print("=" * 60)
+
+    if len(sys.argv) < 2:
+        print("Usage: python label_index.py <dataset_path>")
+        sys.exit(1)
+
+    inspect_dataset(sys.argv[1])
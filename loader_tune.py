@@ -0,0 +1,341 @@
+"""
+Dataloader Autotune Module
+Load-only benchmark of the train dataloader on the actual dataset and imgsz: tries decode backend,
+worker count, prefetch depth and pinned memory, compares images/s with how fast the model consumes
+them, and remembers the best setting per host and dataset
+
+The goal is the cheapest setting that keeps the model fed: the fewest workers whose throughput
+beats the model's forward/backward rate by HEADROOM. If no setting gets there the loader is the
+bottleneck and the fastest setting wins.
+"""
+import json
+import os
+import platform
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+# =============================================================================
+# AUTOTUNE CONFIGURATION
+# =============================================================================
+
+PROFILE_FILE = "loader_profiles.json"  # อยู่ใน PROJECT_NAME (เช่น runs/detect/loader_profiles.json)
+MEASURE_SECONDS = 5.0           # เวลาวัดต่อ 1 setting (หลัง warm-up)
+WORKER_GRID = (0, 1, 2, 4, 6, 8, 12, 16, 24, 32)  # จำนวน workers ที่ลอง (ตัดที่จำนวน core)
+PREFETCH_GRID = (2, 4, 8)       # prefetch_factor ที่ลอง (batch ต่อ worker)
+HEADROOM = 1.2                  # loader ต้องเร็วกว่า model อย่างน้อยเท่านี้ถึงจะถือว่า "พอ"
+MIN_GAIN = 0.05                 # ตัวเลือกอื่นต้องเร็วกว่าอย่างน้อย 5% ถึงจะเปลี่ยนจากค่า default
+CONSUMER_STEPS = 3              # จำนวน forward/backward ที่ใช้วัดความเร็วของ model
+
+# =============================================================================
+
+DEFAULT = {"workers": 8, "prefetch": 4, "pin_memory": True, "decode": "cv2"}
+REDUCED = {"reduced2": 2, "reduced4": 4, "reduced8": 8}  # JPEG DCT-scaled decode (cv2.IMREAD_REDUCED_*)
+
+def _cpu_count() -> int:
+    return len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+
+def host_id() -> dict:
+    """Identity of this machine for the profile key"""
+    import torch
+
+    gpu = torch.cuda.get_device_name(0) if torch.cuda.is_available() else None
+    return {"host": platform.node(), "cpus": _cpu_count(), "gpu": gpu}
+
+def profile_key(dataset_hash: str, imgsz: int, batch: int, cache, model_name: str, device) -> str:
+    host = host_id()
+    return "|".join(str(v) for v in (host["host"], host["cpus"], host["gpu"], dataset_hash,
+                                     imgsz, batch, cache, Path(model_name).stem, device))
+
+def decode_flag(decode: str, channels: int = 3) -> int | None:
+    """cv2 imread flag of a decode backend (None = Ultralytics' default)"""
+    import cv2
+
+    if decode not in REDUCED:
+        return None
+    gray = channels == 1
+    return {2: cv2.IMREAD_REDUCED_GRAYSCALE_2 if gray else cv2.IMREAD_REDUCED_COLOR_2,
+            4: cv2.IMREAD_REDUCED_GRAYSCALE_4 if gray else cv2.IMREAD_REDUCED_COLOR_4,
+            8: cv2.IMREAD_REDUCED_GRAYSCALE_8 if gray else cv2.IMREAD_REDUCED_COLOR_8}[REDUCED[decode]]
+
+def decode_backends(files: list[str], imgsz: int, samples: int = 32) -> list[str]:
+    """
+    Backends worth trying: plain cv2, plus reduced JPEG decodes that still leave the long side >= imgsz
+
+    Args:
+        files: Train images
+        imgsz: Training image size
+    """
+    from PIL import Image
+
+    step = max(1, len(files) // samples)
+    sample = files[::step][:samples]
+    if not sample or sum(Path(f).suffix.lower() in (".jpg", ".jpeg") for f in sample) < len(sample) / 2:
+        return ["cv2"]
+    long_side = []
+    for f in sample:
+        try:
+            with Image.open(f) as im:
+                long_side.append(max(im.size))
+        except OSError:
+            continue
+    smallest = min(long_side, default=0)
+    return ["cv2"] + [name for name, f in REDUCED.items() if smallest // f >= imgsz]
+
+@contextmanager
+def loader_options(prefetch: int | None, pin_memory: bool | None):
+    """Let Ultralytics' build_dataloader create its InfiniteDataLoader with other prefetch / pin settings"""
+    import torch
+    from ultralytics.data import build
+
+    loader_class = build.InfiniteDataLoader
+
+    def make(*args, **kwargs):
+        if prefetch and kwargs.get("num_workers"):
+            kwargs["prefetch_factor"] = prefetch
+        if pin_memory is not None:
+            kwargs["pin_memory"] = pin_memory and torch.cuda.is_available()
+        return loader_class(*args, **kwargs)
+
+    build.InfiniteDataLoader = make
+    try:
+        yield
+    finally:
+        build.InfiniteDataLoader = loader_class
+
+def consumer_rate(model_name: str, imgsz: int, batch: int, device: str, amp: bool = True,
+                  steps: int = CONSUMER_STEPS) -> float:
+    """
+    Images per second the model trains on (forward + backward, after one warm-up step)
+    """
+    import torch
+    from ultralytics import YOLO
+
+    model = YOLO(model_name).model.to(device).train()
+    for p in model.parameters():
+        p.requires_grad = True
+    cuda = device.startswith("cuda")
+    x = torch.rand(batch, 3, imgsz, imgsz, device=device)
+    times = []
+    for _ in range(steps + 1):
+        t0 = time.perf_counter()
+        with torch.autocast("cuda", enabled=cuda and amp):
+            y = model(x)
+        tensors = y if isinstance(y, (list, tuple)) else list(y.values()) if isinstance(y, dict) else [y]
+        sum(t.float().sum() for t in tensors if isinstance(t, torch.Tensor)).backward()
+        model.zero_grad(set_to_none=True)
+        if cuda:
+            torch.cuda.synchronize(device)
+        times.append(time.perf_counter() - t0)
+    del model, x
+    return batch / (sum(times[1:]) / steps)
+
+def _build_dataset(data_yaml: str, imgsz: int, batch: int, cache):
+    """The train dataset as training builds it (mmap store included; RAM cache measured as plain decode)"""
+    from ultralytics.cfg import get_cfg
+    from ultralytics.data import build_yolo_dataset
+    from ultralytics.data.dataset import YOLODataset
+    from ultralytics.data.utils import check_det_dataset
+
+    data = check_det_dataset(data_yaml)
+    cfg = get_cfg(overrides={"imgsz": imgsz, "cache": False, "data": data_yaml})
+    dataset = build_yolo_dataset(cfg, data["train"], batch, data, mode="train")
+    if cache == "mmap" and type(dataset) is YOLODataset:
+        from cache_store import STORE_DIRNAME, MemmapStore, MemmapYOLODataset, build_store
+        dataset.__class__ = MemmapYOLODataset
+        dataset.store = MemmapStore(build_store(data["train"], imgsz, str(Path(data_yaml).parent / STORE_DIRNAME)))
+    return dataset
+
+def measure(dataset, batch: int, workers: int, prefetch: int, pin_memory: bool, decode: str,
+            device: str, seconds: float = MEASURE_SECONDS) -> float:
+    """
+    Images per second one loader setting delivers (host → device copy included on CUDA)
+    """
+    import torch
+    from ultralytics.data import build_dataloader
+
+    default_flag = dataset.cv2_flag
+    dataset.cv2_flag = decode_flag(decode, getattr(dataset, "channels", 3)) or default_flag
+    with loader_options(prefetch, pin_memory):
+        loader = build_dataloader(dataset, batch, workers, shuffle=True, device=device)
+    cuda = device.startswith("cuda")
+
+    def batches():
+        while True:
+            yield from loader
+
+    try:
+        it = batches()
+        for _ in range(max(2, loader.num_workers)):  # worker start-up and the first prefetch
+            next(it)
+        images, t0 = 0, time.perf_counter()
+        while time.perf_counter() - t0 < seconds:
+            b = next(it)
+            if cuda:
+                b["img"].to(device, non_blocking=True)
+            images += b["img"].shape[0]
+        if cuda:
+            torch.cuda.synchronize(device)
+        return images / (time.perf_counter() - t0)
+    finally:
+        loader.close()
+        dataset.cv2_flag = default_flag
+
+def tune(data_yaml: str, model_name: str, imgsz: int, batch: int, cache, device: str, amp: bool = True) -> dict:
+    """
+    Search the loader settings for this machine, dataset and run configuration
+
+    Order: decode backend (file decode only), worker count (fewest that keep up), prefetch depth,
+    pinned memory (CUDA only) - each step keeps the previous choices.
+
+    Returns:
+        Profile dict: workers, prefetch, pin_memory, decode, imgsz, rates and all measurements
+    """
+    import torch
+
+    cuda = device.startswith("cuda")
+    cpus = _cpu_count()
+    print(f"\n⏱️  Autotune dataloader ({imgsz}px, batch {batch}, cache={cache}, {cpus} cores)...")
+    need = consumer_rate(model_name, imgsz, batch, device, amp)
+    target = need * HEADROOM
+    print(f"   Model ใช้ภาพ {need:.1f} ภาพ/วินาที → loader ควรได้ ≥ {target:.1f}")
+
+    dataset = _build_dataset(data_yaml, imgsz, batch, cache)
+    results = []
+
+    def run(**setting) -> float:
+        rate = measure(dataset, batch, device=device, **setting)
+        results.append({**setting, "images_per_s": round(rate, 1)})
+        print(f"   workers={setting['workers']:>2} prefetch={setting['prefetch']} pin={setting['pin_memory']!s:<5} "
+              f"decode={setting['decode']:<8} → {rate:8.1f} ภาพ/วินาที")
+        return rate
+
+    def better(rate: float, current: float) -> bool:
+        return rate > current * (1 + MIN_GAIN)
+
+    best = dict(DEFAULT, workers=min(4, cpus), pin_memory=cuda)
+    best_rate = None
+
+    # 1) Decode backend - only when images are decoded every epoch
+    backends = decode_backends(dataset.im_files, imgsz) if cache in (False, None, "disk") else ["cv2"]
+    for decode in backends:
+        rate = run(**dict(best, decode=decode))
+        if best_rate is None or better(rate, best_rate):
+            best, best_rate = dict(best, decode=decode), rate
+
+    # 2) Workers - the fewest that keep up; stop once more workers stop helping
+    grid = [w for w in WORKER_GRID if w <= cpus]
+    rates = {best["workers"]: best_rate}
+    for w in grid:
+        rate = rates.get(w) or run(**dict(best, workers=w))
+        rates[w] = rate
+        if rate >= target:
+            break
+        if len(rates) > 2 and rate < max(rates.values()) * (1 - MIN_GAIN):
+            break  # oversubscribed - more processes only compete for cores
+    keep_up = [w for w, r in rates.items() if r >= target]
+    workers = min(keep_up) if keep_up else max(rates, key=rates.get)
+    best, best_rate = dict(best, workers=workers), rates[workers]
+
+    # 3) Prefetch depth (worker processes only)
+    if best["workers"]:
+        for p in PREFETCH_GRID:
+            if p != best["prefetch"]:
+                rate = run(**dict(best, prefetch=p))
+                if better(rate, best_rate):
+                    best, best_rate = dict(best, prefetch=p), rate
+
+    # 4) Pinned memory (only matters for host → GPU copies)
+    if cuda:
+        rate = run(**dict(best, pin_memory=not best["pin_memory"]))
+        if better(rate, best_rate):
+            best, best_rate = dict(best, pin_memory=not best["pin_memory"]), rate
+
+    del dataset
+    torch.cuda.empty_cache() if cuda else None
+    profile = {
+        **best,
+        "imgsz": imgsz,
+        "images_per_s": round(best_rate, 1),
+        "model_images_per_s": round(need, 1),
+        "bottleneck": "model" if best_rate >= target else "dataloader",
+        **host_id(),
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "measurements": results,
+    }
+    print(f"✅ Loader: workers={best['workers']}, prefetch={best['prefetch']}, pin={best['pin_memory']}, "
+          f"decode={best['decode']} ({best_rate:.1f} ภาพ/วินาที, คอขวด: {profile['bottleneck']})")
+    return profile
+
+def load_or_tune(data_yaml: str, dataset_hash: str, model_name: str, imgsz: int, batch: int, cache, device,
+                 amp: bool = True, force: bool = False) -> dict:
+    """
+    Loader profile for this host + dataset + run configuration, tuned on first use
+
+    Args:
+        data_yaml: data.yaml of the run
+        dataset_hash: checkpoint_catalog.dataset_hash of it
+        device: DEVICE setting from train.py
+        force: Measure again even if a profile exists
+
+    Returns:
+        Profile dict (see tune)
+    """
+    from planner import _resolve_device
+    from train import PROJECT_NAME
+
+    dev = _resolve_device(device)
+    path = Path(PROJECT_NAME) / PROFILE_FILE
+    profiles = json.loads(path.read_text(encoding="utf-8")) if path.exists() else {}
+    key = profile_key(dataset_hash, imgsz, batch, cache, model_name, dev)
+    if key in profiles and not force:
+        p = profiles[key]
+        print(f"♻️  Loader profile ({p['created']}): workers={p['workers']}, prefetch={p['prefetch']}, "
+              f"pin={p['pin_memory']}, decode={p['decode']}")
+        return p
+
+    profiles[key] = tune(data_yaml, model_name, imgsz, batch, cache, dev, amp)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(profiles, indent=2), encoding="utf-8")
+    return profiles[key]
+
+def tuned_trainer(base, profile: dict):
+    """
+    Trainer class that builds its train loader with a loader profile (workers come from train args)
+
+    Args:
+        base: Trainer class to extend (DetectionTrainer, or e.g. MemmapDetectionTrainer)
+        profile: Profile from load_or_tune
+    """
+    from ultralytics.models.yolo.detect import DetectionTrainer
+
+    class TunedDetectionTrainer(base or DetectionTrainer):
+        def get_dataloader(self, dataset_path, batch_size=16, rank=0, mode="train"):
+            if mode != "train":
+                return super().get_dataloader(dataset_path, batch_size, rank, mode)
+            with loader_options(profile["prefetch"], profile["pin_memory"]):
+                return super().get_dataloader(dataset_path, batch_size, rank, mode)
+
+        def build_dataset(self, img_path, mode="train", batch=None):
+            dataset = super().build_dataset(img_path, mode=mode, batch=batch)
+            # Reduced decodes were chosen for the final size - smaller progressive stages read pyramid images
+            flag = decode_flag(profile["decode"], getattr(dataset, "channels", 3))
+            if mode == "train" and flag is not None and self.args.imgsz == profile["imgsz"]:
+                dataset.cv2_flag = flag
+            return dataset
+
+    return TunedDetectionTrainer
+
+if __name__ == "__main__":
+    # python loader_tune.py <dataset_path> [batch]   → measure again and store the profile
+    import sys
+    from checkpoint_catalog import dataset_hash
+    from train import AMP, BATCH_SIZE, CACHE, DEVICE, IMAGE_SIZE, MODEL_NAME, get_data_yaml
+
+    if len(sys.argv) < 2:
+        print("Usage: python loader_tune.py <dataset_path> [batch]")
+        sys.exit(1)
+    data_yaml = get_data_yaml(sys.argv[1])
+    batch = int(sys.argv[2]) if len(sys.argv) > 2 else BATCH_SIZE if isinstance(BATCH_SIZE, int) else 16
+    cache = CACHE if CACHE != "auto" else False
+    load_or_tune(data_yaml, dataset_hash(data_yaml), MODEL_NAME, IMAGE_SIZE, batch, cache, DEVICE, AMP, force=True)
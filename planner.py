@@ -0,0 +1,269 @@
+"""
+Training Planner Module
+Probes peak memory for the configured model and picks batch size and cache mode
+"""
+import gc
+import json
+import shutil
+import threading
+import time
+from pathlib import Path
+
+# =============================================================================
+# PLANNER CONFIGURATION
+# =============================================================================
+
+PROBE_BATCHES = (1, 2, 4, 8)    # batch sizes ที่ใช้ทดลอง (forward + backward)
+GPU_FRACTION = 0.70             # ใช้ GPU memory ไม่เกินสัดส่วนนี้
+RAM_FRACTION = 0.60             # ใช้ RAM ที่ว่างอยู่ไม่เกินสัดส่วนนี้ (CPU training + cache)
+WORKER_RAM_MB = 400             # RAM โดยประมาณต่อ dataloader worker
+MAX_BATCH = 256                 # batch size สูงสุดที่จะเลือก
+FOOTPRINT_SAMPLES = 64          # จำนวนภาพที่สุ่มมาวัดขนาด dataset
+PLAN_FILENAME = "plan.json"     # ชื่อไฟล์ที่บันทึกไว้ใน run directory
+
+# =============================================================================
+
+def _resolve_device(device) -> str:
+    """Map the DEVICE setting to a torch device string"""
+    import torch
+
+    if str(device).lower() != "cpu" and torch.cuda.is_available():
+        return f"cuda:{str(device).split(',')[0]}"
+    return "cpu"
+
+class _RssSampler:
+    """Samples process RSS in a background thread and keeps the peak"""
+
+    def __init__(self, interval: float = 0.005):
+        import psutil
+
+        self.proc = psutil.Process()
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+
+    def __enter__(self):
+        self.base = self.proc.memory_info().rss
+        self.peak = self.base
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self.proc.memory_info().rss)
+            time.sleep(self.interval)
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.proc.memory_info().rss)
+
+def probe_memory(model_name: str, imgsz: int, device: str, amp: bool = True) -> dict:
+    """
+    Run short forward/backward steps and record peak memory per batch size
+
+    Args:
+        model_name: Ultralytics model (e.g. yolo11l.pt)
+        imgsz: Training image size
+        device: torch device string
+        amp: Use autocast on CUDA (same as AMP in training)
+
+    Returns:
+        Dict with per-batch peaks (MB), step times and parameter memory
+    """
+    import torch
+    from ultralytics import YOLO
+
+    model = YOLO(model_name).model.to(device).train()
+    for p in model.parameters():
+        p.requires_grad = True
+    param_mb = sum(p.numel() * p.element_size() for p in model.parameters()) / 2**20
+    cuda = device.startswith("cuda")
+
+    # CPU: measure against the RSS after loading the model - freed activations stay in the
+    # allocator, so a per-probe baseline would under-count larger batches
+    rss_base = _RssSampler().proc.memory_info().rss
+    probes = []
+    for b in PROBE_BATCHES:
+        x = torch.rand(b, 3, imgsz, imgsz, device=device)
+        gc.collect()
+        try:
+            if cuda:
+                torch.cuda.empty_cache()
+                torch.cuda.reset_peak_memory_stats(device)
+                base = torch.cuda.memory_allocated(device)
+            t0 = time.perf_counter()
+            with _RssSampler() as rss:
+                with torch.autocast("cuda", enabled=cuda and amp):
+                    y = model(x)
+                tensors = y if isinstance(y, (list, tuple)) else list(y.values()) if isinstance(y, dict) else [y]
+                sum(t.float().sum() for t in tensors if isinstance(t, torch.Tensor)).backward()
+            if cuda:
+                torch.cuda.synchronize(device)
+                peak = (torch.cuda.max_memory_allocated(device) - base) / 2**20
+            else:
+                peak = (rss.peak - rss_base) / 2**20
+            probes.append({"batch": b, "peak_mb": round(peak, 1), "step_s": round(time.perf_counter() - t0, 3)})
+            print(f"   batch {b:>3}: peak {peak:8.1f} MB, {probes[-1]['step_s']:.2f}s")
+        except torch.cuda.OutOfMemoryError:
+            print(f"   batch {b:>3}: ❌ out of memory")
+            break
+        finally:
+            model.zero_grad(set_to_none=True)
+            del x
+
+    del model
+    gc.collect()
+    if cuda:
+        torch.cuda.empty_cache()
+    return {"param_mb": round(param_mb, 1), "probes": probes}
+
+def measure_dataset(data_yaml: str, imgsz: int) -> dict:
+    """
+    Estimate how much memory the train split needs when cached
+
+    Returns:
+        Dict with image count, RAM cache footprint, mmap store footprint and free disk (MB)
+    """
+    import random
+    from PIL import Image
+    from train import get_split_paths, list_image_files
+
+    im_files = list_image_files(get_split_paths(data_yaml)["train"])
+    sample = random.Random(0).sample(im_files, min(FOOTPRINT_SAMPLES, len(im_files)))
+
+    pixels = []
+    for f in sample:
+        with Image.open(f) as im:  # header only, no decode
+            w, h = im.size
+        r = imgsz / max(w, h)
+        pixels.append(min(round(w * r), imgsz) * min(round(h * r), imgsz))
+    mean_pixels = sum(pixels) / max(len(pixels), 1)
+
+    return {
+        "images": len(im_files),
+        "ram_footprint_mb": round(len(im_files) * mean_pixels * 3 / 2**20, 1),
+        "store_footprint_mb": round(len(im_files) * imgsz * imgsz * 3 / 2**20, 1),
+        "disk_free_mb": round(shutil.disk_usage(Path(data_yaml).parent).free / 2**20, 1),
+    }
+
+def fit_batch(probes: list[dict], budget_mb: float) -> tuple[int, list[float]]:
+    """
+    Fit peak = slope * batch + intercept and return the largest batch within budget
+
+    Returns:
+        Tuple of (batch size, [slope, intercept])
+    """
+    if len(probes) < 2:
+        return 1, [probes[0]["peak_mb"] if probes else 0.0, 0.0]
+    xs = [p["batch"] for p in probes]
+    ys = [p["peak_mb"] for p in probes]
+    mx, my = sum(xs) / len(xs), sum(ys) / len(ys)
+    slope = sum((x - mx) * (y - my) for x, y in zip(xs, ys)) / sum((x - mx) ** 2 for x in xs)
+    slope = max(slope, 1e-3)
+    intercept = my - slope * mx
+    return max(1, min(MAX_BATCH, int((budget_mb - intercept) / slope))), [round(slope, 2), round(intercept, 1)]
+
+def make_plan(data_yaml: str, model_name: str, imgsz: int, device, workers: int, amp: bool = True) -> dict:
+    """
+    Probe memory and choose batch size and cache mode for this machine
+
+    Args:
+        data_yaml: Path to data.yaml
+        model_name: Ultralytics model
+        imgsz: Training image size
+        device: DEVICE setting from train.py
+        workers: Dataloader workers
+        amp: AMP setting
+
+    Returns:
+        Plan dict with 'batch', 'cache' and the 'measurements' behind them
+    """
+    import psutil
+    import torch
+
+    dev = _resolve_device(device)
+    print(f"\n🧮 วางแผน batch size / cache ({model_name}, imgsz={imgsz}, {dev})...")
+    probe = probe_memory(model_name, imgsz, dev, amp)
+    dataset = measure_dataset(data_yaml, imgsz)
+
+    available_mb = psutil.virtual_memory().available / 2**20
+    workers_mb = workers * WORKER_RAM_MB
+    # Optimizer (2 moments) + EMA copy are not part of the forward/backward probe
+    state_mb = probe["param_mb"] * 3
+
+    # Host RAM that training needs regardless of the cache (CPU: at the largest probed batch)
+    cuda = dev.startswith("cuda")
+    min_train_mb = 0 if cuda or not probe["probes"] else probe["probes"][-1]["peak_mb"] + state_mb
+    host_need_mb = workers_mb + (probe["param_mb"] * 4 if cuda else min_train_mb)
+    ram_budget_mb = available_mb * RAM_FRACTION
+
+    # RAM cache only if it fits next to training; otherwise the disk-backed mmap store
+    if dataset["ram_footprint_mb"] < ram_budget_mb - host_need_mb:
+        cache = True
+    elif dataset["store_footprint_mb"] * 1.1 < dataset["disk_free_mb"]:
+        cache = "mmap"
+    else:
+        cache = False
+    cache_mb = dataset["ram_footprint_mb"] if cache is True else 0
+
+    if cuda:
+        total_mb = torch.cuda.get_device_properties(dev).total_memory / 2**20
+        budget_mb = total_mb * GPU_FRACTION - state_mb
+    else:
+        total_mb = None
+        budget_mb = ram_budget_mb - workers_mb - cache_mb - state_mb
+    batch, fit = fit_batch(probe["probes"], budget_mb)
+    batch = min(batch, dataset["images"])
+
+    plan = {
+        "batch": batch,
+        "cache": cache,
+        "model": model_name,
+        "imgsz": imgsz,
+        "device": dev,
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "measurements": {
+            **probe,
+            "fit_mb_per_image": fit,
+            "budget_mb": round(budget_mb, 1),
+            "device_total_mb": round(total_mb, 1) if total_mb else None,
+            "available_ram_mb": round(available_mb, 1),
+            "host_need_mb": round(host_need_mb, 1),
+            "dataset": dataset,
+        },
+    }
+    print(f"✅ Plan: batch={batch}, cache={cache} "
+          f"(budget {budget_mb:.0f} MB, dataset {dataset['ram_footprint_mb']:.0f} MB ในแรม)")
+    return plan
+
+def attach_plan(model, plan: dict):
+    """Register a callback that saves the plan into the run directory"""
+
+    def save_plan(trainer):
+        (Path(trainer.save_dir) / PLAN_FILENAME).write_text(json.dumps(plan, indent=2), encoding="utf-8")
+
+    model.add_callback("on_pretrain_routine_start", save_plan)
+
+def load_plan(run_dir: str) -> dict | None:
+    """Load the plan saved with a run, or None"""
+    path = Path(run_dir) / PLAN_FILENAME
+    if not path.exists():
+        return None
+    return json.loads(path.read_text(encoding="utf-8"))
+
+if __name__ == "__main__":
+    # Run standalone for testing
+    import sys
+    from train import AMP, DEVICE, IMAGE_SIZE, MODEL_NAME, WORKERS, get_data_yaml
+
+    print("=" * 60)
+    print("       Training Planner")
+    print("=" * 60)
+
+    if len(sys.argv) < 2:
+        print("Usage: python planner.py <dataset_path>")
+        sys.exit(1)
+
+    print(json.dumps(make_plan(get_data_yaml(sys.argv[1]), MODEL_NAME, IMAGE_SIZE, DEVICE, WORKERS, AMP), indent=2))
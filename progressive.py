@@ -0,0 +1,219 @@
+"""
+Progressive Resize Module
+Early epochs train at smaller image sizes from a pre-built image pyramid, later epochs at the final imgsz
+
+Pyramid layout (inside the dataset, one level per size):
+    .pyramid/<size>/<image path relative to dataset>   downscaled image (long side = size)
+    .pyramid/<size>/<...>/labels/<name>.txt            copy of the label (normalized - unchanged)
+    .pyramid/<size>/train.txt                           image list in the same order as the train split
+"""
+import hashlib
+import math
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from copy import copy
+from pathlib import Path
+
+# =============================================================================
+# PROGRESSIVE RESIZE CONFIGURATION
+# =============================================================================
+
+PYRAMID_DIRNAME = ".pyramid"    # โฟลเดอร์เก็บภาพย่อ (อยู่ใน dataset)
+PYRAMID_WORKERS = None          # จำนวน process (None = ทุก core)
+FILES_PER_TASK = 64             # จำนวนภาพต่อ task ที่ส่งให้ process pool
+JPEG_QUALITY = 95               # คุณภาพ JPEG ของภาพย่อ
+
+# =============================================================================
+
+KEEP_SUFFIXES = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
+
+def stage_size(epoch: int, epochs: int, schedule, final: int) -> int:
+    """
+    imgsz for a 0-based epoch
+
+    Args:
+        epoch: Current epoch (0-based, as trainer.epoch)
+        epochs: Total epochs of the run
+        schedule: Sequence of (start fraction of epochs, imgsz or None = final)
+        final: Final imgsz
+
+    Returns:
+        imgsz rounded down to a multiple of 32, never above final
+    """
+    size = final
+    for start, s in sorted(schedule, key=lambda x: x[0]):
+        if epoch >= math.floor(start * epochs):
+            size = _round(s, final)
+    return size
+
+def _round(size: int | None, final: int) -> int:
+    return final if size is None else min(final, max(32, size // 32 * 32))
+
+def pyramid_sizes(schedule, final: int) -> list[int]:
+    """Sizes that need a pyramid level (everything below final)"""
+    return sorted({_round(s, final) for _, s in schedule} - {final})
+
+def _level_path(src: str, root: Path, size: int) -> Path:
+    try:
+        rel = Path(os.path.abspath(src)).relative_to(root)
+    except ValueError:  # split outside the dataset directory
+        parent = Path(os.path.abspath(src)).parent
+        rel = Path("_ext") / hashlib.sha1(str(parent.parent).encode()).hexdigest()[:8] / parent.name / Path(src).name
+    if rel.suffix.lower() not in KEEP_SUFFIXES:
+        rel = rel.with_suffix(".jpg")
+    return root / PYRAMID_DIRNAME / str(size) / rel
+
+def _downscale(tasks: list[tuple[str, str, list[tuple[int, str]]]]) -> int:
+    """
+    Decode each source image once and write every pyramid level (runs in a worker process)
+
+    Args:
+        tasks: (image, label, [(size, level image path), ...]) per image
+
+    Returns:
+        Number of images that could not be decoded
+    """
+    import cv2
+    from label_index import img2label_path
+
+    failed = 0
+    for src, label, levels in tasks:
+        im = cv2.imread(src)
+        if im is None:
+            failed += 1
+            continue
+        h0, w0 = im.shape[:2]
+        for size, dst in levels:
+            r = size / max(h0, w0)
+            out = im
+            if r < 1:
+                out = cv2.resize(im, (min(math.ceil(w0 * r), size), min(math.ceil(h0 * r), size)),
+                                 interpolation=cv2.INTER_AREA)
+            Path(dst).parent.mkdir(parents=True, exist_ok=True)
+            tmp = f"{dst}.tmp{Path(dst).suffix}"
+            cv2.imwrite(tmp, out, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+            os.replace(tmp, dst)
+
+            dst_label = img2label_path(dst)
+            Path(dst_label).parent.mkdir(parents=True, exist_ok=True)
+            if os.path.exists(label):
+                shutil.copy2(label, dst_label)
+            elif os.path.exists(dst_label):
+                os.remove(dst_label)
+    return failed
+
+def _stale(src: str, label: str, dst: Path) -> bool:
+    from label_index import img2label_path
+
+    try:
+        st = os.stat(dst)
+    except OSError:
+        return True
+    if st.st_mtime < os.stat(src).st_mtime:
+        return True
+    dst_label = img2label_path(str(dst))
+    if os.path.exists(label):
+        return not os.path.exists(dst_label) or os.stat(dst_label).st_mtime < os.stat(label).st_mtime
+    return os.path.exists(dst_label)
+
+def build_pyramid(data_yaml: str, sizes: list[int], workers: int | None = PYRAMID_WORKERS) -> dict[int, str]:
+    """
+    Build (or update) the downscaled copies of the train split
+
+    Only images whose level is missing or older than the source are written again.
+
+    Args:
+        data_yaml: Path to data.yaml (the train split may be a list file, e.g. data_dedup.yaml)
+        sizes: Pyramid sizes
+        workers: Number of processes
+
+    Returns:
+        Dict of size -> image list file for that level
+    """
+    from label_index import img2label_path
+    from train import get_split_paths, list_image_files
+
+    root = Path(data_yaml).resolve().parent
+    files = list_image_files(get_split_paths(data_yaml)["train"])
+    levels = {size: [_level_path(f, root, size) for f in files] for size in sizes}
+
+    tasks = []
+    for i, f in enumerate(files):
+        label = img2label_path(f)
+        todo = [(size, str(levels[size][i])) for size in sizes if _stale(f, label, levels[size][i])]
+        if todo:
+            tasks.append((f, label, todo))
+    print(f"🔻 Pyramid {sizes}: {len(files)} ภาพ, ย่อใหม่ {len(tasks)}, ใช้ของเดิม {len(files) - len(tasks)}")
+
+    if tasks:
+        chunks = [tasks[i:i + FILES_PER_TASK] for i in range(0, len(tasks), FILES_PER_TASK)]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            failed = sum(pool.map(_downscale, chunks))
+        if failed:
+            print(f"   ⚠️  decode ไม่ได้ {failed} ภาพ (Ultralytics จะข้ามภาพเหล่านี้)")
+
+    lists = {}
+    for size in sizes:
+        path = root / PYRAMID_DIRNAME / str(size) / "train.txt"
+        path.write_text("\n".join(str(p) for p in levels[size]) + "\n", encoding="utf-8")
+        lists[size] = str(path)
+    return lists
+
+def attach_progressive(model, data_yaml: str, schedule, final: int, epochs: int) -> dict:
+    """
+    Register the resolution schedule on a YOLO model before model.train()
+
+    The stage is derived from trainer.epoch alone, so a resumed run (resume_training) switches
+    straight to the stage of the epoch it continues from. Validation always runs at final.
+
+    Args:
+        model: YOLO model
+        data_yaml: data.yaml the run trains on
+        schedule: Sequence of (start fraction of epochs, imgsz or None = final)
+        final: Final imgsz (the run's imgsz)
+        epochs: Total epochs of the run
+
+    Returns:
+        Dict of size -> pyramid list file
+    """
+    lists = build_pyramid(data_yaml, pyramid_sizes(schedule, final))
+    state = {"size": final}  # the trainer builds its own loader at the final size
+
+    def switch_stage(trainer):
+        from ultralytics.utils import LOCAL_RANK
+
+        size = stage_size(trainer.epoch, trainer.epochs, schedule, final)
+        if size == state["size"]:
+            return
+        old = trainer.train_loader
+        trainer.args.imgsz = size  # only while building - checkpoints and validation keep the final size
+        try:
+            loader = trainer.get_dataloader(lists.get(size, trainer.data["train"]),
+                                            batch_size=trainer.batch_size // max(trainer.world_size, 1),
+                                            rank=LOCAL_RANK, mode="train")
+        finally:
+            trainer.args.imgsz = final
+        if getattr(old.dataset, "mosaic", True) is False:  # switched after close_mosaic
+            loader.dataset.mosaic = False
+            loader.dataset.close_mosaic(hyp=copy(trainer.args))
+        if hasattr(old, "close"):
+            old.close()
+        trainer.train_loader = loader
+        state["size"] = size
+        print(f"\n🔀 Epoch {trainer.epoch + 1}: เปลี่ยน imgsz เป็น {size}")
+
+    model.add_callback("on_train_epoch_start", switch_stage)
+    return lists
+
+if __name__ == "__main__":
+    # Build the pyramid standalone: python progressive.py <dataset_path> [size ...]
+    import sys
+    from train import IMAGE_SIZE, PROGRESSIVE_SCHEDULE, get_data_yaml
+
+    if len(sys.argv) < 2:
+        print("Usage: python progressive.py <dataset_path> [size ...]")
+        sys.exit(1)
+    sizes = [int(s) for s in sys.argv[2:]] or pyramid_sizes(PROGRESSIVE_SCHEDULE, IMAGE_SIZE)
+    for size, path in build_pyramid(get_data_yaml(sys.argv[1]), sizes).items():
+        print(f"✅ {size}: {path}")
@@ -2,8 +2,6 @@
 Resume Training Module
 Handles resuming training from the last checkpoint
 """
-import os
-import glob
 from pathlib import Path
 
 # Training configuration
@@ -12,53 +10,53 @@ WEIGHTS_DIR = "weights"
 
 def find_latest_checkpoint() -> tuple[str | None, str | None]:
     """
-    Find the latest training checkpoint
+    Find the latest resumable training checkpoint
     
     Returns:
         Tuple of (checkpoint_path, run_name) or (None, None) if not found
     """
+    from checkpoint_catalog import all_checkpoints, latest_resumable, refresh
+    
     runs_path = Path(RUNS_DIR)
     
     if not runs_path.exists():
         print(f"❌ ไม่พบโฟลเดอร์ {RUNS_DIR}")
         return None, None
     
-    # Find all training runs
-    train_runs = list(runs_path.glob("train*"))
+    # Incremental catalog refresh - only new/changed checkpoints are read
+    conn = refresh(RUNS_DIR, WEIGHTS_DIR)
+    checkpoints = all_checkpoints(conn)
     
-    if not train_runs:
+    if not checkpoints:
         print("❌ ไม่พบประวัติการ Training")
         return None, None
     
-    # Sort by modification time (newest first)
-    train_runs.sort(key=lambda x: x.stat().st_mtime, reverse=True)
+    runs = {}
+    for ckpt in checkpoints:  # newest first
+        runs.setdefault(ckpt["run"], []).append(ckpt)
     
-    print(f"🔍 พบการ Training {len(train_runs)} ครั้ง:")
+    print(f"🔍 พบการ Training {len(runs)} ครั้ง:")
     print()
     
-    for i, run in enumerate(train_runs[:5], 1):  # Show latest 5
-        weights_path = run / WEIGHTS_DIR
-        last_pt = weights_path / "last.pt"
-        best_pt = weights_path / "best.pt"
-        
+    for i, (run, ckpts) in enumerate(list(runs.items())[:5], 1):  # Show latest 5
         status = []
-        if last_pt.exists():
-            status.append("last.pt ✅")
-        if best_pt.exists():
-            status.append("best.pt ✅")
+        for ckpt in ckpts:
+            if ckpt["file"] in ("last.pt", "best.pt"):
+                epoch = f" epoch {ckpt['epoch'] + 1}" if ckpt["resumable"] else ""
+                status.append(f"{ckpt['file']} ✅{epoch}")
         
         status_str = ", ".join(status) if status else "ไม่มี checkpoint"
-        print(f"   [{i}] {run.name} - {status_str}")
+        print(f"   [{i}] {run} - {status_str}")
     
-    # Use the latest run
-    latest_run = train_runs[0]
-    last_checkpoint = latest_run / WEIGHTS_DIR / "last.pt"
+    # Use the latest run that can still be resumed
+    latest = latest_resumable(conn)
+    conn.close()
     
-    if last_checkpoint.exists():
-        print(f"\n✅ พบ Checkpoint ล่าสุด: {last_checkpoint}")
-        return str(last_checkpoint), latest_run.name
+    if latest:
+        print(f"\n✅ พบ Checkpoint ล่าสุด: {latest['path']}")
+        return latest["path"], latest["run"]
     else:
-        print(f"\n⚠️  ไม่พบ last.pt ใน {latest_run.name}")
+        print("\n⚠️  ไม่พบ last.pt ที่ Resume ได้")
         return None, None
 
 def resume_training(checkpoint_path: str | None = None):
@@ -73,8 +71,20 @@ def resume_training(checkpoint_path: str | None = None):
     
     if checkpoint_path is None:
         checkpoint_path, run_name = find_latest_checkpoint()
+        if checkpoint_path is None:
+            checkpoint_path, run_name = restore_synced_checkpoint()
+        runs_dir = RUNS_DIR  # also runs that were killed before their first last.pt
     else:
         run_name = Path(checkpoint_path).parent.parent.name
+        from ckpt_store import resolve_checkpoint
+        checkpoint_path = resolve_checkpoint(checkpoint_path)  # .ptref snapshot → rebuilt .pt
+        runs_dir = None
+    
+    # A mid-epoch checkpoint newer than last.pt continues at the batch where the run stopped
+    from step_ckpt import newer_step_checkpoint
+    step_path = newer_step_checkpoint(checkpoint_path, runs_dir)
+    if step_path != checkpoint_path:
+        checkpoint_path, run_name = step_path, Path(step_path).parent.parent.name
     
     if checkpoint_path is None:
         print("\n❌ ไม่พบ Checkpoint สำหรับ Resume")
@@ -92,17 +102,52 @@ def resume_training(checkpoint_path: str | None = None):
         return False
     
     # Start resume training
+    sync = {"syncer": None}
     try:
         from ultralytics import YOLO
         
+        # Resume training with the cache mode chosen for the run ("mmap" reopens the existing store)
+        from planner import load_plan
+        from train import CACHE, DEDUP_CHECKPOINTS, INSTRUMENT, STEP_CHECKPOINTS, SYNC_DIR, get_cache_overrides
+        plan = load_plan(Path(checkpoint_path).parent.parent)
+        if plan and plan.get("ddp"):
+            return resume_ddp(checkpoint_path, plan)
+        
         print("\n🏋️ กำลังโหลด Model จาก Checkpoint...")
         model = YOLO(checkpoint_path)
         
         print("🚀 เริ่ม Resume Training...")
         print("=" * 60)
         
-        # Resume training
-        results = model.train(resume=True)
+        overrides = get_cache_overrides(plan["cache"] if plan else CACHE)
+        overrides.pop("cache")
+        if plan and plan.get("loader"):
+            # Same tuned dataloader as the original run
+            from loader_tune import tuned_trainer
+            overrides.update(trainer=tuned_trainer(overrides.get("trainer"), plan["loader"]),
+                             workers=plan["loader"]["workers"])
+        if plan and plan.get("distill"):
+            # Same teacher cache and loss as the original distillation run
+            from distill import distill_trainer
+            overrides["trainer"] = distill_trainer(overrides.get("trainer"), plan["distill"])
+        if plan and plan.get("progressive"):
+            # Same schedule as the original run; the stage follows from the epoch being resumed
+            from progressive import attach_progressive
+            args = model.ckpt["train_args"]
+            attach_progressive(model, args["data"], plan["progressive"], args["imgsz"], args["epochs"])
+        from step_ckpt import STEP_FILE, attach_step_checkpoints
+        if STEP_CHECKPOINTS or Path(checkpoint_path).name == STEP_FILE:
+            attach_step_checkpoints(model)  # also restores the position when resuming from step.pt
+        if INSTRUMENT:
+            from instrument import attach_instrumentation
+            attach_instrumentation(model)
+        if DEDUP_CHECKPOINTS:
+            from ckpt_store import attach_store
+            attach_store(model, synced=bool(SYNC_DIR))
+        if SYNC_DIR:
+            from run_sync import attach_syncer
+            sync = attach_syncer(model, SYNC_DIR)
+        results = model.train(resume=True, **overrides)
         
         print("\n" + "=" * 60)
         print("✅ Training เสร็จสิ้น!")
@@ -117,28 +162,103 @@ def resume_training(checkpoint_path: str | None = None):
     except Exception as e:
         print(f"\n❌ เกิดข้อผิดพลาด: {str(e)}")
         return False
+        
+    finally:
+        if sync["syncer"]:
+            sync["syncer"].stop()
+
+def resume_ddp(checkpoint_path: str, plan: dict) -> bool:
+    """
+    Relaunch the gloo workers of a DDP run (see ddp_cpu.py) from its last.pt
+    
+    Args:
+        checkpoint_path: Resumable last.pt
+        plan: Plan saved with the run
+    """
+    import torch
+    from ddp_cpu import train_ddp
+    from step_ckpt import STEP_FILE
+    from train import DEDUP_CHECKPOINTS, INSTRUMENT, STEP_CHECKPOINTS, SYNC_DIR
+    
+    args = torch.load(checkpoint_path, map_location="cpu", weights_only=False)["train_args"]
+    attach = {"instrument": INSTRUMENT, "store": DEDUP_CHECKPOINTS, "sync": SYNC_DIR,
+              "step": STEP_CHECKPOINTS or Path(checkpoint_path).name == STEP_FILE,
+              "progressive": [args["data"], plan["progressive"], args["imgsz"], args["epochs"]]
+              if plan.get("progressive") else None}
+    ddp = plan["ddp"]
+    print(f"🚀 เริ่ม Resume Training (DDP: {ddp['workers']} workers × {ddp['nodes']} เครื่อง)...")
+    print("=" * 60)
+    train = {"resume": True, "cache": "mmap"} if plan["cache"] == "mmap" else {"resume": True}
+    train_ddp(checkpoint_path, train, attach, ddp["workers"], ddp["nodes"])
+    
+    print("\n" + "=" * 60)
+    print("✅ Training เสร็จสิ้น!")
+    return True
+
+def restore_synced_checkpoint() -> tuple[str | None, str | None]:
+    """
+    Bring back the latest resumable run from SYNC_DIR (e.g. after a preempted machine)
+    
+    Returns:
+        Tuple of (local checkpoint_path, run_name) or (None, None) if nothing was synced
+    """
+    from train import SYNC_DIR
+    
+    if not SYNC_DIR or not Path(SYNC_DIR).exists():
+        return None, None
+    
+    from checkpoint_catalog import latest_resumable, refresh
+    from run_sync import restore_run
+    
+    print(f"\n☁️  ค้นหา Checkpoint ที่ sync ไว้ใน {SYNC_DIR}...")
+    conn = refresh(SYNC_DIR, WEIGHTS_DIR)
+    latest = latest_resumable(conn)
+    conn.close()
+    if latest is None:
+        return None, None
+    
+    local_run = Path(RUNS_DIR) / latest["run"]
+    print(f"   กู้คืน {latest['run']} → {local_run}")
+    return restore_run(str(Path(latest["path"]).parent.parent), str(local_run)), latest["run"]
 
 def list_checkpoints():
-    """List all available checkpoints"""
+    """
+    List all available checkpoints
+    
+    size_mb is the logical checkpoint size; disk_mb is what it really occupies
+    (snapshots in the checkpoint store share deduplicated tensors with other checkpoints)
+    """
+    from checkpoint_catalog import all_checkpoints, refresh
+    from ckpt_store import disk_usage
+    
     runs_path = Path(RUNS_DIR)
     
     if not runs_path.exists():
         print("❌ ไม่พบประวัติการ Training")
         return []
     
-    checkpoints = []
-    
-    for run in runs_path.glob("train*"):
-        weights_path = run / WEIGHTS_DIR
-        
-        for weight_file in weights_path.glob("*.pt"):
-            checkpoints.append({
-                "run": run.name,
-                "file": weight_file.name,
-                "path": str(weight_file),
-                "size_mb": weight_file.stat().st_size / (1024 * 1024),
-                "modified": weight_file.stat().st_mtime
-            })
+    conn = refresh(RUNS_DIR, WEIGHTS_DIR)
+    rows = all_checkpoints(conn)
+    disk = disk_usage([ckpt["path"] for ckpt in rows])
+    checkpoints = [
+        {
+            "run": ckpt["run"],
+            "file": ckpt["file"],
+            "path": ckpt["path"],
+            "size_mb": ckpt["size"] / (1024 * 1024),
+            "disk_mb": disk[ckpt["path"]] / (1024 * 1024),
+            "modified": ckpt["mtime_ns"] / 1e9,
+            "epoch": ckpt["epoch"],
+            "best_fitness": ckpt["best_fitness"],
+            "map50": ckpt["map50"],
+            "map": ckpt["map"],
+            "resumable": bool(ckpt["resumable"]),
+            "dataset_hash": ckpt["dataset_hash"],
+            "file_hash": ckpt["file_hash"],
+        }
+        for ckpt in rows
+    ]
+    conn.close()
     
     return checkpoints
 
@@ -22,54 +22,42 @@ def download_dataset(force_download: bool = False) -> str | None:
     Returns:
         Path to the downloaded dataset, or None if failed
     """
-    try:
-        from roboflow import Roboflow
-    except ImportError:
-        print("❌ ไม่พบ roboflow package")
-        print("   กรุณารัน: pip install roboflow")
-        print("   ถ้าใช้ Colab: !pip install roboflow")
-        return None
-    
+    from robo_fetch import FetchError, fetch_dataset, load_manifest, manifest_path_for
+
     # Check if dataset already exists
     expected_path = os.path.join(os.getcwd(), f"{PROJECT_NAME}-{VERSION_NUMBER}")
     if DOWNLOAD_LOCATION:
         expected_path = os.path.abspath(DOWNLOAD_LOCATION)
     
-    if os.path.exists(expected_path) and not force_download:
+    # Same version already fetched -> only re-check on request (a new version is always a delta update)
+    manifest = load_manifest(manifest_path_for(expected_path))
+    same_version = manifest["source"].get("version") == VERSION_NUMBER
+    if os.path.exists(expected_path) and same_version and not force_download:
         print(f"✅ พบ Dataset ที่มีอยู่แล้ว: {expected_path}")
-        user_input = input("   ต้องการดาวน์โหลดใหม่หรือไม่? (y/N): ").strip().lower()
+        user_input = input("   ต้องการตรวจสอบ/อัปเดตไฟล์ที่เปลี่ยนหรือไม่? (y/N): ").strip().lower()
         if user_input != 'y':
             print("   ใช้ Dataset ที่มีอยู่")
             return expected_path
+    elif os.path.exists(expected_path) and manifest["files"]:
+        print(f"🔄 อัปเดต Dataset v{manifest['source'].get('version')} → v{VERSION_NUMBER} (โหลดเฉพาะไฟล์ที่เปลี่ยน)")
     
     print(f"\n📦 กำลังเชื่อมต่อกับ Roboflow...")
     print(f"   Workspace: {WORKSPACE_NAME}")
     print(f"   Project: {PROJECT_NAME}")
     print(f"   Version: {VERSION_NUMBER}")
     print(f"   Format: {DATASET_FORMAT}")
-    if DOWNLOAD_LOCATION:
-        print(f"   Location: {os.path.abspath(DOWNLOAD_LOCATION)}")
+    print(f"   Location: {expected_path}")
     print()
     
     try:
-        # Initialize Roboflow
-        rf = Roboflow(api_key=ROBOFLOW_API_KEY)
-        
-        # Get project
-        project = rf.workspace(WORKSPACE_NAME).project(PROJECT_NAME)
-        
-        # Get version
-        version = project.version(VERSION_NUMBER)
-        
-        # Download dataset
+        # Parallel, resumable, delta-aware fetch of the export zip
         print("⬇️  กำลังดาวน์โหลด Dataset...")
-        if DOWNLOAD_LOCATION:
-            dataset = version.download(DATASET_FORMAT, location=DOWNLOAD_LOCATION)
-        else:
-            dataset = version.download(DATASET_FORMAT)
+        fetch_dataset(
+            ROBOFLOW_API_KEY, WORKSPACE_NAME, PROJECT_NAME, VERSION_NUMBER, DATASET_FORMAT, expected_path
+        )
         
         # Get the actual download location
-        dataset_path = dataset.location
+        dataset_path = expected_path
         
         print(f"\n✅ ดาวน์โหลดสำเร็จ!")
         print(f"   📁 Location: {dataset_path}")
@@ -84,8 +72,20 @@ def download_dataset(force_download: bool = False) -> str | None:
             else:
                 print(f"   📄 {item}")
         
+        # Build/update the label index and report class balance and broken labels
+        try:
+            from label_index import inspect_dataset
+            inspect_dataset(dataset_path)
+        except Exception as e:
+            print(f"\n⚠️  ตรวจสอบ labels ไม่สำเร็จ: {e}")
+        
         return dataset_path
         
+    except FetchError as e:
+        print(f"\n❌ ดาวน์โหลดไม่สำเร็จ: {str(e)}")
+        print("   รันใหม่อีกครั้งเพื่อโหลดต่อจากที่ค้างไว้ (ไฟล์ที่เสร็จแล้วจะถูกข้าม)")
+        return None
+        
     except Exception as e:
         print(f"\n❌ เกิดข้อผิดพลาด: {str(e)}")
         print("\n🔧 วิธีแก้ไข:")
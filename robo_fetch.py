@@ -0,0 +1,478 @@
+"""
+Dataset Fetch Engine
+Parallel, resumable, delta-aware download of Roboflow exports
+
+The export zip is never downloaded as a whole: its central directory is read with
+an HTTP Range request, every entry's CRC32 is compared with the local manifest and
+only new or changed entries are fetched (coalesced into chunked Range requests and
+downloaded concurrently).
+"""
+import json
+import os
+import struct
+import threading
+import time
+import urllib.error
+import urllib.request
+import zlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+# =============================================================================
+# FETCH CONFIGURATION
+# =============================================================================
+
+ROBOFLOW_API_URL = os.environ.get("ROBOFLOW_API_URL", "https://api.roboflow.com")  # ชี้ไป local stand-in ได้
+FETCH_WORKERS = 8               # จำนวน connection พร้อมกัน
+CHUNK_SIZE = 8 * 1024 * 1024    # ขนาดสูงสุดของ Range request หนึ่งครั้ง (bytes)
+MAX_RETRIES = 5                 # จำนวนครั้งที่ลองใหม่ต่อ request
+TIMEOUT = 60                    # Timeout ต่อ request (วินาที)
+EXPORT_TIMEOUT = 600            # รอ Roboflow สร้าง export ที่ยังไม่มีได้นานสุด (วินาที)
+EXPORT_POLL_INTERVAL = 5        # ถามสถานะ export ทุก ๆ กี่วินาที
+MANIFEST_SUFFIX = ".manifest.json"
+PARTS_DIRNAME = ".fetch_parts"  # ไฟล์ที่โหลดค้างไว้ (resume ได้)
+
+# =============================================================================
+
+_EOCD_SIG = 0x06054B50
+_EOCD64_SIG = 0x06064B50
+_EOCD64_LOC_SIG = 0x07064B50
+_CDIR_SIG = 0x02014B50
+_LOCAL_SIG = 0x04034B50
+
+class FetchError(Exception):
+    """Raised when the export cannot be fetched after all retries"""
+
+def _request(url: str, start: int | None = None, end: int | None = None, method: str = "GET"):
+    """
+    Perform one HTTP request with retries and exponential backoff
+
+    Args:
+        url: URL to fetch
+        start: First byte of the range (negative = suffix range)
+        end: Last byte of the range (inclusive)
+        method: HTTP method
+
+    Returns:
+        Tuple of (status, headers, body)
+    """
+    headers = {"User-Agent": "train-model-yolo"}
+    if start is not None:
+        headers["Range"] = f"bytes={start}" if start < 0 else f"bytes={start}-{'' if end is None else end}"
+
+    for attempt in range(MAX_RETRIES):
+        try:
+            req = urllib.request.Request(url, headers=headers, method=method)
+            with urllib.request.urlopen(req, timeout=TIMEOUT) as resp:
+                body = resp.read() if method != "HEAD" else b""
+                if start is not None and start >= 0 and end is not None and resp.status == 206:
+                    if len(body) != end - start + 1:
+                        raise urllib.error.URLError(f"short read {len(body)}/{end - start + 1}")
+                return resp.status, resp.headers, body
+        except urllib.error.HTTPError as e:
+            if e.code < 500 and e.code != 429:
+                raise FetchError(f"HTTP {e.code}: {url}") from e
+            error = e
+        except (urllib.error.URLError, OSError) as e:
+            error = e
+        time.sleep(min(2**attempt * 0.5, 15))
+    raise FetchError(f"ดาวน์โหลดไม่สำเร็จหลังลอง {MAX_RETRIES} ครั้ง: {error}")
+
+def get_export_link(api_key: str, workspace: str, project: str, version: int, fmt: str) -> str:
+    """
+    Ask the Roboflow API (or the local stand-in) for the export zip link
+
+    A format that has not been exported yet is generated on request (like the roboflow SDK):
+    the export is triggered once and the endpoint is polled until the link appears.
+
+    Returns:
+        URL of the export zip
+    """
+    url = f"{ROBOFLOW_API_URL.rstrip('/')}/{workspace}/{project}/{version}/{fmt}?api_key={api_key}"
+    deadline = time.monotonic() + EXPORT_TIMEOUT
+    data = json.loads(_request(url)[2])
+    if "link" not in data.get("export", {}):
+        print(f"   ⏳ กำลังให้ Roboflow สร้าง export ({fmt}) ...")
+        data = json.loads(_request(url, method="POST")[2])
+    while "link" not in data.get("export", {}):
+        if time.monotonic() >= deadline:
+            raise FetchError(f"Roboflow ยังสร้าง export ไม่เสร็จใน {EXPORT_TIMEOUT}s: {data}")
+        if "progress" in data:
+            print(f"   ⏳ สร้าง export {float(data['progress']) * 100:.0f}%")
+        time.sleep(EXPORT_POLL_INTERVAL)
+        data = json.loads(_request(url)[2])
+    return data["export"]["link"]
+
+def read_zip_index(url: str) -> tuple[list[dict], int]:
+    """
+    Read the central directory of a remote zip with Range requests
+
+    Args:
+        url: URL of the zip
+
+    Returns:
+        Tuple of (entries, central directory offset). Each entry has
+        name, crc32, method, flags, compressed, size and offset.
+    """
+    status, headers, tail = _request(url, -(65536 + 22))
+    if status != 206:
+        raise FetchError("Server ไม่รองรับ HTTP Range")
+    total = int(headers["Content-Range"].rsplit("/", 1)[1])
+    tail_start = total - len(tail)
+
+    pos = tail.rfind(struct.pack("<I", _EOCD_SIG))
+    if pos < 0:
+        raise FetchError("ไม่พบ End of Central Directory - ไฟล์ไม่ใช่ zip")
+    _, _, _, _, count, cd_size, cd_offset, _ = struct.unpack_from("<IHHHHIIH", tail, pos)
+
+    loc = pos - 20
+    if loc >= 0 and struct.unpack_from("<I", tail, loc)[0] == _EOCD64_LOC_SIG:
+        eocd64 = struct.unpack_from("<Q", tail, loc + 8)[0]
+        if eocd64 >= tail_start:
+            rec = tail[eocd64 - tail_start:]
+        else:
+            rec = _request(url, eocd64, eocd64 + 55)[2]
+        if struct.unpack_from("<I", rec)[0] == _EOCD64_SIG:
+            count, cd_size, cd_offset = struct.unpack_from("<QQQ", rec, 32)
+
+    if cd_offset >= tail_start:
+        cdir = tail[cd_offset - tail_start:cd_offset - tail_start + cd_size]
+    else:
+        cdir = _request(url, cd_offset, cd_offset + cd_size - 1)[2]
+
+    entries, p = [], 0
+    for _ in range(count):
+        (sig, _, _, flags, method, _, _, crc, csize, usize,
+         nlen, xlen, clen, _, _, _, offset) = struct.unpack_from("<IHHHHHHIIIHHHHHII", cdir, p)
+        if sig != _CDIR_SIG:
+            raise FetchError("Central directory เสียหาย")
+        raw_name = cdir[p + 46:p + 46 + nlen]
+        extra = cdir[p + 46 + nlen:p + 46 + nlen + xlen]
+        name = raw_name.decode("utf-8" if flags & 0x800 else "cp437")
+
+        # Zip64 extra field holds the 64-bit values that overflowed
+        x = 0
+        while x + 4 <= len(extra):
+            tag, size = struct.unpack_from("<HH", extra, x)
+            if tag == 1:
+                vals, q = list(struct.unpack_from(f"<{size // 8}Q", extra, x + 4)), 0
+                if usize == 0xFFFFFFFF:
+                    usize, q = vals[q], q + 1
+                if csize == 0xFFFFFFFF:
+                    csize, q = vals[q], q + 1
+                if offset == 0xFFFFFFFF:
+                    offset = vals[q]
+            x += 4 + size
+
+        entries.append({
+            "name": name, "crc32": crc, "method": method, "flags": flags,
+            "compressed": csize, "size": usize, "offset": offset,
+        })
+        p += 46 + nlen + xlen + clen
+
+    # Each entry spans from its local header up to the next entry (or the central directory)
+    ordered = sorted(entries, key=lambda e: e["offset"])
+    for e, nxt in zip(ordered, ordered[1:] + [None]):
+        e["end"] = nxt["offset"] if nxt else cd_offset
+    return entries, cd_offset
+
+def _safe_path(root: Path, name: str) -> Path:
+    """Resolve a zip entry name inside root (rejects path traversal)"""
+    target = (root / name).resolve()
+    if root.resolve() not in target.parents and target != root.resolve():
+        raise FetchError(f"ชื่อไฟล์ใน zip ไม่ปลอดภัย: {name}")
+    return target
+
+def _extract_entry(entry: dict, blob: bytes, root: Path):
+    """Decompress one entry from its raw bytes, verify CRC32 and write it atomically"""
+    sig, _, _, _, _, _, _, _, _, nlen, xlen = struct.unpack_from("<IHHHHHIIIHH", blob)
+    if sig != _LOCAL_SIG:
+        raise FetchError(f"Local header เสียหาย: {entry['name']}")
+    data = blob[30 + nlen + xlen:30 + nlen + xlen + entry["compressed"]]
+
+    if entry["method"] == 8:
+        data = zlib.decompressobj(-15).decompress(data)
+    elif entry["method"] != 0:
+        raise FetchError(f"ไม่รองรับการบีบอัดแบบ {entry['method']}: {entry['name']}")
+    if zlib.crc32(data) != entry["crc32"]:
+        raise FetchError(f"CRC32 ไม่ตรง: {entry['name']}")
+
+    target = _safe_path(root, entry["name"])
+    target.parent.mkdir(parents=True, exist_ok=True)
+    tmp = target.with_name(target.name + ".tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, target)
+
+class _Fetcher:
+    """Shared state of one fetch run (manifest, counters, locks)"""
+
+    def __init__(self, url: str, root: Path, manifest: dict, manifest_path: Path):
+        self.url = url
+        self.root = root
+        self.manifest = manifest
+        self.manifest_path = manifest_path
+        self.lock = threading.Lock()
+        self.downloaded = 0
+        self.done_since_save = 0
+
+    def record(self, entry: dict):
+        """Add a finished entry to the manifest (flushed periodically so a kill can resume)"""
+        with self.lock:
+            self.manifest["files"][entry["name"]] = {"crc32": entry["crc32"], "size": entry["size"]}
+            self.done_since_save += 1
+            if self.done_since_save >= 200:
+                save_manifest(self.manifest_path, self.manifest)
+                self.done_since_save = 0
+
+    def fetch_group(self, group: list[dict]):
+        """Fetch adjacent entries with a single Range request"""
+        start, end = group[0]["offset"], group[-1]["end"] - 1
+        blob = _request(self.url, start, end)[2]
+        with self.lock:
+            self.downloaded += len(blob)
+        for e in group:
+            _extract_entry(e, blob[e["offset"] - start:e["end"] - start], self.root)
+            self.record(e)
+
+    def fetch_large(self, entry: dict):
+        """Fetch one entry bigger than CHUNK_SIZE into a resumable .part file"""
+        parts = self.root / PARTS_DIRNAME
+        parts.mkdir(parents=True, exist_ok=True)
+        part = parts / f"{entry['crc32']:08x}_{entry['offset']}.part"
+        span = entry["end"] - entry["offset"]
+
+        have = part.stat().st_size if part.exists() else 0
+        with open(part, "ab") as f:
+            while have < span:
+                hi = min(have + CHUNK_SIZE, span) - 1
+                blob = _request(self.url, entry["offset"] + have, entry["offset"] + hi)[2]
+                f.write(blob)
+                f.flush()
+                have += len(blob)
+                with self.lock:
+                    self.downloaded += len(blob)
+
+        _extract_entry(entry, part.read_bytes(), self.root)
+        part.unlink()
+        self.record(entry)
+
+def manifest_path_for(location: str) -> Path:
+    """Manifest lives next to the dataset directory, e.g. ./data.manifest.json"""
+    loc = Path(location).resolve()
+    return loc.with_name(loc.name + MANIFEST_SUFFIX)
+
+def load_manifest(path: Path) -> dict:
+    """Load the per-file checksum manifest (empty if missing or unreadable)"""
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {"source": {}, "files": {}}
+
+def save_manifest(path: Path, manifest: dict):
+    """Write the manifest atomically"""
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(json.dumps(manifest, ensure_ascii=False), encoding="utf-8")
+    os.replace(tmp, path)
+
+def _file_crc32(path: Path) -> int:
+    """CRC32 of a local file, read in 1 MB chunks"""
+    crc = 0
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            crc = zlib.crc32(block, crc)
+    return crc
+
+def plan_delta(entries: list[dict], manifest: dict, root: Path) -> tuple[list[dict], list[dict], list[str]]:
+    """
+    Compare the remote zip index with the local manifest
+
+    Returns:
+        Tuple of (entries to fetch, entries already present, local files to delete)
+    """
+    files = manifest.get("files", {})
+    fetch, keep = [], []
+    for e in entries:
+        if e["name"].endswith("/"):
+            continue
+        old = files.get(e["name"])
+        local = root / e["name"]
+        if not local.exists() or local.stat().st_size != e["size"]:
+            fetch.append(e)
+        elif old and old["crc32"] == e["crc32"] and old["size"] == e["size"]:
+            keep.append(e)
+        elif not old and _file_crc32(local) == e["crc32"]:
+            # Dataset extracted before the manifest existed - adopt identical files
+            files[e["name"]] = {"crc32": e["crc32"], "size": e["size"]}
+            keep.append(e)
+        else:
+            fetch.append(e)
+    remote = {e["name"] for e in entries}
+    stale = [name for name in files if name not in remote]
+    return fetch, keep, stale
+
+def fetch_export(url: str, location: str, source: dict | None = None, workers: int = FETCH_WORKERS) -> dict:
+    """
+    Mirror a remote export zip into location, fetching only what changed
+
+    Args:
+        url: URL of the export zip (must support HTTP Range)
+        location: Destination directory
+        source: Metadata stored in the manifest (workspace, project, version...)
+        workers: Concurrent connections
+
+    Returns:
+        Stats dict (files, fetched, skipped, deleted, bytes, skipped_bytes, seconds, mb_per_s)
+    """
+    root = Path(location).resolve()
+    root.mkdir(parents=True, exist_ok=True)
+    mpath = manifest_path_for(location)
+    manifest = load_manifest(mpath)
+
+    t0 = time.time()
+    entries, _ = read_zip_index(url)
+    fetch, keep, stale = plan_delta(entries, manifest, root)
+
+    # Remove files that no longer exist in this version
+    for name in stale:
+        _safe_path(root, name).unlink(missing_ok=True)
+        manifest["files"].pop(name, None)
+    manifest["source"] = source or {}
+    save_manifest(mpath, manifest)
+
+    skipped_bytes = sum(e["size"] for e in keep)
+    print(f"   📋 {len(entries)} ไฟล์ใน export: ต้องโหลด {len(fetch)}, ข้าม {len(keep)}, ลบ {len(stale)}")
+
+    # Coalesce adjacent entries into Range requests of at most CHUNK_SIZE
+    groups, large = [], []
+    for e in sorted(fetch, key=lambda e: e["offset"]):
+        if e["end"] - e["offset"] > CHUNK_SIZE:
+            large.append(e)
+        elif groups and groups[-1][-1]["end"] == e["offset"] \
+                and e["end"] - groups[-1][0]["offset"] <= CHUNK_SIZE:
+            groups[-1].append(e)
+        else:
+            groups.append([e])
+
+    fetcher = _Fetcher(url, root, manifest, mpath)
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(fetcher.fetch_group, g) for g in groups]
+            futures += [pool.submit(fetcher.fetch_large, e) for e in large]
+            for i, fut in enumerate(as_completed(futures), 1):
+                fut.result()
+                if i % 50 == 0 or i == len(futures):
+                    mb = fetcher.downloaded / 1e6
+                    print(f"   ⬇️  {i}/{len(futures)} requests, {mb:.1f} MB")
+    finally:
+        save_manifest(mpath, manifest)
+
+    seconds = max(time.time() - t0, 1e-9)
+    stats = {
+        "files": len(entries),
+        "fetched": len(fetch),
+        "skipped": len(keep),
+        "deleted": len(stale),
+        "bytes": fetcher.downloaded,
+        "skipped_bytes": skipped_bytes,
+        "seconds": seconds,
+        "mb_per_s": fetcher.downloaded / 1e6 / seconds,
+    }
+    print(f"   🚀 {stats['mb_per_s']:.2f} MB/s, โหลด {stats['bytes'] / 1e6:.1f} MB, "
+          f"ข้าม {skipped_bytes / 1e6:.1f} MB ({stats['seconds']:.1f}s)")
+    return stats
+
+def fetch_dataset(api_key: str, workspace: str, project: str, version: int, fmt: str, location: str) -> dict:
+    """
+    Resolve the export link for a dataset version and mirror it into location
+
+    Returns:
+        Stats dict from fetch_export
+    """
+    link = get_export_link(api_key, workspace, project, version, fmt)
+    source = {"workspace": workspace, "project": project, "version": version, "format": fmt}
+    return fetch_export(link, location, source=source)
+
+# =============================================================================
+# LOCAL STAND-IN FOR THE ROBOFLOW EXPORT ENDPOINT (offline testing)
+# =============================================================================
+
+def serve_exports(export_dir: str, host: str = "127.0.0.1", port: int = 8765):
+    """
+    Serve {export_dir}/{version}.zip as a Roboflow-like export API with Range support
+
+    GET/POST /{workspace}/{project}/{version}/{format} returns {"export": {"link": ...}}
+    and GET/HEAD /export/{version}.zip serves the zip (single byte ranges only).
+
+    Returns:
+        The running ThreadingHTTPServer (call shutdown() to stop)
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    root = Path(export_dir).resolve()
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_HEAD(self):
+            self.do_GET(head=True)
+
+        def do_POST(self):
+            self.do_GET()  # exports are always ready here; POST (generate export) answers like GET
+
+        def do_GET(self, head: bool = False):
+            path = self.path.split("?", 1)[0].strip("/").split("/")
+            if len(path) == 4:
+                link = f"http://{host}:{self.server.server_port}/export/{path[2]}.zip"
+                body = json.dumps({"export": {"link": link}}).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                return
+
+            zip_path = root / path[-1]
+            if len(path) != 2 or path[0] != "export" or not zip_path.is_file():
+                self.send_error(404)
+                return
+
+            data = zip_path.read_bytes()
+            total, rng = len(data), self.headers.get("Range")
+            if rng:
+                spec = rng.split("=", 1)[1]
+                lo, hi = spec.split("-", 1)
+                if not lo:
+                    lo, hi = max(total - int(hi), 0), total - 1
+                else:
+                    lo, hi = int(lo), min(int(hi), total - 1) if hi else total - 1
+                self.send_response(206)
+                self.send_header("Content-Range", f"bytes {lo}-{hi}/{total}")
+                data = data[lo:hi + 1]
+            else:
+                self.send_response(200)
+            self.send_header("Accept-Ranges", "bytes")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            if not head:
+                self.wfile.write(data)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+if __name__ == "__main__":
+    # Run a local stand-in: python robo_fetch.py serve <export_dir> [port]
+    import sys
+
+    if len(sys.argv) >= 3 and sys.argv[1] == "serve":
+        port = int(sys.argv[3]) if len(sys.argv) > 3 else 8765
+        srv = serve_exports(sys.argv[2], port=port)
+        print(f"🌐 Local Roboflow stand-in: http://127.0.0.1:{port}  (ตั้ง ROBOFLOW_API_URL ให้ชี้มาที่นี่)")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            srv.shutdown()
+    else:
+        print("Usage: python robo_fetch.py serve <export_dir> [port]")
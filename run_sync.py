@@ -0,0 +1,218 @@
+"""
+Run Sync Module
+Mirrors a training run directory to durable storage in the background
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+# =============================================================================
+# SYNC CONFIGURATION
+# =============================================================================
+
+SYNC_INTERVAL = 30          # วินาที ระหว่างรอบ sync (หรือเร็วกว่านั้นเมื่อมีการ save checkpoint)
+CHUNK_SIZE = 4 * 1024 * 1024  # ขนาด chunk ที่ใช้ hash / copy
+STATE_NAME = ".sync_state.json"
+LOG_NAME = ".sync_log.jsonl"
+
+# =============================================================================
+
+def hash_file(path: str, chunk: int = CHUNK_SIZE) -> str:
+    """SHA1 of a file read in chunks"""
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def copy_to_tmp(src: str, dst: str, chunk: int = CHUNK_SIZE) -> tuple[str, int, str]:
+    """
+    Copy a file in chunks to dst.tmp (fsynced); the caller renames it over dst once the copy is known good
+
+    Returns:
+        Tuple of (tmp path, bytes copied, sha1 of the copied content)
+    """
+    Path(dst).parent.mkdir(parents=True, exist_ok=True)
+    tmp = f"{dst}.tmp"
+    h, n = hashlib.sha1(), 0
+    with open(src, "rb") as fin, open(tmp, "wb") as fout:
+        for block in iter(lambda: fin.read(chunk), b""):
+            h.update(block)
+            fout.write(block)
+            n += len(block)
+        fout.flush()
+        os.fsync(fout.fileno())
+    return tmp, n, h.hexdigest()
+
+class RunSyncer:
+    """
+    Background mirror of one directory
+
+    Only files whose size/mtime changed are considered; their content hash is compared
+    with the last synced hash so touched-but-identical files are not copied again.
+    """
+
+    def __init__(self, src: str, dst: str, interval: float = SYNC_INTERVAL):
+        self.src = Path(src)
+        self.dst = Path(dst)
+        self.interval = interval
+        self.dst.mkdir(parents=True, exist_ok=True)
+        self.state = self._load_state()
+        self.stats = {"rounds": 0, "files": 0, "bytes": 0, "copy_s": 0.0, "max_lag_s": 0.0, "last_lag_s": 0.0}
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _load_state(self) -> dict:
+        try:
+            return json.loads((self.dst / STATE_NAME).read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return {}
+
+    def _save_state(self):
+        tmp = self.dst / (STATE_NAME + ".tmp")
+        tmp.write_text(json.dumps(self.state), encoding="utf-8")
+        os.replace(tmp, self.dst / STATE_NAME)
+
+    def sync_once(self) -> dict:
+        """
+        Run one sync round (thread-safe, also usable without the background thread)
+
+        Returns:
+            Round stats (files, bytes, seconds)
+        """
+        with self._lock:
+            t0, files, nbytes = time.time(), 0, 0
+            for root, _, names in os.walk(self.src):
+                for name in names:
+                    if name.endswith(".tmp") or name in (STATE_NAME, LOG_NAME):
+                        continue
+                    src = os.path.join(root, name)
+                    rel = os.path.relpath(src, self.src)
+                    try:
+                        st = os.stat(src)
+                    except FileNotFoundError:
+                        continue
+                    old = self.state.get(rel)
+                    if old and old["size"] == st.st_size and old["mtime_ns"] == st.st_mtime_ns:
+                        continue
+
+                    dst = str(self.dst / rel)
+                    if old and old["size"] == st.st_size and os.path.exists(dst) and hash_file(src) == old["sha1"]:
+                        old["mtime_ns"] = st.st_mtime_ns  # touched, content unchanged
+                        continue
+
+                    c0 = time.time()
+                    tmp, n, sha1 = copy_to_tmp(src, dst)
+                    after = os.stat(src)
+                    if (after.st_size, after.st_mtime_ns) != (st.st_size, st.st_mtime_ns):
+                        # Written while copying (last.pt is not saved atomically): keep the previous good copy
+                        os.unlink(tmp)
+                        continue
+                    os.replace(tmp, dst)
+                    self.state[rel] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha1": sha1}
+
+                    lag = time.time() - st.st_mtime_ns / 1e9
+                    files, nbytes = files + 1, nbytes + n
+                    self.stats["copy_s"] += time.time() - c0
+                    self.stats["last_lag_s"] = lag
+                    self.stats["max_lag_s"] = max(self.stats["max_lag_s"], lag)
+                    self._log({"time": time.time(), "file": rel, "bytes": n, "lag_s": round(lag, 3),
+                               "mb_per_s": round(n / 1e6 / max(time.time() - c0, 1e-9), 2)})
+
+            if files:
+                self._save_state()
+            self.stats["rounds"] += 1
+            self.stats["files"] += files
+            self.stats["bytes"] += nbytes
+            return {"files": files, "bytes": nbytes, "seconds": time.time() - t0}
+
+    def _log(self, record: dict):
+        with open(self.dst / LOG_NAME, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.sync_once()
+            except Exception as e:  # any error would otherwise end the thread silently
+                print(f"⚠️  Sync ล้มเหลว (จะลองใหม่รอบถัดไป): {e}")
+
+    def start(self):
+        """Start the background thread"""
+        self._thread = threading.Thread(target=self._run, name="run-sync", daemon=True)
+        self._thread.start()
+        return self
+
+    def notify(self):
+        """Ask for a sync round soon (called after a checkpoint save - never blocks)"""
+        self._wake.set()
+
+    def stop(self, final_sync: bool = True):
+        """Stop the thread and optionally run one last round"""
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join()
+        if final_sync:
+            # Runs from finally blocks: a failing target must not replace the training result / Ctrl+C
+            try:
+                self.sync_once()
+            except Exception as e:
+                print(f"⚠️  Sync รอบสุดท้ายล้มเหลว - ข้อมูลล่าสุดอาจยังไม่อยู่ใน {self.dst}: {e}")
+        mb = self.stats["bytes"] / 1e6
+        bw = mb / self.stats["copy_s"] if self.stats["copy_s"] else 0.0
+        print(f"☁️  Sync: {self.stats['files']} ไฟล์, {mb:.1f} MB, {bw:.1f} MB/s, "
+              f"lag สูงสุด {self.stats['max_lag_s']:.1f}s → {self.dst}")
+
+def attach_syncer(model, sync_dir: str, interval: float = SYNC_INTERVAL) -> dict:
+    """
+    Mirror the run directory of model.train() to sync_dir/<run name> while training
+
+    Returns:
+        Holder dict; holder["syncer"] is set once training has created its save_dir
+    """
+    holder = {"syncer": None}
+
+    def on_pretrain_routine_start(trainer):
+        save_dir = Path(trainer.save_dir)
+        holder["syncer"] = RunSyncer(str(save_dir), str(Path(sync_dir) / save_dir.name), interval).start()
+        print(f"☁️  Background sync: {save_dir} → {holder['syncer'].dst}")
+
+    def on_model_save(trainer):
+        if holder["syncer"]:
+            holder["syncer"].notify()
+
+    model.add_callback("on_pretrain_routine_start", on_pretrain_routine_start)
+    model.add_callback("on_model_save", on_model_save)
+    return holder
+
+def restore_run(sync_run_dir: str, local_run_dir: str) -> str:
+    """
+    Copy a synced run back to the local runs directory (changed files only)
+
+    Returns:
+        Path of the local last.pt
+    """
+    RunSyncer(sync_run_dir, local_run_dir).sync_once()
+    # The local copy is a source again, not a mirror
+    (Path(local_run_dir) / STATE_NAME).unlink(missing_ok=True)
+    (Path(local_run_dir) / LOG_NAME).unlink(missing_ok=True)
+    return str(Path(local_run_dir) / "weights" / "last.pt")
+
+if __name__ == "__main__":
+    # One-shot sync: python run_sync.py <run_dir> <target_dir>
+    import sys
+
+    if len(sys.argv) < 3:
+        print("Usage: python run_sync.py <run_dir> <target_dir>")
+        sys.exit(1)
+
+    syncer = RunSyncer(sys.argv[1], sys.argv[2])
+    print(syncer.sync_once())
@@ -0,0 +1,411 @@
+"""
+Inference Server Module
+Serves a trained model on CPU: warm model pool, threaded decode/letterbox and dynamic micro-batching
+"""
+import asyncio
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+# =============================================================================
+# SERVER CONFIGURATION
+# =============================================================================
+
+SERVE_HOST = "127.0.0.1"
+SERVE_PORT = 8080
+SERVE_IMGSZ = None        # None = imgsz ที่ใช้ตอน Training (อ่านจาก checkpoint)
+MODEL_REPLICAS = 1        # จำนวน model ใน pool (แต่ละตัวใช้ cores // MODEL_REPLICAS threads)
+MAX_BATCH = 8             # ภาพสูงสุดต่อ micro-batch
+MAX_WAIT_MS = 10          # รอรวม batch นานสุดเท่านี้หลังได้ request แรก
+MAX_QUEUE = 64            # request ที่รับไว้แล้วแต่ยังไม่เสร็จ สูงสุด (เกินนี้ตอบ 429)
+DECODE_WORKERS = 4        # threads สำหรับ decode + letterbox
+CONF = 0.25               # confidence threshold
+IOU = 0.7                 # NMS IoU threshold
+MAX_DET = 300             # detection สูงสุดต่อภาพ
+STATS_WINDOW = 5000       # จำนวน latency ล่าสุดที่ใช้คำนวณ p50/p99
+MAX_BODY = 20 * 1024 ** 2 # ขนาด body สูงสุดต่อ request (เกินนี้ตอบ 413 แล้วปิด connection)
+
+# =============================================================================
+
+class Overloaded(Exception):
+    """Raised when MAX_QUEUE requests are already in flight"""
+
+class BadRequest(Exception):
+    """Raised for a request that cannot be parsed; the connection is answered with `status` and closed"""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+class _Request:
+    __slots__ = ("canvas", "shape", "ratio_pad", "future", "t0")
+
+    def __init__(self, canvas, shape, ratio_pad, future, t0):
+        self.canvas, self.shape, self.ratio_pad, self.future, self.t0 = canvas, shape, ratio_pad, future, t0
+
+class InferenceServer:
+    """
+    Micro-batching detector
+
+    Requests are decoded and letterboxed in a thread pool, then queued. Each model replica
+    takes the first waiting request, collects more until MAX_BATCH or MAX_WAIT_MS, and runs
+    the whole batch in one forward pass on its own thread.
+    """
+
+    def __init__(self, weights: str, imgsz: int | None = SERVE_IMGSZ, replicas: int = MODEL_REPLICAS,
+                 max_batch: int = MAX_BATCH, max_wait_ms: float = MAX_WAIT_MS, max_queue: int = MAX_QUEUE,
+                 conf: float = CONF, iou: float = IOU):
+        self.weights = weights
+        self.imgsz = imgsz
+        self.replicas = replicas
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.max_queue = max_queue
+        self.conf, self.iou = conf, iou
+        self.inflight = 0
+        self.latencies = deque(maxlen=STATS_WINDOW)
+        self.batch_sizes = deque(maxlen=STATS_WINDOW)
+        self.counts = {"served": 0, "rejected": 0, "failed": 0}
+        self._tasks = []
+
+    async def start(self):
+        """Load and warm up the model replicas, then start one batcher per replica"""
+        import torch
+        from ultralytics import YOLO
+
+        torch.set_num_threads(max(1, (os.cpu_count() or 1) // self.replicas))
+        self.models = []
+        for _ in range(self.replicas):
+            yolo = YOLO(self.weights)
+            self.models.append(yolo.model.float().fuse().eval())
+        self.names = yolo.names
+        self.imgsz = self.imgsz or int(yolo.overrides.get("imgsz") or 640)
+
+        self.queue = asyncio.Queue()
+        self.decode_pool = ThreadPoolExecutor(max_workers=DECODE_WORKERS, thread_name_prefix="decode")
+        self.model_pools = [ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"model{i}")
+                            for i in range(self.replicas)]
+        loop = asyncio.get_running_loop()
+        warm = np.full((self.max_batch, self.imgsz, self.imgsz, 3), 114, dtype=np.uint8)
+        for model, pool in zip(self.models, self.model_pools):
+            await loop.run_in_executor(pool, self._forward, model, warm)
+        self._tasks = [asyncio.create_task(self._batcher(m, p)) for m, p in zip(self.models, self.model_pools)]
+        self.started = time.perf_counter()
+        print(f"🔥 Model พร้อม: {Path(self.weights).name} × {self.replicas}, imgsz={self.imgsz}, "
+              f"batch ≤ {self.max_batch}, รอ ≤ {self.max_wait * 1000:.0f} ms")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        self.decode_pool.shutdown(wait=False)
+        for pool in self.model_pools:
+            pool.shutdown(wait=False)
+
+    def _prepare(self, image) -> tuple[np.ndarray, tuple, tuple]:
+        """Decode (if encoded bytes) and letterbox - runs in the decode pool"""
+        import cv2
+        from val_sweep import letterbox
+
+        im = cv2.imdecode(np.frombuffer(image, np.uint8), cv2.IMREAD_COLOR) if isinstance(image, bytes) else image
+        if im is None:
+            raise ValueError("decode ภาพไม่ได้")
+        canvas, ratio_pad = letterbox(im, self.imgsz)
+        return canvas, im.shape[:2], ratio_pad
+
+    async def detect(self, image) -> list[dict]:
+        """
+        Detect objects in one image
+
+        Args:
+            image: Encoded image bytes (jpg/png/...) or a BGR numpy array
+
+        Returns:
+            List of detections with box (xyxy, original pixels), conf, cls and name
+
+        Raises:
+            Overloaded: MAX_QUEUE requests are already in flight
+        """
+        if self.inflight >= self.max_queue:
+            self.counts["rejected"] += 1
+            raise Overloaded(f"queue เต็ม ({self.inflight}/{self.max_queue})")
+        self.inflight += 1
+        t0 = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            canvas, shape, ratio_pad = await loop.run_in_executor(self.decode_pool, self._prepare, image)
+            future = loop.create_future()
+            await self.queue.put(_Request(canvas, shape, ratio_pad, future, t0))
+            result = await future
+            self.latencies.append(time.perf_counter() - t0)
+            self.counts["served"] += 1
+            return result
+        except Exception:
+            self.counts["failed"] += 1
+            raise
+        finally:
+            self.inflight -= 1
+
+    async def _batcher(self, model, pool):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                if not self.queue.empty():
+                    batch.append(self.queue.get_nowait())
+                    continue
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            self.batch_sizes.append(len(batch))
+            try:
+                dets = await loop.run_in_executor(pool, self._infer, model, batch)
+            except Exception as e:
+                for r in batch:
+                    if not r.future.done():
+                        r.future.set_exception(e)
+                continue
+            for r, d in zip(batch, dets):
+                if not r.future.done():
+                    r.future.set_result(d)
+
+    @staticmethod
+    def _forward(model, images: np.ndarray):
+        import torch
+
+        with torch.inference_mode():
+            x = torch.from_numpy(np.ascontiguousarray(images[..., ::-1])).permute(0, 3, 1, 2).float().div_(255)
+            y = model(x)
+            return y[0] if isinstance(y, (list, tuple)) else y
+
+    def _infer(self, model, batch: list[_Request]) -> list[list[dict]]:
+        """Forward pass + NMS for one micro-batch, boxes mapped back to the original images"""
+        from ultralytics.utils.nms import non_max_suppression
+
+        pred = self._forward(model, np.stack([r.canvas for r in batch]))
+        out = []
+        for r, det in zip(batch, non_max_suppression(pred, self.conf, self.iou, max_det=MAX_DET)):
+            det = det.numpy()
+            ratio, left, top = r.ratio_pad
+            boxes = (det[:, :4] - [left, top, left, top]) / ratio
+            boxes[:, 0::2] = boxes[:, 0::2].clip(0, r.shape[1])
+            boxes[:, 1::2] = boxes[:, 1::2].clip(0, r.shape[0])
+            out.append([
+                {"box": [round(float(v), 1) for v in box], "conf": round(float(c), 4),
+                 "cls": int(k), "name": self.names[int(k)]}
+                for box, c, k in zip(boxes, det[:, 4], det[:, 5])
+            ])
+        return out
+
+    def stats(self) -> dict:
+        """Latency percentiles, throughput and queue state"""
+        lat = np.array(self.latencies) * 1000 if self.latencies else np.zeros(1)
+        elapsed = time.perf_counter() - self.started
+        return {
+            **self.counts,
+            "p50_ms": round(float(np.percentile(lat, 50)), 2),
+            "p99_ms": round(float(np.percentile(lat, 99)), 2),
+            "images_per_s": round(self.counts["served"] / elapsed, 2),
+            "mean_batch": round(float(np.mean(self.batch_sizes)), 2) if self.batch_sizes else 0.0,
+            "inflight": self.inflight,
+            "queued": self.queue.qsize(),
+        }
+
+# =============================================================================
+# HTTP front end (stdlib asyncio, HTTP/1.1 keep-alive)
+# =============================================================================
+
+async def _read_request(reader) -> tuple[str, str, dict, bytes] | None:
+    try:
+        line = await reader.readline()
+        if not line:
+            return None
+        parts = line.decode("latin-1").split()
+        if len(parts) != 3:
+            raise BadRequest(400, f"malformed request line: {line[:100]!r}")
+        method, path, _ = parts
+        headers = {}
+        while (h := await reader.readline()) not in (b"\r\n", b"\n", b""):
+            k, _, v = h.decode("latin-1").partition(":")
+            headers[k.strip().lower()] = v.strip()
+    except ValueError as e:  # line longer than the stream limit
+        raise BadRequest(400, str(e)) from e
+    try:
+        length = int(headers.get("content-length", 0))
+    except ValueError:
+        raise BadRequest(400, f"bad Content-Length: {headers['content-length'][:100]}") from None
+    if length < 0:
+        raise BadRequest(400, f"bad Content-Length: {length}")
+    if length > MAX_BODY:
+        raise BadRequest(413, f"body {length} bytes > MAX_BODY ({MAX_BODY})")
+    body = await reader.readexactly(length)
+    return method, path, headers, body
+
+def _response(status: int, payload: dict, extra: str = "") -> bytes:
+    body = json.dumps(payload).encode()
+    reason = {200: "OK", 400: "Bad Request", 404: "Not Found", 413: "Payload Too Large", 429: "Too Many Requests",
+              500: "Error"}[status]
+    head = (f"HTTP/1.1 {status} {reason}\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n{extra}\r\n")
+    return head.encode() + body
+
+async def serve_http(server: InferenceServer, host: str = SERVE_HOST, port: int = SERVE_PORT):
+    """
+    Start the HTTP front end
+
+    POST /detect (raw image bytes) → {"detections": [...]}
+    GET /stats → server.stats(), GET /health → {"ok": true}
+
+    Returns:
+        The asyncio server (already listening)
+    """
+
+    async def handle(reader, writer):
+        try:
+            while (req := await _read_request(reader)) is not None:
+                method, path, headers, body = req
+                if method == "POST" and path.startswith("/detect"):
+                    try:
+                        out = _response(200, {"detections": await server.detect(body)})
+                    except Overloaded as e:
+                        out = _response(429, {"error": str(e)}, "Retry-After: 1\r\n")
+                    except ValueError as e:
+                        out = _response(400, {"error": str(e)})
+                    except Exception as e:
+                        out = _response(500, {"error": str(e)})
+                elif path.startswith("/stats"):
+                    out = _response(200, server.stats())
+                elif path.startswith("/health"):
+                    out = _response(200, {"ok": True})
+                else:
+                    out = _response(404, {"error": path})
+                writer.write(out)
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except BadRequest as e:
+            try:
+                writer.write(_response(e.status, {"error": str(e)}, "Connection: close\r\n"))
+                await writer.drain()
+            except ConnectionError:
+                pass
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port)
+
+# =============================================================================
+# Asyncio client + load test
+# =============================================================================
+
+class DetectClient:
+    """Keep-alive asyncio client for POST /detect"""
+
+    def __init__(self, host: str = SERVE_HOST, port: int = SERVE_PORT):
+        self.host, self.port = host, port
+        self.reader = self.writer = None
+
+    async def detect(self, image: bytes) -> tuple[int, dict]:
+        """Returns (HTTP status, JSON body)"""
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        self.writer.write(f"POST /detect HTTP/1.1\r\nHost: {self.host}\r\n"
+                          f"Content-Length: {len(image)}\r\n\r\n".encode() + image)
+        await self.writer.drain()
+        status = int((await self.reader.readline()).split()[1])
+        headers = {}
+        while (h := await self.reader.readline()) not in (b"\r\n", b""):
+            k, _, v = h.decode("latin-1").partition(":")
+            headers[k.strip().lower()] = v.strip()
+        return status, json.loads(await self.reader.readexactly(int(headers["content-length"])))
+
+    async def close(self):
+        if self.writer:
+            self.writer.close()
+
+async def load_test(images: list[bytes], requests: int = 200, concurrency: int = 16,
+                    host: str = SERVE_HOST, port: int = SERVE_PORT) -> dict:
+    """
+    Send requests from concurrent keep-alive clients and measure client-side latency
+
+    Returns:
+        Dict with p50/p99 latency (ms), images per second and rejected (429) count
+    """
+    latencies, rejected = [], 0
+    counter = iter(range(requests))
+
+    async def worker():
+        nonlocal rejected
+        client = DetectClient(host, port)
+        try:
+            for i in counter:
+                t0 = time.perf_counter()
+                status, _ = await client.detect(images[i % len(images)])
+                if status == 429:
+                    rejected += 1
+                    await asyncio.sleep(0.01)
+                else:
+                    latencies.append(time.perf_counter() - t0)
+        finally:
+            await client.close()
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - t0
+    lat = np.array(latencies or [0.0]) * 1000
+    return {"requests": requests, "concurrency": concurrency, "served": len(latencies), "rejected": rejected,
+            "p50_ms": round(float(np.percentile(lat, 50)), 2), "p99_ms": round(float(np.percentile(lat, 99)), 2),
+            "images_per_s": round(len(latencies) / elapsed, 2)}
+
+async def _serve_forever(weights: str, port: int):
+    server = InferenceServer(weights)
+    await server.start()
+    http = await serve_http(server, port=port)
+    print(f"🌐 POST http://{SERVE_HOST}:{port}/detect  |  GET /stats")
+    async with http:
+        await http.serve_forever()
+
+async def _bench(weights: str, image_dir: str, concurrency: int, requests: int):
+    from train import list_image_files
+
+    images = [Path(f).read_bytes() for f in list_image_files(image_dir)[:64]]
+    server = InferenceServer(weights)
+    await server.start()
+    http = await serve_http(server, port=0)
+    port = http.sockets[0].getsockname()[1]
+    client = await load_test(images, requests, concurrency, port=port)
+    print(f"\n📊 Client: p50 {client['p50_ms']} ms, p99 {client['p99_ms']} ms, "
+          f"{client['images_per_s']} ภาพ/วินาที, 429 × {client['rejected']}")
+    print(f"📊 Server: {json.dumps(server.stats())}")
+    http.close()
+    await server.stop()
+
+if __name__ == "__main__":
+    # python serve.py <best.pt> [port]
+    # python serve.py bench <best.pt> <image_dir> [concurrency] [requests]
+    import sys
+
+    if len(sys.argv) >= 4 and sys.argv[1] == "bench":
+        asyncio.run(_bench(sys.argv[2], sys.argv[3], int(sys.argv[4]) if len(sys.argv) > 4 else 16,
+                           int(sys.argv[5]) if len(sys.argv) > 5 else 200))
+    elif len(sys.argv) >= 2 and sys.argv[1] != "bench":
+        try:
+            asyncio.run(_serve_forever(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else SERVE_PORT))
+        except KeyboardInterrupt:
+            print("\n👋 หยุด server")
+    else:
+        print("Usage: python serve.py <best.pt> [port]")
+        print("       python serve.py bench <best.pt> <image_dir> [concurrency] [requests]")
+        sys.exit(1)
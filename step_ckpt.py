@@ -0,0 +1,307 @@
+"""
+Step Checkpoint Module
+Mid-epoch checkpoints every N iterations or T seconds, so a killed run resumes at the batch
+where it stopped instead of the last epoch boundary
+
+weights/step.pt is an Ultralytics resume checkpoint (EMA, optimizer, scaler, best fitness) plus a
+"step" record with the raw model weights, RNG states and the position in the epoch. The data order
+of every epoch is a pure function of (seed, epoch) - EpochSampler replaces the loader's sampler - so
+a resumed run skips exactly the samples already trained on. Snapshots are copied in memory right
+after an optimizer step; serialization and the disk write run on a background thread.
+"""
+import json
+import math
+import os
+import random
+import threading
+import time
+from copy import deepcopy
+from datetime import datetime
+from pathlib import Path
+
+# =============================================================================
+# STEP CHECKPOINT CONFIGURATION
+# =============================================================================
+
+STEP_EVERY = 500                # บันทึกทุก N iterations (None = ไม่ใช้เงื่อนไขนี้)
+STEP_SECONDS = 600              # หรือทุก T วินาที (แล้วแต่อย่างไหนถึงก่อน, None = ไม่ใช้)
+STEP_FILE = "step.pt"           # อยู่ใน weights/ ของ run (ลบทิ้งเมื่อ epoch นั้นบันทึก last.pt แล้ว)
+STEP_INFO = "step.json"         # epoch/batch ของ step.pt (อ่านได้โดยไม่ต้องโหลด checkpoint)
+SAMPLER_SEED = 6148914691236517205
+
+# =============================================================================
+
+def _sampler_class():
+    from torch.utils.data import Sampler
+
+    class EpochSampler(Sampler):
+        """
+        Shuffled (or sequential) order that depends only on (seed, epoch), sharded like DistributedSampler
+
+        Every new pass over the sampler is the next epoch; skip drops the first samples of the next pass.
+        """
+
+        def __init__(self, n: int, seed: int, epoch: int, shuffle: bool = True, rank: int = 0, world: int = 1):
+            self.n, self.seed, self.epoch, self.shuffle = n, seed, epoch, shuffle
+            self.rank, self.world = max(rank, 0), max(world, 1)
+            self.num = math.ceil(n / self.world)
+            self.skip = 0   # samples to drop from the next pass
+            self.short = 0  # samples missing from the current epoch's length (cleared at epoch end)
+
+        def __len__(self):
+            return self.num - self.short
+
+        def __iter__(self):
+            import torch
+
+            epoch, skip = self.epoch, self.skip
+            self.epoch, self.skip = epoch + 1, 0
+            if self.shuffle:
+                g = torch.Generator()
+                g.manual_seed((self.seed + epoch) % (1 << 63))
+                order = torch.randperm(self.n, generator=g).tolist()
+            else:
+                order = list(range(self.n))
+            order += order[:self.num * self.world - self.n]  # pad so every rank gets num samples
+            yield from order[self.rank::self.world][skip:]
+
+    return EpochSampler
+
+def _rng_state() -> dict:
+    import numpy as np
+    import torch
+
+    state = {"python": random.getstate(), "numpy": np.random.get_state(), "torch": torch.get_rng_state()}
+    if torch.cuda.is_available():
+        state["cuda"] = torch.cuda.get_rng_state_all()
+    return state
+
+def _set_rng_state(state: dict):
+    import numpy as np
+    import torch
+
+    random.setstate(state["python"])
+    np.random.set_state(state["numpy"])
+    torch.set_rng_state(state["torch"])
+    if state.get("cuda") is not None and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state["cuda"])
+
+class StepCheckpointer:
+    """
+    Trainer callbacks that write and restore step checkpoints
+
+    Every rank installs the sampler and restores its position; only rank 0 (or a single process)
+    writes. A snapshot is only taken right after an optimizer step, so no accumulated gradients
+    are lost, and only when the previous write has finished - training never waits on disk.
+    """
+
+    def __init__(self, every: int | None = STEP_EVERY, seconds: float | None = STEP_SECONDS):
+        self.every, self.seconds = every, seconds
+        self.sampler = None
+        self.resume = None       # "step" record of the checkpoint being resumed
+        self.batch = 0           # batches trained in the current epoch
+        self.batches = 0         # batches in the current epoch
+        self.stepped = False
+        self.last_batch = 0
+        self.last_time = time.monotonic()
+        self.writer = None
+
+    # ----------------------------------------------------------------- helpers
+
+    def _paths(self, trainer) -> tuple[Path, Path]:
+        return Path(trainer.wdir) / STEP_FILE, Path(trainer.wdir) / STEP_INFO
+
+    def _install_sampler(self, trainer):
+        """Give the current train loader an EpochSampler (no-op if it already has one)"""
+        from torch.utils.data import RandomSampler
+        from ultralytics.utils import RANK
+
+        loader = trainer.train_loader
+        batches = loader.batch_sampler.sampler  # BatchSampler inside Ultralytics' _RepeatSampler
+        if type(batches.sampler).__name__ == "EpochSampler":
+            self.sampler = batches.sampler
+            return
+        shuffle = isinstance(batches.sampler, RandomSampler) or getattr(batches.sampler, "shuffle", False)
+        self.sampler = _sampler_class()(len(loader.dataset), SAMPLER_SEED + trainer.args.seed, trainer.epoch,
+                                        shuffle, RANK, trainer.world_size)
+        batches.sampler = self.sampler
+        if loader.iterator is not None:
+            loader.reset()  # batches already prefetched in the old order
+
+        # A reset (close_mosaic) drops the pass that was prefetched for this epoch - start it again
+        sampler, reset = self.sampler, loader.reset
+
+        def rewinding_reset():
+            if loader.iterator is not None:
+                sampler.epoch, sampler.skip = trainer.epoch, 0
+            reset()
+
+        loader.reset = rewinding_reset
+
+    def _snapshot(self, trainer) -> dict:
+        """In-memory copy of everything needed to continue after this batch (training thread)"""
+        from ultralytics.utils import __version__
+        from ultralytics.utils.torch_utils import unwrap_model
+
+        ema = deepcopy(trainer.ema.ema)
+        if hasattr(ema, "criterion"):
+            ema.criterion = None
+        return {
+            "epoch": max(trainer.epoch - 1, 0),  # Ultralytics resumes at epoch + 1 - corrected on resume
+            "best_fitness": trainer.best_fitness,
+            "stopper": {"best_fitness": trainer.stopper.best_fitness, "best_epoch": trainer.stopper.best_epoch},
+            "model": None,
+            "ema": ema,
+            "updates": trainer.ema.updates,
+            "optimizer": deepcopy(trainer.optimizer.state_dict()),
+            "scaler": deepcopy(trainer.scaler.state_dict()),
+            "train_args": vars(trainer.args),
+            "train_metrics": {**(trainer.metrics or {}), "fitness": trainer.fitness},
+            "date": datetime.now().astimezone().isoformat(),
+            "version": __version__,
+            "step": {
+                "epoch": trainer.epoch,
+                "batch": self.batch,
+                "batches": self.batches,
+                "samples": self.batch * trainer.train_loader.batch_size,
+                "model": {k: v.detach().clone() for k, v in unwrap_model(trainer.model).state_dict().items()},
+                "rng": _rng_state(),
+            },
+        }
+
+    def _write(self, ckpt: dict, pt_path: Path, info_path: Path):
+        """Serialize and atomically replace step.pt / step.json (background thread)"""
+        import torch
+
+        try:
+            tmp = pt_path.with_name(pt_path.name + ".tmp")
+            torch.save(ckpt, tmp)
+            os.replace(tmp, pt_path)
+            step = ckpt["step"]
+            info = {"epoch": step["epoch"], "batch": step["batch"], "batches": step["batches"], "date": ckpt["date"]}
+            tmp = info_path.with_name(info_path.name + ".tmp")
+            tmp.write_text(json.dumps(info), encoding="utf-8")
+            os.replace(tmp, info_path)
+        except Exception as e:
+            print(f"⚠️  บันทึก step checkpoint ไม่สำเร็จ: {e}")
+
+    def _wait(self):
+        if self.writer is not None:
+            self.writer.join()
+            self.writer = None
+
+    def _discard(self, trainer):
+        """The epoch checkpoint is newer now - a step checkpoint would only rewind"""
+        self._wait()
+        for path in self._paths(trainer):
+            path.unlink(missing_ok=True)
+
+    # ----------------------------------------------------------------- callbacks
+
+    def on_pretrain_routine_end(self, trainer):
+        if not (trainer.resume and Path(str(trainer.args.resume)).name == STEP_FILE):
+            return
+        import torch
+        from ultralytics.utils import RANK
+        from ultralytics.utils.torch_utils import unwrap_model
+
+        self.resume = torch.load(trainer.args.resume, map_location="cpu", weights_only=False)["step"]
+        epoch = self.resume["epoch"]
+        trainer.start_epoch, trainer.scheduler.last_epoch = epoch, epoch - 1
+        unwrap_model(trainer.model).load_state_dict(self.resume.pop("model"))  # raw weights, not the EMA
+        if RANK in {-1, 0}:
+            print(f"⏩ Resume กลาง epoch: epoch {epoch + 1} ต่อจาก batch {self.resume['batch']}/{self.resume['batches']}")
+
+    def on_train_start(self, trainer):
+        step = trainer.optimizer_step
+
+        def optimizer_step(*args, **kwargs):
+            result = step(*args, **kwargs)
+            self.stepped = True
+            return result
+
+        trainer.optimizer_step = optimizer_step
+
+    def on_train_epoch_start(self, trainer):
+        from ultralytics.utils import RANK
+
+        self._install_sampler(trainer)
+        self.batches = len(trainer.train_loader)
+        self.batch = self.last_batch = 0
+        self.stepped = False
+        if self.resume and trainer.epoch == self.resume["epoch"]:
+            skip = min(self.resume["samples"], self.sampler.num)
+            self.sampler.skip = self.sampler.short = skip
+            self.batch = self.last_batch = self.resume["batch"]
+            if RANK in {-1, 0}:
+                _set_rng_state(self.resume["rng"])
+            self.resume = None
+        self.last_time = time.monotonic()
+
+    def on_train_batch_end(self, trainer):
+        from ultralytics.utils import RANK
+
+        self.batch += 1
+        if not self.stepped or RANK not in {-1, 0}:
+            return
+        self.stepped = False
+        due = (self.every and self.batch - self.last_batch >= self.every) or \
+              (self.seconds and time.monotonic() - self.last_time >= self.seconds)
+        if not due or self.batch >= self.batches:
+            return  # the epoch checkpoint follows anyway
+        if self.writer is not None and self.writer.is_alive():
+            return  # previous snapshot still being written - try again after the next step
+        ckpt = self._snapshot(trainer)
+        self.writer = threading.Thread(target=self._write, args=(ckpt, *self._paths(trainer)),
+                                       name="step-ckpt", daemon=True)
+        self.writer.start()
+        self.last_batch, self.last_time = self.batch, time.monotonic()
+
+    def on_train_epoch_end(self, trainer):
+        if self.sampler is not None:
+            self.sampler.short = 0
+
+    def on_model_save(self, trainer):
+        self._discard(trainer)
+
+    def on_train_end(self, trainer):
+        self._discard(trainer)
+
+def attach_step_checkpoints(model, every: int | None = STEP_EVERY, seconds: float | None = STEP_SECONDS):
+    """
+    Register step checkpoints on a YOLO model before model.train()
+
+    Attach after attach_progressive, so the sampler lands on the loader of the current stage.
+    """
+    ckpt = StepCheckpointer(every, seconds)
+    for event in ("on_pretrain_routine_end", "on_train_start", "on_train_epoch_start", "on_train_batch_end",
+                  "on_train_epoch_end", "on_model_save", "on_train_end"):
+        model.add_callback(event, getattr(ckpt, event))
+    return ckpt
+
+def newer_step_checkpoint(checkpoint_path: str | None, runs_dir: str | None = None) -> str | None:
+    """
+    Step checkpoint to resume from instead of checkpoint_path, if one is newer
+
+    Args:
+        checkpoint_path: Epoch checkpoint chosen for resume (last.pt), or None
+        runs_dir: Also consider step checkpoints of every run in here (runs killed in their first epoch)
+
+    Returns:
+        Path to step.pt, or checkpoint_path unchanged
+    """
+    candidates = []
+    if checkpoint_path:
+        candidates.append(Path(checkpoint_path).parent / STEP_FILE)
+    if runs_dir and Path(runs_dir).exists():
+        candidates += Path(runs_dir).glob(f"*/weights/{STEP_FILE}")
+    candidates = [p for p in candidates if p.exists() and p.with_name(STEP_INFO).exists()]
+    if not candidates:
+        return checkpoint_path
+    newest = max(candidates, key=lambda p: p.stat().st_mtime_ns)
+    if checkpoint_path and newest.stat().st_mtime_ns <= Path(checkpoint_path).stat().st_mtime_ns:
+        return checkpoint_path
+    info = json.loads(newest.with_name(STEP_INFO).read_text(encoding="utf-8"))
+    print(f"⏩ พบ step checkpoint ที่ใหม่กว่า: {newest} (epoch {info['epoch'] + 1}, "
+          f"batch {info['batch']}/{info['batches']})")
+    return str(newest)
@@ -0,0 +1,313 @@
+"""
+Hyperparameter Sweep Module
+Runs trials in parallel (one process per CPU core slice or GPU) with ASHA early pruning
+Usage: python sweep.py <dataset_path> [sweep_name]
+"""
+import itertools
+import json
+import math
+import os
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+# =============================================================================
+# SWEEP CONFIGURATION
+# =============================================================================
+
+# Search space - ทุก combination จะถูกสร้างเป็น trial
+SEARCH_SPACE = {
+    "model": ["yolo11n.pt", "yolo11s.pt"],
+    "imgsz": [480, 640],
+    "epochs": [30, 60],
+    "lr0": [0.01, 0.005],
+}
+
+PARALLEL_TRIALS = None    # จำนวน trial พร้อมกัน (None = จำนวน GPU หรือ cores // CORES_PER_TRIAL)
+CORES_PER_TRIAL = 4       # จำนวน CPU cores ต่อ trial เมื่อเทรนด้วย CPU
+TRIAL_BATCH = 16          # batch size ของแต่ละ trial
+ETA = 3                   # ASHA: เก็บไว้ 1/ETA ของ trial ในแต่ละ rung
+MIN_EPOCHS = 2            # ASHA: rung แรก (rung ถัดไป = MIN_EPOCHS * ETA^k)
+MIN_TRIALS_PER_RUNG = 3   # ต้องมีผลใน rung อย่างน้อยเท่านี้ก่อนจะตัด trial
+SWEEP_DIR = "runs/sweeps" # ที่เก็บ results.db
+COMPACT_TRIALS = True     # ย้าย last.pt ของ trial ที่จบแล้วเข้า checkpoint store (best.pt ยังอยู่)
+
+# =============================================================================
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS trials (
+    id INTEGER PRIMARY KEY,
+    params TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',   -- pending | running | done | pruned | failed
+    run_dir TEXT,
+    slot TEXT,
+    best_map REAL,
+    best_map50 REAL,
+    epochs_done INTEGER DEFAULT 0,
+    error TEXT,
+    started REAL,
+    finished REAL
+);
+CREATE TABLE IF NOT EXISTS epochs (
+    trial_id INTEGER NOT NULL,
+    epoch INTEGER NOT NULL,
+    map50 REAL,
+    map REAL,
+    fitness REAL,
+    seconds REAL,
+    PRIMARY KEY (trial_id, epoch)
+);
+"""
+
+def connect(db_path: str) -> sqlite3.Connection:
+    """Open the results table (safe for concurrent trial processes)"""
+    conn = sqlite3.connect(db_path, timeout=60)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+def expand_space(space: dict) -> list[dict]:
+    """Expand a grid search space into a list of parameter dicts (stable order)"""
+    keys = sorted(space)
+    return [dict(zip(keys, values)) for values in itertools.product(*(space[k] for k in keys))]
+
+def rung_epochs(max_epochs: int, min_epochs: int = MIN_EPOCHS, eta: int = ETA) -> list[int]:
+    """Epoch milestones where ASHA compares trials, e.g. 2, 6, 18, 54"""
+    rungs, e = [], min_epochs
+    while e < max_epochs:
+        rungs.append(e)
+        e *= eta
+    return rungs
+
+def should_prune(conn: sqlite3.Connection, trial_id: int, epoch: int, value: float, eta: int = ETA) -> bool:
+    """
+    Asynchronous successive halving: keep a trial only if its mAP at this rung
+    is in the top 1/eta of all trials that reached the same rung so far
+    """
+    values = [r[0] for r in conn.execute(
+        "SELECT map FROM epochs WHERE epoch = ? AND trial_id != ? AND map IS NOT NULL", (epoch, trial_id))]
+    if len(values) + 1 < MIN_TRIALS_PER_RUNG:
+        return False
+    values.append(value)
+    keep = max(1, math.floor(len(values) / eta))
+    return value < sorted(values, reverse=True)[keep - 1]
+
+def make_slots(device, parallel: int | None = None) -> list[dict]:
+    """
+    Split the machine into independent trial slots
+
+    Returns:
+        List of {"device": "0"} (one per GPU) or {"device": "cpu", "cores": [...]}
+    """
+    import torch
+
+    if str(device).lower() != "cpu" and torch.cuda.is_available():
+        n = torch.cuda.device_count()
+        return [{"device": str(i % n)} for i in range(parallel or n)]
+
+    cores = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count()))
+    n = min(parallel or max(1, len(cores) // CORES_PER_TRIAL), len(cores))
+    size = max(1, len(cores) // n)
+    return [{"device": "cpu", "cores": cores[i * size:(i + 1) * size]} for i in range(n)]
+
+def _pin(slot: dict):
+    """Pin the current process to its slot (CPU cores or GPU)"""
+    if slot["device"] != "cpu":
+        return
+    cores = slot["cores"]
+    os.environ["OMP_NUM_THREADS"] = str(len(cores))
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    import torch
+    torch.set_num_threads(len(cores))
+
+def run_trial(db_path: str, sweep_name: str, trial_id: int, params: dict, data_yaml: str, slots) -> str:
+    """
+    Train one trial inside a pool process; reports every epoch and stops itself when pruned
+
+    Args:
+        db_path: Path to results.db
+        sweep_name: Sweep name (run directories are <sweep_name>_tNNN)
+        trial_id: Trial id
+        params: Trial parameters (model, imgsz, epochs, and any model.train() argument)
+        data_yaml: Path to data.yaml
+        slots: Shared queue of free slots
+
+    Returns:
+        Final trial status
+    """
+    slot = slots.get()
+    try:
+        _pin(slot)
+        from ultralytics import YOLO
+        from train import PROJECT_NAME, get_cache_overrides
+
+        name = f"{sweep_name}_t{trial_id:03d}"
+        run_dir = Path(PROJECT_NAME).resolve() / name  # Ultralytics resolves project under its runs_dir otherwise
+        last = run_dir / "weights" / "last.pt"
+        conn = connect(db_path)
+        conn.execute("UPDATE trials SET status='running', run_dir=?, slot=?, started=COALESCE(started, ?) WHERE id=?",
+                     (str(run_dir), json.dumps(slot), time.time(), trial_id))
+        conn.commit()
+
+        rungs = set(rung_epochs(params["epochs"]))
+        state = {"pruned": False, "t0": time.time(), "epoch": None}
+
+        def on_train_epoch_end(trainer):
+            state["epoch"] = trainer.epoch
+
+        def on_fit_epoch_end(trainer):
+            if trainer.epoch != state["epoch"]:
+                return  # final validation of best.pt (runs at epoch + 1, also after a prune / patience stop)
+            epoch = trainer.epoch + 1
+            m = trainer.metrics
+            value = m.get("metrics/mAP50-95(B)")
+            conn.execute("INSERT OR REPLACE INTO epochs VALUES (?, ?, ?, ?, ?, ?)",
+                         (trial_id, epoch, m.get("metrics/mAP50(B)"), value,
+                          float(trainer.fitness or 0), time.time() - state["t0"]))
+            conn.execute("UPDATE trials SET epochs_done=?, best_map=MAX(COALESCE(best_map, 0), ?), "
+                         "best_map50=MAX(COALESCE(best_map50, 0), ?) WHERE id=?",
+                         (epoch, value or 0, m.get("metrics/mAP50(B)") or 0, trial_id))
+            conn.commit()
+            state["t0"] = time.time()
+            if epoch in rungs and value is not None and should_prune(conn, trial_id, epoch, value):
+                print(f"✂️  trial {trial_id} ถูกตัดที่ epoch {epoch} (mAP50-95 {value:.4f})")
+                state["pruned"] = True
+                trainer.stop = True
+
+        overrides = get_cache_overrides("mmap")
+        workers = min(len(slot.get("cores", [])) or 8, 8)
+        if last.exists():
+            # Restarted sweep - continue the existing runs/detect checkpoint
+            model = YOLO(str(last))
+            model.add_callback("on_train_epoch_end", on_train_epoch_end)
+            model.add_callback("on_fit_epoch_end", on_fit_epoch_end)
+            overrides.pop("cache")
+            model.train(resume=True, device=slot["device"], workers=workers, **overrides)
+        else:
+            train_args = {k: v for k, v in params.items() if k != "model"}
+            model = YOLO(params["model"])
+            model.add_callback("on_train_epoch_end", on_train_epoch_end)
+            model.add_callback("on_fit_epoch_end", on_fit_epoch_end)
+            model.train(
+                data=data_yaml,
+                batch=train_args.pop("batch", TRIAL_BATCH),
+                device=slot["device"],
+                workers=workers,
+                project=str(run_dir.parent),
+                name=name,
+                exist_ok=True,
+                plots=False,
+                verbose=False,
+                **train_args,
+                **overrides,
+            )
+
+        status = "pruned" if state["pruned"] else "done"
+        if COMPACT_TRIALS:
+            from ckpt_store import compact_run
+            compact_run(str(run_dir), files=("last.pt",))
+        conn.execute("UPDATE trials SET status=?, finished=? WHERE id=?", (status, time.time(), trial_id))
+        conn.commit()
+        return status
+
+    except Exception as e:
+        conn = connect(db_path)
+        conn.execute("UPDATE trials SET status='failed', error=?, finished=? WHERE id=?",
+                     (str(e), time.time(), trial_id))
+        conn.commit()
+        return "failed"
+    finally:
+        slots.put(slot)
+
+def run_sweep(dataset_path: str, space: dict = SEARCH_SPACE, sweep_name: str = "sweep",
+              parallel: int | None = PARALLEL_TRIALS) -> str:
+    """
+    Run (or continue) a headless sweep
+
+    Args:
+        dataset_path: Path to the dataset directory
+        space: Grid search space
+        sweep_name: Name of the sweep (same name = continue after a restart)
+        parallel: Number of concurrent trials
+
+    Returns:
+        Path to results.db
+    """
+    import multiprocessing as mp
+    from train import DEVICE, EPOCHS, IMAGE_SIZE, MODEL_NAME, get_data_yaml
+
+    data_yaml = get_data_yaml(dataset_path)
+    sweep_dir = Path(SWEEP_DIR) / sweep_name
+    sweep_dir.mkdir(parents=True, exist_ok=True)
+    db_path = str(sweep_dir / "results.db")
+
+    conn = connect(db_path)
+    defaults = {"model": MODEL_NAME, "imgsz": IMAGE_SIZE, "epochs": EPOCHS}
+    for i, params in enumerate(expand_space(space)):
+        params = {**defaults, **params}
+        conn.execute("INSERT OR IGNORE INTO trials (id, params) VALUES (?, ?)", (i, json.dumps(params)))
+    # Trials interrupted by a restart go back to the queue (and resume from their last.pt)
+    conn.execute("UPDATE trials SET status='pending' WHERE status='running'")
+    conn.commit()
+    todo = [(r[0], json.loads(r[1])) for r in conn.execute(
+        "SELECT id, params FROM trials WHERE status='pending' ORDER BY id")]
+    conn.close()
+
+    # Decode each image size once into the shared mmap store before trials start
+    from cache_store import prepare_stores
+    for imgsz in sorted({p["imgsz"] for _, p in todo}):
+        prepare_stores(data_yaml, imgsz)
+
+    slots = make_slots(DEVICE, parallel)
+    print(f"\n🔬 Sweep '{sweep_name}': {len(todo)} trials, {len(slots)} slots พร้อมกัน")
+    for s in slots:
+        print(f"   slot: {s}")
+
+    ctx = mp.get_context("spawn")
+    with ctx.Manager() as manager:
+        free = manager.Queue()
+        for s in slots:
+            free.put(s)
+        with ProcessPoolExecutor(max_workers=len(slots), mp_context=ctx) as pool:
+            futures = {
+                pool.submit(run_trial, db_path, sweep_name, tid, params, data_yaml, free): tid
+                for tid, params in todo
+            }
+            for fut in as_completed(futures):
+                print(f"   trial {futures[fut]}: {fut.result()}")
+
+    print_leaderboard(db_path)
+    return db_path
+
+def query(db_path: str, sql: str, args: tuple = ()) -> list[tuple]:
+    """Run an SQL query against the results table"""
+    conn = connect(db_path)
+    try:
+        return conn.execute(sql, args).fetchall()
+    finally:
+        conn.close()
+
+def print_leaderboard(db_path: str, top: int = 10):
+    """Print the best trials of a sweep"""
+    rows = query(db_path, "SELECT id, status, best_map, best_map50, epochs_done, params FROM trials "
+                          "ORDER BY best_map DESC NULLS LAST LIMIT ?", (top,))
+    print("\n🏆 ผลลัพธ์ Sweep:")
+    print(f"   {'id':>3} {'status':<8} {'mAP50-95':>9} {'mAP50':>7} {'ep':>4}  params")
+    for tid, status, best, best50, ep, params in rows:
+        print(f"   {tid:>3} {status:<8} {best or 0:>9.4f} {best50 or 0:>7.4f} {ep or 0:>4}  {params}")
+
+if __name__ == "__main__":
+    # Headless sweep
+    import sys
+
+    print("=" * 60)
+    print("       Hyperparameter Sweep")
+    print("=" * 60)
+
+    if len(sys.argv) < 2:
+        print("Usage: python sweep.py <dataset_path> [sweep_name]")
+        sys.exit(1)
+
+    run_sweep(sys.argv[1], sweep_name=sys.argv[2] if len(sys.argv) > 2 else "sweep")
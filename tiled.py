@@ -0,0 +1,304 @@
+"""
+Tiled Inference Module
+Detects small, distant objects in high-resolution frames (e.g. 4K traffic cameras): frames are cut
+into overlapping tiles from a precomputed grid, tiles of several frames run through the model as
+batches, and detections are merged back into frame coordinates with a vectorized cross-tile NMS
+and box fusion
+
+A box cut by a tile border lies mostly inside the full box found by the neighbouring tile (or the
+whole-frame pass), so the merge compares boxes by intersection over the smaller box (IoS) and fuses
+each cluster into one box. Only boxes from different tiles are merged - inside a tile the model's
+own NMS already ran, and IoS there would swallow a car partly hidden behind a truck.
+"""
+import json
+import math
+import time
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+
+# =============================================================================
+# TILED INFERENCE CONFIGURATION
+# =============================================================================
+
+TILE_SIZE = 640           # ขนาด tile (pixel ของ frame) ถ้าไม่เท่ากับ imgsz ของ model จะ resize tile เป็น imgsz
+TILE_OVERLAP = 0.2        # สัดส่วนที่ tile ติดกันซ้อนทับกัน (อย่างน้อย)
+TILE_BATCH = 16           # tile ต่อ forward pass (tile จากหลาย frame รวม batch เดียวกัน)
+FULL_FRAME = True         # รวม detection จากภาพทั้ง frame ด้วย (รถคันใหญ่กว่า tile)
+CONF = 0.25               # confidence threshold
+IOU = 0.7                 # NMS IoU ภายในแต่ละ tile
+MERGE_THRESHOLD = 0.5     # IoS ขั้นต่ำที่ถือว่าเป็นวัตถุเดียวกันข้าม tile
+FUSE = "union"            # "union" = กรอบที่ครอบทั้งกลุ่ม (ต่อกรอบที่ถูกขอบ tile ตัด), "weighted" = เฉลี่ยถ่วงด้วย score
+MAX_DET = 300             # detection สูงสุดต่อ frame
+EVAL_FRAMES = 4           # frame ต่อรอบตอนวัดผลบน val split
+REPORT_FILE = "tiled_report.json"  # อยู่ใน run directory ของ weights
+
+# =============================================================================
+
+SIZE_BUCKETS = {"small": (0, 32 ** 2), "medium": (32 ** 2, 96 ** 2), "large": (96 ** 2, math.inf)}  # COCO, frame px
+
+@lru_cache(maxsize=32)
+def tile_grid(h: int, w: int, tile: int = TILE_SIZE, overlap: float = TILE_OVERLAP) -> np.ndarray:
+    """
+    Tiles covering an h × w frame, cached per frame size (a camera always sends the same size)
+
+    Tiles are spread evenly so the last row/column ends on the border and every overlap is
+    at least `overlap`. Frames smaller than a tile get one (clipped) tile.
+
+    Returns:
+        Read-only (n, 4) int array of x0, y0, x1, y1
+    """
+    def starts(size: int) -> np.ndarray:
+        if size <= tile:
+            return np.zeros(1, dtype=int)
+        n = math.ceil((size - tile) / max(1, int(tile * (1 - overlap)))) + 1
+        return np.linspace(0, size - tile, n).round().astype(int)
+
+    ys, xs = starts(h), starts(w)
+    x0, y0 = np.meshgrid(xs, ys)
+    grid = np.stack([x0.ravel(), y0.ravel(), np.minimum(x0.ravel() + tile, w), np.minimum(y0.ravel() + tile, h)], 1)
+    grid.flags.writeable = False
+    return grid
+
+def merge_detections(boxes, scores, cls, source, threshold: float = MERGE_THRESHOLD, fuse: str = FUSE,
+                     max_det: int = MAX_DET):
+    """
+    Cross-tile NMS + box fusion for the detections of one frame, as whole-matrix tensor ops
+
+    Fast-NMS rule: a box is suppressed when a higher-scoring box of the same class from another
+    source (tile / whole frame) overlaps it by IoS >= threshold. Each kept box then absorbs the
+    boxes it suppressed.
+
+    Args:
+        boxes: (n, 4) xyxy in frame pixels
+        scores, cls: (n,) tensors
+        source: (n,) tile id of each box
+        fuse: "union" (enclosing box) or "weighted" (score-weighted mean)
+
+    Returns:
+        Tuple of (boxes, scores, cls), highest score first
+    """
+    import torch
+
+    order = scores.argsort(descending=True)
+    boxes, scores, cls, source = boxes[order], scores[order], cls[order], source[order]
+    n = len(scores)
+    if n < 2:
+        return boxes, scores, cls
+
+    inter = (torch.min(boxes[:, None, 2:], boxes[None, :, 2:]) - torch.max(boxes[:, None, :2], boxes[None, :, :2]))
+    inter = inter.clamp_(min=0).prod(2)
+    area = (boxes[:, 2:] - boxes[:, :2]).prod(1)
+    ios = inter / torch.min(area[:, None], area[None, :]).clamp_(min=1e-7)
+    over = (ios >= threshold) & (cls[:, None] == cls[None, :]) & (source[:, None] != source[None, :])
+    over = over.triu_(diagonal=1)  # row i (higher score) acts on column j
+    keep = ~over.any(0)
+
+    # Owner of each box: the first kept box that overlaps it (itself when kept)
+    claim = (over & keep[:, None]) | torch.eye(n, dtype=torch.bool)
+    owner = claim.byte().argmax(0)
+    member = keep[owner]
+    idx, src, w = owner[member], boxes[member], scores[member]
+    if fuse == "weighted":
+        total = torch.zeros(n).index_add_(0, idx, w)
+        fused = torch.zeros(n, 4).index_add_(0, idx, src * w[:, None]) / total.clamp(min=1e-7)[:, None]
+    else:
+        fused = boxes.clone()
+        fused[:, :2] = fused[:, :2].scatter_reduce(0, idx[:, None].expand(-1, 2), src[:, :2], "amin")
+        fused[:, 2:] = fused[:, 2:].scatter_reduce(0, idx[:, None].expand(-1, 2), src[:, 2:], "amax")
+    return fused[keep][:max_det], scores[keep][:max_det], cls[keep][:max_det]
+
+class TiledDetector:
+    """
+    Detector over full-resolution frames: tiles (+ optionally the whole frame) → batched model → merge
+
+    Use detect(frames) for tiled inference and detect(frames, tiled=False) for the whole-frame baseline.
+    """
+
+    def __init__(self, weights: str, tile: int = TILE_SIZE, overlap: float = TILE_OVERLAP, batch: int = TILE_BATCH,
+                 full_frame: bool = FULL_FRAME, conf: float = CONF, iou: float = IOU,
+                 merge_threshold: float = MERGE_THRESHOLD, fuse: str = FUSE, imgsz: int | None = None):
+        from ultralytics import YOLO
+
+        yolo = YOLO(weights)
+        self.model = yolo.model.float().fuse().eval()
+        self.names = yolo.names
+        self.imgsz = imgsz or int(yolo.overrides.get("imgsz") or 640)
+        self.tile, self.overlap, self.batch = tile, overlap, batch
+        self.full_frame = full_frame
+        self.conf, self.iou = conf, iou
+        self.merge_threshold, self.fuse = merge_threshold, fuse
+
+    def _tile_canvas(self, crop: np.ndarray) -> np.ndarray:
+        """Pad a (border) crop to tile × tile at the top-left, then scale to the model's imgsz"""
+        import cv2
+
+        if crop.shape[:2] != (self.tile, self.tile):
+            canvas = np.full((self.tile, self.tile, 3), 114, dtype=np.uint8)
+            canvas[:crop.shape[0], :crop.shape[1]] = crop
+            crop = canvas
+        if self.tile != self.imgsz:
+            crop = cv2.resize(crop, (self.imgsz, self.imgsz), interpolation=cv2.INTER_LINEAR)
+        return crop
+
+    def views_per_frame(self, h: int, w: int, tiled: bool = True) -> int:
+        """Model inputs one h × w frame needs"""
+        n = len(tile_grid(h, w, self.tile, self.overlap)) if tiled else 0
+        return n + (not tiled or (self.full_frame and n > 1))
+
+    def _views(self, frames: list[np.ndarray], tiled: bool) -> tuple[list[np.ndarray], np.ndarray]:
+        """
+        Model inputs for every frame plus the mapping back: frame index, scale, x/y offset and clip box
+
+        Returns:
+            (canvases, (n, 8) array of frame, ratio, dx, dy, x0, y0, x1, y1) with frame = canvas / ratio + d
+        """
+        from val_sweep import letterbox
+
+        canvases, meta = [], []
+        for f, im in enumerate(frames):
+            h, w = im.shape[:2]
+            grid = tile_grid(h, w, self.tile, self.overlap) if tiled else np.zeros((0, 4), dtype=int)
+            r = self.imgsz / self.tile
+            for x0, y0, x1, y1 in grid:
+                canvases.append(self._tile_canvas(im[y0:y1, x0:x1]))
+                meta.append((f, r, x0, y0, x0, y0, x1, y1))
+            if not tiled or (self.full_frame and len(grid) > 1):
+                canvas, (r, left, top) = letterbox(im, self.imgsz)
+                canvases.append(canvas)
+                meta.append((f, r, -left / r, -top / r, 0, 0, w, h))
+        return canvases, np.array(meta, dtype=np.float32).reshape(-1, 8)
+
+    def detect(self, frames: list[np.ndarray], tiled: bool = True) -> list[dict]:
+        """
+        Detect objects in BGR frames
+
+        Args:
+            frames: Full-resolution BGR images (any sizes)
+            tiled: False = one letterboxed pass per frame (baseline)
+
+        Returns:
+            Per frame a dict of numpy arrays: boxes (xyxy, frame pixels), score, cls
+        """
+        import torch
+        from serve import InferenceServer
+        from ultralytics.utils.nms import non_max_suppression
+
+        canvases, meta = self._views(frames, tiled)
+        dets = []
+        for start in range(0, len(canvases), self.batch):
+            pred = InferenceServer._forward(self.model, np.stack(canvases[start:start + self.batch]))
+            dets += non_max_suppression(pred, self.conf, self.iou, max_det=MAX_DET)
+
+        # All tiles back to frame coordinates at once
+        view = torch.cat([torch.full((len(d),), i) for i, d in enumerate(dets)]).long()
+        det = torch.cat(dets)
+        m = torch.from_numpy(meta)[view]
+        boxes = det[:, :4] / m[:, 1:2] + m[:, [2, 3, 2, 3]]
+        boxes = torch.max(torch.min(boxes, m[:, [6, 7, 6, 7]]), m[:, [4, 5, 4, 5]])
+        frame = m[:, 0].long()
+
+        out = []
+        for f in range(len(frames)):
+            sel = frame == f
+            b, s, c = boxes[sel], det[sel, 4], det[sel, 5]
+            if tiled:
+                b, s, c = merge_detections(b, s, c, view[sel], self.merge_threshold, self.fuse)
+            out.append({"boxes": b.numpy(), "score": s.numpy(), "cls": c.numpy().astype(np.int16)})
+        return out
+
+def _recall(preds: dict, cache, mask: np.ndarray | None = None) -> tuple[float, int]:
+    """Recall at IoU 0.5 over the ground truth in mask (one-to-one matching of val_sweep.match)"""
+    from types import SimpleNamespace
+    from val_sweep import match
+
+    if mask is None:
+        mask = np.ones(len(cache.gt_cls), dtype=bool)
+    gt = SimpleNamespace(gt_image=cache.gt_image[mask], gt_cls=cache.gt_cls[mask], gt_boxes=cache.gt_boxes[mask],
+                         nc=cache.nc)
+    hits = int(match(preds, gt)[:, 0].sum())
+    return hits / max(int(mask.sum()), 1), int(mask.sum())
+
+def evaluate(weights: str, dataset_path: str, tile: int = TILE_SIZE, overlap: float = TILE_OVERLAP) -> dict:
+    """
+    Whole-frame vs tiled inference on the val split: frames per second and recall (overall and per object size)
+
+    Args:
+        weights: Path to best.pt
+        dataset_path: Dataset directory
+
+    Returns:
+        Report dict, also written to REPORT_FILE in the run directory
+    """
+    import cv2
+    from train import get_data_yaml
+    from val_sweep import ValCache
+
+    detector = TiledDetector(weights, tile=tile, overlap=overlap)
+    cache = ValCache.build(get_data_yaml(dataset_path), detector.imgsz)  # ground truth in original pixels
+    area = (cache.gt_boxes[:, 2:] - cache.gt_boxes[:, :2]).prod(1)
+    print(f"\n🧩 Tiled vs whole-frame: {len(cache.files)} ภาพ, tile {tile}px (overlap {overlap:.0%}), "
+          f"model {detector.imgsz}px")
+
+    report = {"weights": str(weights), "tile": tile, "overlap": overlap, "imgsz": detector.imgsz,
+              "full_frame": detector.full_frame, "merge": detector.fuse, "modes": {}}
+    for mode in ("whole", "tiled"):
+        tiled = mode == "tiled"
+        preds = {"image": [], "boxes": [], "score": [], "cls": []}
+        elapsed, views = 0.0, 0
+        detector.detect([cv2.imread(cache.files[0])], tiled)  # warm-up
+        for start in range(0, len(cache.files), EVAL_FRAMES):
+            frames = [cv2.imread(f) for f in cache.files[start:start + EVAL_FRAMES]]
+            t0 = time.perf_counter()
+            dets = detector.detect(frames, tiled)
+            elapsed += time.perf_counter() - t0
+            views += sum(detector.views_per_frame(*im.shape[:2], tiled) for im in frames)
+            for i, d in enumerate(dets):
+                preds["image"].append(np.full(len(d["score"]), start + i, dtype=np.int32))
+                for k in ("boxes", "score", "cls"):
+                    preds[k].append(d[k])
+        preds = {k: np.concatenate(v) for k, v in preds.items()}
+        recall, _ = _recall(preds, cache)
+        row = {"fps": round(len(cache.files) / elapsed, 2), "views_per_frame": round(views / len(cache.files), 1),
+               "recall": round(recall, 4), "detections": len(preds["score"])}
+        for name, (lo, hi) in SIZE_BUCKETS.items():
+            r, n = _recall(preds, cache, (area >= lo) & (area < hi))
+            row[f"recall_{name}"] = round(r, 4) if n else None
+        report["modes"][mode] = row
+
+    whole, tiled = report["modes"]["whole"], report["modes"]["tiled"]
+    report["recall_gain"] = round(tiled["recall"] - whole["recall"], 4)
+    report["slowdown"] = round(whole["fps"] / max(tiled["fps"], 1e-9), 2)
+
+    print(f"\n   {'Mode':<6} {'FPS':>7} {'Views':>6} {'Recall':>7} {'Small':>7} {'Medium':>7} {'Large':>7}")
+    for mode, r in report["modes"].items():
+        cells = [("-" if r[f"recall_{b}"] is None else f"{r[f'recall_{b}']:.3f}") for b in SIZE_BUCKETS]
+        print(f"   {mode:<6} {r['fps']:>7.2f} {r['views_per_frame']:>6g} {r['recall']:>7.3f} "
+              + " ".join(f"{c:>7}" for c in cells))
+    print(f"\n📈 Recall +{report['recall_gain']:.3f} (IoU 0.5, conf {detector.conf}) แลกกับช้าลง {report['slowdown']}×")
+
+    path = Path(weights).parent.parent / REPORT_FILE
+    path.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    print(f"📄 {path}")
+    return report
+
+if __name__ == "__main__":
+    # python tiled.py <best.pt> <dataset_path> [tile]   → whole-frame vs tiled report on the val split
+    # python tiled.py <best.pt> --image <frame> [tile]  → tiled detections of one frame
+    import sys
+
+    if len(sys.argv) >= 4 and sys.argv[2] == "--image":
+        import cv2
+        detector = TiledDetector(sys.argv[1], tile=int(sys.argv[4]) if len(sys.argv) > 4 else TILE_SIZE)
+        im = cv2.imread(sys.argv[3])
+        det = detector.detect([im])[0]
+        print(f"🧩 {len(tile_grid(*im.shape[:2], detector.tile, detector.overlap))} tiles → {len(det['score'])} detections")
+        for box, s, c in zip(det["boxes"], det["score"], det["cls"]):
+            print(f"   {detector.names[int(c)]:<12} {s:.2f}  {[round(float(v), 1) for v in box]}")
+    elif len(sys.argv) >= 3:
+        evaluate(sys.argv[1], sys.argv[2], int(sys.argv[3]) if len(sys.argv) > 3 else TILE_SIZE)
+    else:
+        print("Usage: python tiled.py <best.pt> <dataset_path> [tile]")
+        print("       python tiled.py <best.pt> --image <frame> [tile]")
+        sys.exit(1)
@@ -2,6 +2,7 @@
 Training Module
 Handles YOLO model training with configurable parameters
 """
+import glob
 import os
 from pathlib import Path
 
@@ -14,24 +15,39 @@ MODEL_NAME = "yolo11l.pt"  # Options: yolo11n.pt, yolo11s.pt, yolo11m.pt, yolo11
 
 # Training Hyperparameters
 EPOCHS = 100              # จำนวน Epochs
-BATCH_SIZE = 16           # Batch size (ลดลงถ้า GPU memory ไม่พอ)
+BATCH_SIZE = "auto"       # "auto" = วัด memory แล้วเลือก batch ใหญ่สุดที่ปลอดภัย หรือกำหนดเอง เช่น 16
 IMAGE_SIZE = 640          # ขนาดภาพ (640 หรือ 1280)
 PATIENCE = 50             # จำนวน epochs ที่จะหยุดถ้าไม่มีการปรับปรุง
+CORESET_FRACTION = None   # เช่น 0.1 / 0.25 = train บน subset ตัวแทนเพื่อทดลองเร็ว (ดู coreset.py), None = ทั้งหมด
+PROGRESSIVE_RESIZE = False  # True = epochs แรกๆ train ที่ภาพเล็ก แล้วค่อยขยายตาม schedule (ดู progressive.py)
+PROGRESSIVE_SCHEDULE = ((0.0, 320), (0.3, 480), (0.6, None))  # (เริ่มที่สัดส่วนของ EPOCHS, imgsz) None = IMAGE_SIZE
 
 # Device Configuration
 DEVICE = 0                # GPU ID (0 = GPU แรก, 'cpu' = ใช้ CPU)
+DDP_WORKERS = None        # เช่น 4 = train บน CPU แบบ data-parallel (gloo) 4 process ต่อเครื่อง (ดู ddp_cpu.py), None = ปิด
+DDP_NODES = 1             # จำนวนเครื่องที่ร่วม train (เครื่องนี้ = node 0, เครื่องอื่นสั่งด้วย ddp_cpu.py node ...)
 
 # Output Configuration
 PROJECT_NAME = "runs/detect"
 RUN_NAME = "train"        # ชื่อ run (จะถูกเพิ่มเลขอัตโนมัติ ถ้าซ้ำ)
+INSTRUMENT = True         # บันทึกเวลาแต่ละ phase (phases.jsonl + trace.json ใน run directory)
+DEDUP_CHECKPOINTS = True  # ย้าย epochN.pt (save_period) เข้า checkpoint store แบบ dedup (ดู ckpt_store.py)
+STEP_CHECKPOINTS = True   # checkpoint กลาง epoch ทุก N iterations / T วินาที → Resume ต่อได้ที่ batch เดิม (ดู step_ckpt.py)
+SYNC_DIR = None           # sync run ไปที่นี่ระหว่าง Training เช่น "/content/drive/MyDrive/YOLO_Training" (None = ปิด)
+PRUNE_DUPLICATES = True   # ตัดภาพซ้ำ/เกือบซ้ำ + train/val leak ออกจาก train ก่อนเริ่ม (ดู dedup.py)
+EXPORT_AFTER_TRAIN = False # Export best.pt เป็น ONNX / INT8 แล้วเทียบ mAP + latency (ดู export.py, ต้องมี onnxruntime / openvino / nncf)
+PRUNE_AFTER_TRAIN = False # ตัด channel ของ best.pt ตาม budget FLOPs/latency แล้ว fine-tune สั้นๆ (ดู channel_prune.py)
 
 # Advanced Settings
-WORKERS = 8               # จำนวน workers สำหรับ data loading
-CACHE = True              # Cache images สำหรับเร็วขึ้น
+WORKERS = 8               # จำนวน workers สำหรับ data loading (ใช้เมื่อ AUTOTUNE_LOADER = False)
+AUTOTUNE_LOADER = True    # วัด workers / prefetch / pin / decode กับ dataset จริงครั้งแรก แล้วจำไว้ต่อเครื่อง+dataset (ดู loader_tune.py)
+CACHE = "auto"            # "auto" = เลือกตาม RAM/disk, "mmap" = shard บน disk (แชร์ระหว่าง workers), True/"ram", False
 AMP = True                # Automatic Mixed Precision (ใช้ memory น้อยลง)
 
 # =============================================================================
 
+IMG_FORMATS = {"bmp", "dng", "jpeg", "jpg", "mpo", "png", "tif", "tiff", "webp", "pfm", "heic"}
+
 def get_data_yaml(dataset_path: str) -> str:
     """Find the data.yaml file in the dataset"""
     data_yaml = Path(dataset_path) / "data.yaml"
@@ -47,26 +63,187 @@ def get_data_yaml(dataset_path: str) -> str:
     
     raise FileNotFoundError(f"ไม่พบ data.yaml ใน {dataset_path}")
 
-def print_training_config(dataset_path: str):
+def get_split_paths(data_yaml: str) -> dict:
+    """
+    Resolve the image paths of each split listed in data.yaml
+
+    Args:
+        data_yaml: Path to data.yaml
+
+    Returns:
+        Dict of split name -> image directory (or list file)
+    """
+    from ultralytics.data.utils import check_det_dataset
+
+    data = check_det_dataset(data_yaml)
+    return {split: data[split] for split in ("train", "val") if data.get(split)}
+
+def derive_data_yaml(data_yaml: str, out_path: str, train: str) -> str:
+    """
+    Write a copy of data.yaml with another train split (val and class names unchanged)
+
+    Args:
+        data_yaml: Path to the original data.yaml
+        out_path: Path of the new yaml
+        train: Image directory or *.txt list file for the train split
+
+    Returns:
+        out_path
+    """
+    import yaml
+
+    splits = get_split_paths(data_yaml)
+    with open(data_yaml, encoding="utf-8") as f:
+        data = yaml.safe_load(f)
+    data.update(path=str(Path(data_yaml).resolve().parent), train=str(Path(train).resolve()),
+                val=splits.get("val") or splits["train"])
+    data.pop("test", None)
+    Path(out_path).parent.mkdir(parents=True, exist_ok=True)
+    with open(out_path, "w", encoding="utf-8") as f:
+        yaml.safe_dump(data, f, sort_keys=False, allow_unicode=True)
+    return str(out_path)
+
+def list_image_files(img_path: str) -> list[str]:
+    """
+    List image files the same way Ultralytics does for a split
+
+    Args:
+        img_path: Image directory or *.txt file listing images
+
+    Returns:
+        Sorted list of image paths
+    """
+    files = []
+    for p in img_path if isinstance(img_path, list) else [img_path]:
+        p = Path(p)
+        if p.is_dir():
+            files += glob.glob(str(Path(glob.escape(str(p))) / "**" / "*.*"), recursive=True)
+        elif p.is_file():
+            parent = str(p.parent) + os.sep
+            lines = p.read_text(encoding="utf-8").strip().splitlines()
+            files += [x.replace("./", parent, 1) if x.startswith("./") else x for x in lines]
+    return sorted(x.replace("/", os.sep) for x in files if x.rpartition(".")[-1].lower() in IMG_FORMATS)
+
+def get_cache_overrides(cache=CACHE) -> dict:
+    """
+    Translate a cache mode into model.train() keyword arguments
+
+    Args:
+        cache: Cache mode (defaults to CACHE)
+
+    Returns:
+        Dict with 'cache' and, for "mmap", the store-backed trainer
+    """
+    if cache == "mmap":
+        from cache_store import MemmapDetectionTrainer
+        return {"cache": False, "trainer": MemmapDetectionTrainer}
+    return {"cache": cache}
+
+def print_training_config(dataset_path: str, model_name: str = MODEL_NAME, teacher: str | None = None):
     """Print the training configuration"""
     print("\n📋 Training Configuration:")
     print("=" * 60)
-    print(f"   Model:      {MODEL_NAME}")
+    print(f"   Model:      {model_name}")
+    if teacher:
+        source = f"best {MODEL_NAME} ใน {PROJECT_NAME}" if teacher == "auto" else teacher
+        print(f"   Teacher:    {source} (distillation)")
     print(f"   Dataset:    {dataset_path}")
     print(f"   Epochs:     {EPOCHS}")
+    if CORESET_FRACTION:
+        print(f"   Coreset:    {CORESET_FRACTION:.0%} ของ train")
     print(f"   Batch Size: {BATCH_SIZE}")
     print(f"   Image Size: {IMAGE_SIZE}")
-    print(f"   Device:     {DEVICE}")
+    if PROGRESSIVE_RESIZE:
+        stages = ", ".join(f"{size or IMAGE_SIZE}@{start:.0%}" for start, size in PROGRESSIVE_SCHEDULE)
+        print(f"   Progressive: {stages}")
+    if DDP_WORKERS and not teacher:
+        print(f"   Device:     cpu × {DDP_WORKERS} workers × {DDP_NODES} เครื่อง (gloo DDP)")
+    else:
+        print(f"   Device:     {DEVICE}")
+    print(f"   Cache:      {CACHE}")
+    print(f"   Workers:    {'autotune' if AUTOTUNE_LOADER and not DDP_WORKERS else WORKERS}")
     print(f"   AMP:        {AMP}")
     print("=" * 60)
 
-def start_training(dataset_path: str, resume: bool = False):
+def post_training(best: str, dataset_path: str, teacher: str | None = None):
+    """
+    Optional stages on a finished run's best.pt; a failing stage only warns (training itself succeeded)
+
+    Args:
+        best: Path to best.pt
+        dataset_path: Path to the dataset directory
+        teacher: Teacher checkpoint of a distillation run (adds the distillation report)
+    """
+    if EXPORT_AFTER_TRAIN:
+        try:
+            from export import export_and_compare
+            print("\n📦 Export + Quantize best.pt...")
+            export_and_compare(best, dataset_path)
+        except Exception as e:
+            print(f"⚠️  Export ไม่สำเร็จ: {e}")
+    if PRUNE_AFTER_TRAIN:
+        try:
+            from channel_prune import prune_and_finetune
+            print("\n✂️  Channel pruning + fine-tune best.pt...")
+            prune_and_finetune(best, dataset_path)
+        except Exception as e:
+            print(f"⚠️  Channel pruning ไม่สำเร็จ: {e}")
+    if teacher:
+        try:
+            from distill import report
+            report(best, teacher, dataset_path, IMAGE_SIZE)
+        except Exception as e:
+            print(f"⚠️  Distillation report ไม่สำเร็จ: {e}")
+
+def train_ddp_workers(data_yaml: str, dataset_path: str, plan: dict) -> bool:
+    """
+    Train with DDP_WORKERS gloo processes per machine instead of model.train() in this process
+
+    Args:
+        data_yaml: data.yaml to train on (after prune/coreset)
+        dataset_path: Original dataset directory (for the export)
+        plan: Training plan (batch, cache, ...)
+
+    Interrupted runs continue through resume.py, which relaunches the workers from last.pt.
+    """
+    from ddp_cpu import train_ddp
+
+    if PROGRESSIVE_RESIZE:
+        from progressive import build_pyramid, pyramid_sizes
+        print("\n🔻 เตรียมภาพย่อสำหรับ Progressive Resize...")
+        build_pyramid(data_yaml, pyramid_sizes(PROGRESSIVE_SCHEDULE, IMAGE_SIZE))  # once, before the workers start
+    attach = {"plan": plan, "instrument": INSTRUMENT, "store": DEDUP_CHECKPOINTS, "sync": SYNC_DIR,
+              "step": STEP_CHECKPOINTS,
+              "progressive": [data_yaml, plan.get("progressive"), IMAGE_SIZE, EPOCHS] if PROGRESSIVE_RESIZE else None}
+    train = {"data": data_yaml, "epochs": EPOCHS, "batch": plan["batch"], "imgsz": IMAGE_SIZE,
+             "project": os.path.abspath(PROJECT_NAME), "name": RUN_NAME, "patience": PATIENCE,
+             "workers": WORKERS, "amp": AMP, "cache": plan["cache"],
+             "save": True, "save_period": 10, "plots": True, "verbose": True}
+
+    print("\n🚀 เริ่ม Training (DDP บน CPU)...")
+    print("=" * 60)
+    save_dir = train_ddp(MODEL_NAME, train, attach, DDP_WORKERS, DDP_NODES)
+
+    print("\n" + "=" * 60)
+    print("✅ Training เสร็จสิ้น!")
+    print("=" * 60)
+    print(f"\n📁 ผลลัพธ์อยู่ที่:")
+    print(f"   Best Model: {save_dir}/weights/best.pt")
+    print(f"   Last Model: {save_dir}/weights/last.pt")
+    print(f"   Results:    {save_dir}")
+
+    post_training(f"{save_dir}/weights/best.pt", dataset_path)
+    return True
+
+def start_training(dataset_path: str, resume: bool = False, teacher: str | None = None):
     """
     Start YOLO training
     
     Args:
         dataset_path: Path to the dataset directory
         resume: Whether to resume from last checkpoint
+        teacher: Distillation run: teacher checkpoint, or "auto" = best MODEL_NAME run on this dataset.
+            Trains distill.STUDENT_MODEL instead of MODEL_NAME (single process, DDP_WORKERS is ignored)
     """
     try:
         from ultralytics import YOLO
@@ -83,8 +260,14 @@ def start_training(dataset_path: str, resume: bool = False):
         print(f"❌ {e}")
         return False
     
+    model_name = MODEL_NAME
+    if teacher:
+        from distill import STUDENT_MODEL
+        model_name = STUDENT_MODEL
+    ddp = DDP_WORKERS and not teacher
+
     # Print configuration
-    print_training_config(dataset_path)
+    print_training_config(dataset_path, model_name, teacher)
     
     # Confirm with user
     user_input = input("\n   ต้องการเริ่ม Training? (Y/n): ").strip().lower()
@@ -92,10 +275,87 @@ def start_training(dataset_path: str, resume: bool = False):
         print("   ยกเลิกการ Training")
         return False
     
+    sync = {"syncer": None}
     try:
+        if PRUNE_DUPLICATES:
+            from dedup import prune_dataset
+            data_yaml = prune_dataset(dataset_path)["data_yaml"]  # train → deduplicated image list
+        from coreset import train_key
+        source_key = train_key(data_yaml)  # full train split - pairs coreset runs with full runs
+        if CORESET_FRACTION:
+            from coreset import make_coreset
+            data_yaml = make_coreset(data_yaml, CORESET_FRACTION)
+
+        # Planning mode: probe memory for this model/imgsz/device, then pick batch and cache
+        from planner import attach_plan, make_plan
+        device = "cpu" if ddp else DEVICE
+        if BATCH_SIZE == "auto" or CACHE == "auto":
+            plan = make_plan(data_yaml, model_name, IMAGE_SIZE, device, WORKERS, AMP)
+        else:
+            plan = {"model": model_name, "imgsz": IMAGE_SIZE}
+        if BATCH_SIZE != "auto":
+            plan["batch"] = BATCH_SIZE
+        if CACHE != "auto":
+            plan["cache"] = CACHE
+        from checkpoint_catalog import dataset_hash
+        plan["dataset_hash"] = dataset_hash(data_yaml)
+        plan.update(train_key=source_key, coreset=CORESET_FRACTION, epochs=EPOCHS)
+        if PROGRESSIVE_RESIZE:
+            plan["progressive"] = [list(stage) for stage in PROGRESSIVE_SCHEDULE]  # resume follows the same schedule
+        if teacher:
+            # Teacher outputs for the train split, computed once and reused by every distillation run
+            from distill import DISTILL_WEIGHT, TeacherCache, resolve_teacher
+            teacher = resolve_teacher(teacher, source_key, str(Path(get_data_yaml(dataset_path)).parent))
+            cache = TeacherCache.build(teacher, data_yaml, IMAGE_SIZE, DEVICE)
+            plan["distill"] = {"teacher": os.path.abspath(teacher), "cache": str(cache.dir), "weight": DISTILL_WEIGHT}
+        if ddp:
+            world = DDP_WORKERS * DDP_NODES
+            plan["batch"] = max(world, plan["batch"] // world * world)  # split evenly across workers
+            plan["ddp"] = {"workers": DDP_WORKERS, "nodes": DDP_NODES}  # resume relaunches the same layout
+        
+        # Decode each split once into the mmap store (reused by later runs and resume)
+        if plan["cache"] == "mmap":
+            from cache_store import prepare_stores
+            print("\n🗄️  เตรียม mmap image store...")
+            prepare_stores(data_yaml, IMAGE_SIZE)
+
+        if ddp:
+            return train_ddp_workers(data_yaml, dataset_path, plan)
+
+        # Dataloader settings measured for this host + dataset (cached after the first run)
+        overrides = get_cache_overrides(plan["cache"])
+        workers = WORKERS
+        if AUTOTUNE_LOADER:
+            from loader_tune import load_or_tune, tuned_trainer
+            profile = load_or_tune(data_yaml, plan["dataset_hash"], model_name, IMAGE_SIZE, plan["batch"],
+                                   plan["cache"], DEVICE, AMP)
+            plan["loader"] = {k: profile[k] for k in ("workers", "prefetch", "pin_memory", "decode", "imgsz")}
+            overrides["trainer"] = tuned_trainer(overrides.get("trainer"), plan["loader"])
+            workers = profile["workers"]
+        if teacher:
+            from distill import distill_trainer
+            overrides["trainer"] = distill_trainer(overrides.get("trainer"), plan["distill"])
+
         # Load model
-        print(f"\n📦 กำลังโหลด Model: {MODEL_NAME}")
-        model = YOLO(MODEL_NAME)
+        print(f"\n📦 กำลังโหลด Model: {model_name}")
+        model = YOLO(model_name)
+        attach_plan(model, plan)
+        if PROGRESSIVE_RESIZE:
+            from progressive import attach_progressive
+            print("\n🔻 เตรียมภาพย่อสำหรับ Progressive Resize...")
+            attach_progressive(model, data_yaml, PROGRESSIVE_SCHEDULE, IMAGE_SIZE, EPOCHS)
+        if STEP_CHECKPOINTS:
+            from step_ckpt import attach_step_checkpoints
+            attach_step_checkpoints(model)  # after progressive: the sampler goes on the stage's loader
+        if INSTRUMENT:
+            from instrument import attach_instrumentation
+            attach_instrumentation(model)
+        if DEDUP_CHECKPOINTS:
+            from ckpt_store import attach_store
+            attach_store(model, synced=bool(SYNC_DIR))  # save_period snapshots → deduplicated store, off the training thread
+        if SYNC_DIR:
+            from run_sync import attach_syncer
+            sync = attach_syncer(model, SYNC_DIR)  # mirrors last.pt etc. while training runs
         
         print("\n🚀 เริ่ม Training...")
         print("=" * 60)
@@ -107,16 +367,16 @@ def start_training(dataset_path: str, resume: bool = False):
         results = model.train(
             data=data_yaml,
             epochs=EPOCHS,
-            batch=BATCH_SIZE,
+            batch=plan["batch"],
             imgsz=IMAGE_SIZE,
             device=DEVICE,
-            project=PROJECT_NAME,
+            project=os.path.abspath(PROJECT_NAME),  # relative paths would land under Ultralytics' runs_dir
             name=RUN_NAME,
             patience=PATIENCE,
-            workers=WORKERS,
-            cache=CACHE,
+            workers=workers,
             amp=AMP,
             resume=resume,
+            **overrides,
             
             # Additional settings
             save=True,           # Save checkpoints
@@ -134,6 +394,8 @@ def start_training(dataset_path: str, resume: bool = False):
         print(f"   Best Model: {results.save_dir}/weights/best.pt")
         print(f"   Last Model: {results.save_dir}/weights/last.pt")
         print(f"   Results:    {results.save_dir}")
+
+        post_training(f"{results.save_dir}/weights/best.pt", dataset_path, teacher)
         
         return True
         
@@ -145,6 +407,11 @@ def start_training(dataset_path: str, resume: bool = False):
     except Exception as e:
         print(f"\n❌ เกิดข้อผิดพลาด: {str(e)}")
         return False
+        
+    finally:
+        # Final sync round so the durable copy has the latest last.pt, even after Ctrl+C
+        if sync["syncer"]:
+            sync["syncer"].stop()
 
 def validate_model(model_path: str, dataset_path: str):
     """
@@ -0,0 +1,370 @@
+"""
+Validation Sweep Module
+Scores many checkpoints on the val split: images are letterboxed once, raw predictions are
+cached per checkpoint, and mAP is computed by a vectorized matcher over the whole split
+"""
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+# =============================================================================
+# VALIDATION SWEEP CONFIGURATION
+# =============================================================================
+
+CACHE_DIRNAME = ".val_cache"    # โฟลเดอร์ cache (อยู่ใน dataset)
+VAL_BATCH = 16                  # batch size ตอน inference
+PRED_CONF = 0.001               # เก็บ candidate ที่ score >= ค่านี้ (ค่าเดียวกับ model.val)
+MAX_CANDIDATES = 30000          # candidate สูงสุดต่อภาพก่อน NMS (เหมือน max_nms ของ Ultralytics)
+CONF = 0.001                    # confidence threshold ตอนให้คะแนน (เปลี่ยนได้โดยไม่ต้อง inference ใหม่)
+NMS_IOU = 0.7                   # NMS IoU threshold (เปลี่ยนได้โดยไม่ต้อง inference ใหม่)
+MAX_DET = 300                   # detection สูงสุดต่อภาพหลัง NMS
+RESULTS_FILE = "val_sweep.json" # ผลลัพธ์ (อยู่ใน RUNS_DIR)
+
+# =============================================================================
+
+IOU_THRESHOLDS = np.linspace(0.5, 0.95, 10)
+_trapezoid = getattr(np, "trapezoid", None) or np.trapz  # numpy < 2.0
+
+def letterbox(im: np.ndarray, imgsz: int) -> tuple[np.ndarray, tuple]:
+    """
+    Resize and pad a BGR image onto a square imgsz canvas (same padding value as Ultralytics)
+
+    Returns:
+        Tuple of (canvas, (ratio, left pad, top pad))
+    """
+    import cv2
+
+    h0, w0 = im.shape[:2]
+    r = min(imgsz / h0, imgsz / w0)
+    w, h = round(w0 * r), round(h0 * r)
+    if (w, h) != (w0, h0):
+        im = cv2.resize(im, (w, h), interpolation=cv2.INTER_LINEAR)
+    top, left = (imgsz - h) // 2, (imgsz - w) // 2
+    canvas = np.full((imgsz, imgsz, 3), 114, dtype=np.uint8)
+    canvas[top:top + h, left:left + w] = im
+    return canvas, (r, left, top)
+
+def _letterbox(args: tuple[str, int]) -> tuple[np.ndarray, tuple, tuple]:
+    """Decode and letterbox one image file"""
+    import cv2
+
+    path, imgsz = args
+    im = cv2.imread(path)
+    if im is None:
+        raise FileNotFoundError(f"อ่านภาพไม่ได้: {path}")
+    canvas, ratio_pad = letterbox(im, imgsz)
+    return canvas, im.shape[:2], ratio_pad
+
+class ValCache:
+    """
+    Letterboxed val images (uint8 memmap) plus original shapes and ground truth
+
+    Built once per val split and imgsz; shared by every checkpoint that is scored.
+    """
+
+    def __init__(self, cache_dir: str):
+        self.dir = Path(cache_dir)
+        meta = json.loads((self.dir / "meta.json").read_text(encoding="utf-8"))
+        self.files = meta["files"]
+        self.imgsz = meta["imgsz"]
+        self.names = meta["names"]
+        self.images = np.load(self.dir / "images.npy", mmap_mode="r")
+        arrays = np.load(self.dir / "meta.npz")
+        self.shapes, self.ratio_pad = arrays["shapes"], arrays["ratio_pad"]
+        self.gt_image, self.gt_cls, self.gt_boxes = arrays["gt_image"], arrays["gt_cls"], arrays["gt_boxes"]
+
+    @property
+    def nc(self) -> int:
+        return len(self.names)
+
+    @classmethod
+    def build(cls, data_yaml: str, imgsz: int, workers: int | None = None) -> "ValCache":
+        """Create the cache for the val split of data_yaml (no-op if it already exists)"""
+        from numpy.lib.format import open_memmap
+        from ultralytics.data.utils import check_det_dataset
+        from cache_store import store_key
+        from label_index import build_dataset_index
+        from train import get_split_paths, list_image_files
+
+        img_path = get_split_paths(data_yaml)["val"]
+        files = list_image_files(img_path)
+        cache_dir = Path(data_yaml).parent / CACHE_DIRNAME / store_key(files, imgsz)
+        if (cache_dir / "meta.json").exists():
+            return cls(str(cache_dir))
+
+        print(f"🧊 เตรียม val cache: {len(files)} ภาพ @ {imgsz}px (ทำครั้งเดียว)")
+        tmp = cache_dir.with_name(cache_dir.name + ".tmp")
+        tmp.mkdir(parents=True, exist_ok=True)
+        images = open_memmap(tmp / "images.npy", mode="w+", dtype=np.uint8, shape=(len(files), imgsz, imgsz, 3))
+        shapes = np.zeros((len(files), 2), dtype=np.float32)
+        ratio_pad = np.zeros((len(files), 3), dtype=np.float32)
+        with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+            for i, (im, shape, rp) in enumerate(pool.map(_letterbox, [(f, imgsz) for f in files])):
+                images[i], shapes[i], ratio_pad[i] = im, shape, rp
+        images.flush()
+        del images
+
+        # Ground truth from the label index (normalized xywh) → pixel xyxy of the original image
+        index = build_dataset_index(data_yaml)["val"]
+        counts = index.boxes_per_image()
+        gt_image = np.repeat(np.arange(len(files)), counts).astype(np.int32)
+        xywh = np.asarray(index.boxes, dtype=np.float32)
+        h0, w0 = shapes[gt_image, 0], shapes[gt_image, 1]
+        gt_boxes = np.stack([(xywh[:, 0] - xywh[:, 2] / 2) * w0, (xywh[:, 1] - xywh[:, 3] / 2) * h0,
+                             (xywh[:, 0] + xywh[:, 2] / 2) * w0, (xywh[:, 1] + xywh[:, 3] / 2) * h0], 1)
+        np.savez(tmp / "meta.npz", shapes=shapes, ratio_pad=ratio_pad, gt_image=gt_image,
+                 gt_cls=np.asarray(index.classes, dtype=np.int32), gt_boxes=gt_boxes.astype(np.float32))
+
+        names = check_det_dataset(data_yaml)["names"]
+        (tmp / "meta.json").write_text(json.dumps({
+            "files": files, "imgsz": imgsz, "names": [names[k] for k in sorted(names)],
+        }), encoding="utf-8")
+        os.replace(tmp, cache_dir)
+        return cls(str(cache_dir))
+
+def predict_checkpoint(path: str, cache: ValCache, batch: int = VAL_BATCH) -> dict:
+    """
+    Run one checkpoint over the cached val images and keep every pre-NMS candidate >= PRED_CONF
+
+    Candidates are stored in original-image pixels, so NMS and scoring can be redone
+    for any confidence / IoU threshold without running the model again.
+
+    Returns:
+        Dict of arrays: image, boxes (xyxy), score, cls
+    """
+    import torch
+    from ultralytics import YOLO
+
+    model = YOLO(path).model.float().fuse().eval()
+    out = {"image": [], "boxes": [], "score": [], "cls": []}
+    with torch.inference_mode():
+        for start in range(0, len(cache.files), batch):
+            x = torch.from_numpy(np.ascontiguousarray(cache.images[start:start + batch][..., ::-1]))
+            x = x.permute(0, 3, 1, 2).float().div_(255)
+            y = model(x)
+            y = (y[0] if isinstance(y, (list, tuple)) else y).float()  # (B, 4 + nc, anchors)
+            for b in range(y.shape[0]):
+                i = start + b
+                pred = y[b].T
+                scores = pred[:, 4:4 + cache.nc]
+                anchor, cls = (scores >= PRED_CONF).nonzero(as_tuple=True)  # multi-label, as model.val
+                score = scores[anchor, cls]
+                if len(score) > MAX_CANDIDATES:
+                    score, keep = score.topk(MAX_CANDIDATES)
+                    anchor, cls = anchor[keep], cls[keep]
+                xywh = pred[anchor, :4]
+                r, left, top = cache.ratio_pad[i]
+                h0, w0 = cache.shapes[i]
+                boxes = torch.cat([xywh[:, :2] - xywh[:, 2:] / 2, xywh[:, :2] + xywh[:, 2:] / 2], 1)
+                boxes -= torch.tensor([left, top, left, top])
+                boxes /= float(r)
+                boxes[:, 0::2] = boxes[:, 0::2].clamp(0, float(w0))
+                boxes[:, 1::2] = boxes[:, 1::2].clamp(0, float(h0))
+                out["image"].append(np.full(len(score), i, dtype=np.int32))
+                out["boxes"].append(boxes.numpy())
+                out["score"].append(score.numpy())
+                out["cls"].append(cls.numpy().astype(np.int16))
+    return {k: np.concatenate(v) if v else np.zeros(0) for k, v in out.items()}
+
+def cached_predictions(path: str, file_hash: str, cache: ValCache) -> dict:
+    """Predictions of a checkpoint, loaded from the cache when its content hash was scored before"""
+    pred_path = cache.dir / "preds" / f"{file_hash}_{PRED_CONF:g}.npz"
+    if pred_path.exists():
+        with np.load(pred_path) as data:
+            return dict(data)
+
+    # Checkpoints kept in the checkpoint store are rebuilt to a temporary file for loading
+    from ckpt_store import REF_SUFFIX, materialize
+    if str(path).endswith(REF_SUFFIX):
+        with tempfile.TemporaryDirectory() as tmp:
+            preds = predict_checkpoint(materialize(path, os.path.join(tmp, Path(path).stem + ".pt")), cache)
+    else:
+        preds = predict_checkpoint(path, cache)
+
+    pred_path.parent.mkdir(exist_ok=True)
+    tmp_npz = pred_path.with_name(pred_path.stem + ".tmp.npz")
+    np.savez(tmp_npz, **preds)
+    os.replace(tmp_npz, pred_path)
+    return preds
+
+def nms(preds: dict, conf: float = CONF, iou: float = NMS_IOU, max_det: int = MAX_DET) -> dict:
+    """
+    Class-aware NMS for every image of the split in a single batched call
+
+    Returns:
+        Kept predictions (same keys), sorted by image then score
+    """
+    import torch
+    import torchvision
+
+    keep = preds["score"] >= conf
+    p = {k: v[keep] for k, v in preds.items()}
+    if not len(p["score"]):
+        return p
+    groups = p["image"].astype(np.int64) * (int(p["cls"].max()) + 1) + p["cls"]
+    idx = torchvision.ops.batched_nms(torch.from_numpy(p["boxes"]), torch.from_numpy(p["score"]),
+                                      torch.from_numpy(groups), iou).numpy()
+    # batched_nms returns score order; a stable sort by image keeps that order inside each image
+    idx = idx[np.argsort(p["image"][idx], kind="stable")]
+    image = p["image"][idx]
+    first = np.searchsorted(image, image, side="left")
+    idx = idx[np.arange(len(idx)) - first < max_det]
+    return {k: v[idx] for k, v in p.items()}
+
+def box_iou_pairs(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """IoU of box pairs a[i], b[i] (xyxy)"""
+    lt = np.maximum(a[:, :2], b[:, :2])
+    rb = np.minimum(a[:, 2:], b[:, 2:])
+    inter = np.clip(rb - lt, 0, None).prod(1)
+    area_a = (a[:, 2:] - a[:, :2]).prod(1)
+    area_b = (b[:, 2:] - b[:, :2]).prod(1)
+    return inter / (area_a + area_b - inter + 1e-7)
+
+def match(preds: dict, cache: ValCache) -> np.ndarray:
+    """
+    True-positive matrix (num predictions × 10 IoU thresholds) for the whole split at once
+
+    Every same-image, same-class (prediction, ground truth) pair is formed with one join.
+    Per threshold each prediction keeps its best-IoU pair, then each ground truth goes to the
+    highest-scoring prediction (the same rule as Ultralytics' match_predictions).
+    """
+    n = len(preds["score"])
+    tp = np.zeros((n, len(IOU_THRESHOLDS)), dtype=bool)
+    if not n or not len(cache.gt_cls):
+        return tp
+
+    # Join on (image, class): sort ground truth by key, then expand each prediction to its key's range
+    gt_key = cache.gt_image.astype(np.int64) * (cache.nc + 1) + cache.gt_cls
+    order = np.argsort(gt_key, kind="stable")
+    sorted_key = gt_key[order]
+    pred_key = preds["image"].astype(np.int64) * (cache.nc + 1) + preds["cls"]
+    lo = np.searchsorted(sorted_key, pred_key, side="left")
+    hi = np.searchsorted(sorted_key, pred_key, side="right")
+    counts = hi - lo
+    pi = np.repeat(np.arange(n), counts)
+    gi = order[np.repeat(lo, counts) + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)]
+    iou = box_iou_pairs(preds["boxes"][pi], cache.gt_boxes[gi])
+
+    by_iou = np.argsort(-iou, kind="stable")
+    pi, gi, iou = pi[by_iou], gi[by_iou], iou[by_iou]
+    for t, threshold in enumerate(IOU_THRESHOLDS):
+        ok = iou >= threshold
+        p, g = pi[ok], gi[ok]
+        first_p = np.unique(p, return_index=True)[1]  # best IoU per prediction, now in prediction order
+        p, g = p[first_p], g[first_p]
+        first_g = np.unique(g, return_index=True)[1]  # highest-scoring prediction per ground truth
+        tp[p[first_g], t] = True
+    return tp
+
+def average_precision(tp: np.ndarray, score: np.ndarray, pred_cls: np.ndarray, gt_cls: np.ndarray,
+                      nc: int) -> np.ndarray:
+    """
+    AP per class and IoU threshold (101-point interpolation, as Ultralytics)
+
+    Returns:
+        Array (classes present in ground truth × 10)
+    """
+    order = np.argsort(-score, kind="stable")
+    tp, pred_cls = tp[order], pred_cls[order]
+    x = np.linspace(0, 1, 101)
+    ap = []
+    for c in range(nc):
+        n_gt = int((gt_cls == c).sum())
+        if n_gt == 0:
+            continue
+        hits = tp[pred_cls == c]
+        if not len(hits):
+            ap.append(np.zeros(tp.shape[1]))
+            continue
+        tpc = np.cumsum(hits, 0)
+        fpc = np.cumsum(~hits, 0)
+        recall = tpc / n_gt
+        precision = tpc / (tpc + fpc)
+        row = []
+        for t in range(tp.shape[1]):
+            # Precision drops to 0 right after the highest recall reached (no extrapolation)
+            mrec = np.concatenate(([0.0], recall[:, t], recall[-1:, t], [1.0]))
+            mpre = np.concatenate(([1.0], precision[:, t], [0.0], [0.0]))
+            mpre = np.flip(np.maximum.accumulate(np.flip(mpre)))
+            row.append(_trapezoid(np.interp(x, mrec, mpre), x))
+        ap.append(row)
+    return np.array(ap).reshape(-1, tp.shape[1])
+
+def score(preds: dict, cache: ValCache, conf: float = CONF, iou: float = NMS_IOU) -> dict:
+    """
+    mAP50 / mAP50-95 of cached predictions at a given confidence and NMS IoU
+
+    Returns:
+        Dict with map50, map, precision and recall (at IoU 0.5, over the kept detections)
+    """
+    kept = nms(preds, conf, iou)
+    tp = match(kept, cache)
+    ap = average_precision(tp, kept["score"], kept["cls"], cache.gt_cls, cache.nc)
+    n_tp = int(tp[:, 0].sum())
+    return {
+        "map50": float(ap[:, 0].mean()) if len(ap) else 0.0,
+        "map": float(ap.mean()) if len(ap) else 0.0,
+        "precision": n_tp / max(len(tp), 1),
+        "recall": n_tp / max(len(cache.gt_cls), 1),
+        "detections": len(tp),
+    }
+
+def sweep_checkpoints(dataset_path: str, checkpoints: list[dict] | None = None, imgsz: int | None = None,
+                      conf: float = CONF, iou: float = NMS_IOU) -> list[dict]:
+    """
+    Score checkpoints on the val split, reusing the val cache and cached predictions
+
+    Args:
+        dataset_path: Dataset directory
+        checkpoints: Rows from resume.list_checkpoints() (default: all of them)
+        imgsz: Validation image size (default: IMAGE_SIZE from train.py)
+        conf: Confidence threshold for scoring
+        iou: NMS IoU threshold for scoring
+
+    Returns:
+        One row per checkpoint, best mAP50-95 first
+    """
+    from resume import RUNS_DIR, list_checkpoints
+    from train import IMAGE_SIZE, get_data_yaml
+
+    cache = ValCache.build(get_data_yaml(dataset_path), imgsz or IMAGE_SIZE)
+    checkpoints = list_checkpoints() if checkpoints is None else checkpoints
+    rows, seen = [], {}
+    for ckpt in checkpoints:
+        t0 = time.perf_counter()
+        key = ckpt["file_hash"]
+        if key not in seen:  # identical content (e.g. last.pt == best.pt) is scored once
+            seen[key] = score(cached_predictions(ckpt["path"], key, cache), cache, conf, iou)
+        rows.append({"run": ckpt["run"], "file": ckpt["file"], "path": ckpt["path"], "epoch": ckpt["epoch"],
+                     "file_hash": key, **seen[key], "seconds": round(time.perf_counter() - t0, 3)})
+        print(f"   {ckpt['run']:<20} {ckpt['file']:<14} mAP50={seen[key]['map50']:.4f} "
+              f"mAP50-95={seen[key]['map']:.4f} ({rows[-1]['seconds']:.2f}s)")
+
+    rows.sort(key=lambda r: -r["map"])
+    out = Path(RUNS_DIR) / RESULTS_FILE
+    out.write_text(json.dumps({"conf": conf, "iou": iou, "imgsz": cache.imgsz, "results": rows}, indent=2),
+                   encoding="utf-8")
+    return rows
+
+if __name__ == "__main__":
+    # python val_sweep.py <dataset_path> [conf] [nms_iou]
+    import sys
+
+    print("=" * 60)
+    print("       Validation Sweep")
+    print("=" * 60)
+
+    if len(sys.argv) < 2:
+        print("Usage: python val_sweep.py <dataset_path> [conf] [nms_iou]")
+        sys.exit(1)
+
+    conf = float(sys.argv[2]) if len(sys.argv) > 2 else CONF
+    iou = float(sys.argv[3]) if len(sys.argv) > 3 else NMS_IOU
+    results = sweep_checkpoints(sys.argv[1], conf=conf, iou=iou)
+    if results:
+        print(f"\n🏆 Best: {results[0]['path']} (mAP50-95 {results[0]['map']:.4f}, mAP50 {results[0]['map50']:.4f})")